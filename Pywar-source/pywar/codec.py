@@ -0,0 +1,276 @@
+"""Codecs of the turn requests sent to the slaves, and of the turn results they send back.
+
+JSON is the default, and is easy to debug. The binary codec packs game views in
+the tiles wire format, and commands, by fixed struct schemas. The slave answers
+every request in the codec it was given in, which HTTP requests name by their
+Content-Type and frames by the codec ID.
+"""
+import json
+import struct
+
+# The schema of the binary codec refers to piece types and command names by
+# their index in these lists, so new ones must be appended. They match
+# engine.TYPE_TO_CLASS and commands.COMMAND_NAME_TO_CLASS.
+PIECE_TYPES = [
+    'tank',
+    'airplane',
+    'artillery',
+    'helicopter',
+    'antitank',
+    'irondome',
+    'bunker',
+    'spy',
+    'tower',
+    'satelite',
+    'builder',
+]
+COMMAND_NAMES = [
+    'meleeAttack',
+    'takeOff',
+    'land',
+    'turnOnProtection',
+    'turnOffProtection',
+    'move',
+    'remoteAttack',
+    'takeMoney',
+    'throwMoney',
+    'build',
+]
+NO_COUNTRY = -1
+UNKNOWN_MONEY = -1
+
+# delta, width, height, my country index
+REQUEST_HEADER = struct.Struct('>?HHh')
+COUNT = struct.Struct('>I')
+STRING_LENGTH = struct.Struct('>H')
+# x, y, money, country index, pieces count
+TILE = struct.Struct('>HHihH')
+# id, type index, country index, flags
+PIECE = struct.Struct('>IBhB')
+INT = struct.Struct('>i')
+# name index, piece ID
+COMMAND = struct.Struct('>BI')
+COORDINATES = struct.Struct('>HH')
+
+# Flags of optional piece fields, followed by an INT for the ones marked with a value.
+FLAG_IN_AIR_KNOWN = 1
+FLAG_IN_AIR = 2
+FLAG_TIME_IN_AIR = 4  # value
+FLAG_IS_DEFENDING_KNOWN = 8
+FLAG_IS_DEFENDING = 16
+FLAG_MONEY = 32  # value
+
+
+class CodecError(ValueError):
+    pass
+
+
+class JsonCodec(object):
+    name = 'json'
+    codec_id = 0
+    content_type = 'application/json'
+
+    def encode_tiles(self, tile_dicts, all_countries):
+        return [json.dumps(tile_dict) for tile_dict in tile_dicts]
+
+    def encode_turn_request(self, view_fields, encoded_tiles):
+        """Returns a turn request made of the given view fields and encoded tiles."""
+        encoded_fields = json.dumps(view_fields)
+        return '{{"tiles": [{}], {}'.format(', '.join(encoded_tiles), encoded_fields[1:]).encode('utf8')
+
+    def decode_turn_request(self, data):
+        return json.loads(data.decode('utf8'))
+
+    def encode_turn_result(self, command_dicts):
+        return json.dumps(command_dicts).encode('utf8')
+
+    def decode_turn_result(self, data):
+        return json.loads(data.decode('utf8'))
+
+
+def _encode_string(value):
+    encoded = value.encode('utf8')
+    return STRING_LENGTH.pack(len(encoded)) + encoded
+
+
+def _decode_string(data, offset):
+    length, = STRING_LENGTH.unpack_from(data, offset)
+    offset += STRING_LENGTH.size
+    return data[offset:offset + length].decode('utf8'), offset + length
+
+
+def _encode_coordinates(coordinates_dict):
+    return COORDINATES.pack(coordinates_dict['x'], coordinates_dict['y'])
+
+
+def _coordinates_dict(data, offset):
+    x, y = COORDINATES.unpack_from(data, offset)
+    return {'x': x, 'y': y}
+
+
+class BinaryCodec(object):
+    name = 'binary'
+    codec_id = 1
+    content_type = 'application/x-pywar-binary'
+
+    def __init__(self):
+        super(BinaryCodec, self).__init__()
+        self._piece_type_index = {piece_type: i for i, piece_type in enumerate(PIECE_TYPES)}
+        self._command_name_index = {name: i for i, name in enumerate(COMMAND_NAMES)}
+
+    def _encode_piece(self, piece_dict, country_index):
+        flags = 0
+        values = []
+        if 'inAir' in piece_dict:
+            flags |= FLAG_IN_AIR_KNOWN | (FLAG_IN_AIR if piece_dict['inAir'] else 0)
+        if 'timeInAir' in piece_dict:
+            flags |= FLAG_TIME_IN_AIR
+            values.append(piece_dict['timeInAir'])
+        if 'isDefending' in piece_dict:
+            flags |= FLAG_IS_DEFENDING_KNOWN | (FLAG_IS_DEFENDING if piece_dict['isDefending'] else 0)
+        if 'money' in piece_dict:
+            flags |= FLAG_MONEY
+            values.append(piece_dict['money'])
+        try:
+            header = PIECE.pack(piece_dict['id'], self._piece_type_index[piece_dict['type']],
+                                country_index[piece_dict['country']], flags)
+        except (KeyError, struct.error) as e:
+            raise CodecError('Cannot encode piece {}: {}'.format(piece_dict, e))
+        return header + b''.join(INT.pack(value) for value in values)
+
+    def _encode_tile(self, tile_dict, country_index):
+        money = tile_dict['money']
+        coordinates = tile_dict['coordinate']
+        header = TILE.pack(coordinates['x'], coordinates['y'], UNKNOWN_MONEY if money is None else money,
+                           country_index[tile_dict['country']], len(tile_dict['pieces']))
+        return header + b''.join(self._encode_piece(piece_dict, country_index) for piece_dict in tile_dict['pieces'])
+
+    def encode_tiles(self, tile_dicts, all_countries):
+        """Returns the encodings of tile dicts, as returned by engine.LandTile.to_dict_as_seen_by."""
+        country_index = {country: i for i, country in enumerate(all_countries)}
+        country_index[None] = NO_COUNTRY
+        return [self._encode_tile(tile_dict, country_index) for tile_dict in tile_dicts]
+
+    def encode_turn_request(self, view_fields, encoded_tiles):
+        """Returns a turn request made of the given view fields and encoded tiles.
+
+        The tiles must be encoded by encode_tiles with the same list of countries.
+        """
+        all_countries = view_fields['all_countries']
+        parts = [REQUEST_HEADER.pack(view_fields.get('delta', False), view_fields['width'], view_fields['height'],
+                                     all_countries.index(view_fields['country'])),
+                 COUNT.pack(len(all_countries))]
+        parts.extend(_encode_string(country) for country in all_countries)
+        parts.append(COUNT.pack(len(encoded_tiles)))
+        parts.extend(encoded_tiles)
+        return b''.join(parts)
+
+    def _decode_piece(self, data, offset, all_countries):
+        piece_id, type_index, country_index, flags = PIECE.unpack_from(data, offset)
+        offset += PIECE.size
+        piece_dict = {'id': piece_id, 'type': PIECE_TYPES[type_index], 'country': all_countries[country_index]}
+        if flags & FLAG_IN_AIR_KNOWN:
+            piece_dict['inAir'] = bool(flags & FLAG_IN_AIR)
+        if flags & FLAG_TIME_IN_AIR:
+            piece_dict['timeInAir'], = INT.unpack_from(data, offset)
+            offset += INT.size
+        if flags & FLAG_IS_DEFENDING_KNOWN:
+            piece_dict['isDefending'] = bool(flags & FLAG_IS_DEFENDING)
+        if flags & FLAG_MONEY:
+            piece_dict['money'], = INT.unpack_from(data, offset)
+            offset += INT.size
+        return piece_dict, offset
+
+    def decode_turn_request(self, data):
+        try:
+            delta, width, height, my_country_index = REQUEST_HEADER.unpack_from(data, 0)
+            offset = REQUEST_HEADER.size
+            countries_count, = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+            all_countries = []
+            for _ in range(countries_count):
+                country, offset = _decode_string(data, offset)
+                all_countries.append(country)
+            tiles_count, = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+            tiles = []
+            for _ in range(tiles_count):
+                x, y, money, country_index, pieces_count = TILE.unpack_from(data, offset)
+                offset += TILE.size
+                pieces = []
+                for _ in range(pieces_count):
+                    piece_dict, offset = self._decode_piece(data, offset, all_countries)
+                    pieces.append(piece_dict)
+                tiles.append({
+                    'coordinate': {'x': x, 'y': y},
+                    'money': None if money == UNKNOWN_MONEY else money,
+                    'country': None if country_index == NO_COUNTRY else all_countries[country_index],
+                    'pieces': pieces,
+                })
+        except (struct.error, IndexError) as e:
+            raise CodecError('Malformed turn request: {}'.format(e))
+        turn_data = {
+            'tiles': tiles,
+            'country': all_countries[my_country_index],
+            'all_countries': all_countries,
+            'width': width,
+            'height': height,
+        }
+        if delta:
+            turn_data['delta'] = True
+        return turn_data
+
+    def encode_turn_result(self, command_dicts):
+        parts = [COUNT.pack(len(command_dicts))]
+        for command_dict in command_dicts:
+            name = command_dict['name']
+            try:
+                parts.append(COMMAND.pack(self._command_name_index[name], command_dict['pieceId']))
+                if name == 'move':
+                    parts.append(_encode_coordinates(command_dict['newLocation']))
+                elif name == 'remoteAttack':
+                    parts.append(_encode_coordinates(command_dict['destination']))
+                elif name in ('takeMoney', 'throwMoney'):
+                    parts.append(INT.pack(command_dict['amount']))
+                elif name == 'build':
+                    parts.append(bytes([self._piece_type_index[command_dict['newPieceType']]]))
+            except (KeyError, TypeError, struct.error) as e:
+                raise CodecError('Cannot encode command {}: {}'.format(command_dict, e))
+        return b''.join(parts)
+
+    def decode_turn_result(self, data):
+        try:
+            count, = COUNT.unpack_from(data, 0)
+            offset = COUNT.size
+            command_dicts = []
+            for _ in range(count):
+                name_index, piece_id = COMMAND.unpack_from(data, offset)
+                offset += COMMAND.size
+                name = COMMAND_NAMES[name_index]
+                command_dict = {'name': name, 'pieceId': piece_id}
+                if name == 'move':
+                    command_dict['newLocation'] = _coordinates_dict(data, offset)
+                    offset += COORDINATES.size
+                elif name == 'remoteAttack':
+                    command_dict['destination'] = _coordinates_dict(data, offset)
+                    offset += COORDINATES.size
+                elif name in ('takeMoney', 'throwMoney'):
+                    command_dict['amount'], = INT.unpack_from(data, offset)
+                    offset += INT.size
+                elif name == 'build':
+                    command_dict['newPieceType'] = PIECE_TYPES[data[offset]]
+                    offset += 1
+                command_dicts.append(command_dict)
+        except (struct.error, IndexError) as e:
+            raise CodecError('Malformed turn result: {}'.format(e))
+        return command_dicts
+
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+# dict: codec name -> codec
+CODECS = {codec.name: codec for codec in (JSON, BINARY)}
+# dict: codec ID -> codec
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+# dict: content type -> codec
+CODECS_BY_CONTENT_TYPE = {codec.content_type: codec for codec in CODECS.values()}
@@ -0,0 +1,87 @@
+"""Benchmarks the codecs of turn requests and results against each other, on random maps of several sizes."""
+import argparse
+import itertools
+import timeit
+
+from common_types import Coordinates
+import codec
+import commands
+import engine
+
+PIECE_CLASSES = [engine.Tank, engine.Builder, engine.Artillery, engine.Airplane, engine.IronDome, engine.Spy]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks the PyWar turn codecs.')
+    parser.add_argument('-s', '--sizes', metavar='SIZE', type=int, nargs='+', default=[10, 50, 100, 200],
+                        help='Widths of the square maps to benchmark.')
+    parser.add_argument('-r', '--repeat', metavar='NUM', type=int, default=5,
+                        help='Amount of times to repeat each measurement, of which the best is reported.')
+    return parser.parse_args()
+
+
+def create_game(size):
+    """Creates a game with four countries and a piece in about every tenth tile."""
+    game = engine.Game(size, size, seed=size)
+    countries = [game.add_country('country {}'.format(i)) for i in range(4)]
+    for tile in itertools.chain.from_iterable(game.tiles):
+        x, y = tile.coordinates
+        tile.country = countries[(x >= size // 2) * 2 + (y >= size // 2)]
+        tile.money = game.random.randrange(100)
+        if game.random.random() < 0.1:
+            game.random.choice(PIECE_CLASSES)(game, tile, tile.country)
+    game.apply_turn({})
+    return game, countries[0]
+
+
+def create_commands(game, country):
+    """Returns commands for all pieces of the given country."""
+    command_dicts = []
+    for piece in country.pieces:
+        destination = Coordinates(piece.tile.coordinates.x, min(piece.tile.coordinates.y + 1, game.height - 1))
+        command = game.random.choice([commands.MoveCommand(piece.id, destination),
+                                      commands.RemoteAttackCommand(piece.id, destination),
+                                      commands.TakeMoneyCommand(piece.id, 5),
+                                      commands.BuildPieceCommand(piece.id, 'tank'),
+                                      commands.MeleeAttackCommand(piece.id)])
+        command_dicts.append(command.to_dict())
+    return command_dicts
+
+
+def measure(repeat, function):
+    """Returns the best time of function, in milliseconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def benchmark(size, repeat):
+    game, country = create_game(size)
+    view = game.to_dict_as_seen_by(country)
+    view_fields = game.view_fields_as_seen_by(country)
+    command_dicts = create_commands(game, country)
+    for turn_codec in codec.CODECS.values():
+        def encode_request():
+            encoded_tiles = turn_codec.encode_tiles(view['tiles'], view['all_countries'])
+            return turn_codec.encode_turn_request(view_fields, encoded_tiles)
+
+        request = encode_request()
+        result = turn_codec.encode_turn_result(command_dicts)
+        print('{:>5}x{:<5} {:>8} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.2f} {:>10.2f}'.format(
+            size, size, turn_codec.name,
+            len(request) / 1024,
+            measure(repeat, encode_request),
+            measure(repeat, lambda: turn_codec.decode_turn_request(request)),
+            len(result) / 1024,
+            measure(repeat, lambda: turn_codec.encode_turn_result(command_dicts)),
+            measure(repeat, lambda: turn_codec.decode_turn_result(result))))
+
+
+def main():
+    args = parse_args()
+    print('{:>11} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'map', 'codec', 'req KiB', 'enc ms', 'dec ms', 'res KiB', 'enc ms', 'dec ms'))
+    for size in args.sizes:
+        benchmark(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import itertools
+import unittest
+
+from common_types import Coordinates
+import codec
+import commands
+import engine
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.game = engine.Game(5, 5)
+        self.country1 = self.game.add_country('country 1')
+        self.country2 = self.game.add_country('country 2')
+        for tile in itertools.chain.from_iterable(self.game.tiles):
+            tile.country = self.country1 if tile.coordinates.x < 3 else self.country2
+            tile.money = tile.coordinates.y
+        engine.Tank(self.game, self.game.tiles[0][0], self.country1)
+        engine.Airplane(self.game, self.game.tiles[0][1], self.country1).take_off()
+        engine.Helicopter(self.game, self.game.tiles[1][1], self.country1)
+        engine.IronDome(self.game, self.game.tiles[1][2], self.country1).turn_on()
+        builder = engine.Builder(self.game, self.game.tiles[2][2], self.country1)
+        builder.money = 7
+        engine.Tank(self.game, self.game.tiles[3][2], self.country2)
+        self.game.apply_turn({})
+
+    def encode_turn_request(self, turn_codec, delta=False):
+        view = self.game.to_dict_as_seen_by(self.country1)
+        view_fields = self.game.view_fields_as_seen_by(self.country1)
+        if delta:
+            view_fields['delta'] = True
+        return turn_codec.encode_turn_request(view_fields, turn_codec.encode_tiles(view['tiles'],
+                                                                                   view['all_countries']))
+
+    def test_schema_matches_game(self):
+        self.assertEqual(set(codec.PIECE_TYPES), set(engine.TYPE_TO_CLASS))
+        self.assertEqual(set(codec.COMMAND_NAMES), set(commands.COMMAND_NAME_TO_CLASS))
+
+    def test_binary_turn_request(self):
+        turn_data = codec.BINARY.decode_turn_request(self.encode_turn_request(codec.BINARY))
+        self.assertEqual(turn_data, codec.JSON.decode_turn_request(self.encode_turn_request(codec.JSON)))
+        self.assertEqual(turn_data, self.game.to_dict_as_seen_by(self.country1))
+        self.assertIsNone(turn_data['tiles'][4 * 5 + 4]['money'])
+
+    def test_binary_delta_turn_request(self):
+        turn_data = codec.BINARY.decode_turn_request(self.encode_turn_request(codec.BINARY, delta=True))
+        self.assertTrue(turn_data['delta'])
+
+    def test_binary_turn_result(self):
+        command_dicts = [command.to_dict() for command in [
+            commands.MeleeAttackCommand(1),
+            commands.TakeOffCommand(2),
+            commands.LandCommand(3),
+            commands.TurnOnProtection(4),
+            commands.TurnOffProtection(5),
+            commands.MoveCommand(6, Coordinates(1, 2)),
+            commands.RemoteAttackCommand(7, Coordinates(3, 4)),
+            commands.TakeMoneyCommand(8, 10),
+            commands.ThrowMoneyCommand(9, 20),
+            commands.BuildPieceCommand(10, 'tank'),
+        ]]
+        encoded = codec.BINARY.encode_turn_result(command_dicts)
+        self.assertEqual(codec.BINARY.decode_turn_result(encoded), command_dicts)
+
+    def test_binary_bad_command(self):
+        with self.assertRaises(codec.CodecError):
+            codec.BINARY.encode_turn_result([{'name': 'dance', 'pieceId': 1}])
+        with self.assertRaises(codec.CodecError):
+            codec.BINARY.encode_turn_result([{'name': 'takeMoney', 'pieceId': 1, 'amount': 'a lot'}])
+
+    def test_binary_malformed_data(self):
+        encoded = self.encode_turn_request(codec.BINARY)
+        with self.assertRaises(codec.CodecError):
+            codec.BINARY.decode_turn_request(encoded[:len(encoded) // 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
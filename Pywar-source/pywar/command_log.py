@@ -0,0 +1,136 @@
+"""Command logs, recording only what is needed to play a game again.
+
+Given its initial map and seed, the engine plays a game the same way every
+time, so a command log keeps only those (in the game information) and the
+commands of the countries in every turn, in the order they were applied. Every
+few turns, a hash of the game state is logged as a checkpoint, to detect
+replays that went astray. Turns are reconstructed by playing the game again
+with engine.Game.apply_turn.
+
+A command log is a gzipped file of JSON lines: the game information, followed by
+an entry for every turn.
+"""
+import bisect
+import gzip
+import hashlib
+import json
+
+import engine
+import game_log
+
+# File extension of command logs, by which the master chooses to write one.
+COMMAND_LOG_EXTENSION = '.pwc'
+
+
+def state_hash(state):
+    """Returns a hash of a game state dict, as returned by engine.Game.to_dict.
+
+    Countries and pieces are kept in sets by the engine, so they are sorted to
+    get the same hash for the same state in every process.
+    """
+    canonical_state = dict(state, countries=sorted(state['countries']),
+                           tiles=[[dict(tile_dict, pieces=sorted(tile_dict['pieces'], key=lambda piece: piece['id']))
+                                   for tile_dict in tile_row] for tile_row in state['tiles']])
+    return hashlib.sha256(json.dumps(canonical_state, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class CommandLogWriter(object):
+    def __init__(self, path, keyframe_interval=game_log.KEYFRAME_INTERVAL, expected_turns=0):
+        """Opens a new command log for writing, with the interface of game_log.GameLogWriter.
+
+        A checkpoint is logged every keyframe_interval turns. The game
+        information must have the initial map of the game, and its seed.
+        """
+        super(CommandLogWriter, self).__init__()
+        if keyframe_interval < 1:
+            raise ValueError('The keyframe interval must be positive, not {}'.format(keyframe_interval))
+        self.keyframe_interval = keyframe_interval
+        self._file = gzip.open(path, 'wt', encoding='utf8')
+
+    def _write_line(self, value):
+        self._file.write(json.dumps(value))
+        self._file.write('\n')
+
+    def write_info(self, info):
+        """Writes the dict of information required for reproducing the game."""
+        if 'map' not in info or 'seed' not in info:
+            raise ValueError('Command logs require the initial map and seed of the game')
+        self._write_line(info)
+
+    def capture_turn(self, game, commands_info):
+        """Returns the log entry of the current turn of the game, given the commands of its countries."""
+        entry = {'turn': game.turns, 'commands': commands_info}
+        if game.turns % self.keyframe_interval == 0:
+            entry['hash'] = state_hash(game.to_dict())
+        return entry
+
+    def write_captured_turn(self, captured_turn):
+        """Writes a log entry returned by capture_turn."""
+        self._write_line(captured_turn)
+
+    def write_turn(self, game, commands_info):
+        """Writes the log entry of the current turn of the game, given the commands of its countries."""
+        self.write_captured_turn(self.capture_turn(game, commands_info))
+
+    def close(self):
+        self._file.close()
+
+
+class CommandLogReader(game_log.TurnLogReader):
+    """Reads a command log, playing the game again up to the turns that are read.
+
+    The state of the game is kept every keyframe_interval turns it plays, with
+    its random generator, so a turn before the last one read is played again
+    from the kept state before it. A ValueError is raised if the game reaches a
+    checkpoint in another state than the logged one.
+    """
+
+    def __init__(self, path, keyframe_interval=game_log.KEYFRAME_INTERVAL):
+        with gzip.open(path, 'rt', encoding='utf8') as log_file:
+            self._info = json.loads(log_file.readline())
+            # dict: turn -> log entry
+            self._entries = {entry['turn']: entry for entry in map(json.loads, log_file)}
+        super(CommandLogReader, self).__init__(self._entries)
+        if keyframe_interval < 1:
+            raise ValueError('The keyframe interval must be positive, not {}'.format(keyframe_interval))
+        self.keyframe_interval = keyframe_interval
+        # The game played so far, and the (turn, state dict, random generator state) kept while playing it.
+        self._game = None
+        self._keyframes = []
+
+    def _read_entry(self, turn):
+        return self._entries[turn]
+
+    def get_info(self):
+        return self._info
+
+    def _restore_game(self, turn):
+        """Sets the game to the last kept state before the given turn, if it is not already closer to it."""
+        index = bisect.bisect_right([keyframe_turn for keyframe_turn, _, _ in self._keyframes], turn) - 1
+        if self._game is not None and self._keyframes[index][0] <= self._game.turns <= turn:
+            return
+        keyframe_turn, state, random_state = self._keyframes[index]
+        self._game = engine.game_from_dict(state, seed=self._info['seed'])
+        self._game.random.setstate(random_state)
+        self._game.turns = keyframe_turn
+
+    def _play_turn(self):
+        game = self._game
+        entry = self._entries[game.turns + 1]
+        game.apply_turn({game.get_country(country_name): commands
+                         for country_name, commands in entry['commands'].items()})
+        if 'hash' in entry and state_hash(game.to_dict()) != entry['hash']:
+            raise ValueError('The game played again differs from the log in turn {}'.format(game.turns))
+        if game.turns % self.keyframe_interval == 0 and game.turns > self._keyframes[-1][0]:
+            self._keyframes.append((game.turns, game.to_dict(), game.random.getstate()))
+
+    def get_state(self, turn):
+        if turn not in self._entries:
+            raise KeyError('No turn {} in the command log'.format(turn))
+        if not self._keyframes:
+            initial_game = engine.game_from_dict(self._info['map'], seed=self._info['seed'])
+            self._keyframes.append((0, initial_game.to_dict(), initial_game.random.getstate()))
+        self._restore_game(turn)
+        while self._game.turns < turn:
+            self._play_turn()
+        return self._game.to_dict()
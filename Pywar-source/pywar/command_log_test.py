@@ -0,0 +1,81 @@
+import gzip
+import json
+import unittest
+
+import command_log
+from common_types import Coordinates
+import commands
+import engine
+from game_log_testing import LoggedGameTestCase
+
+
+class TestCommandLog(LoggedGameTestCase):
+    def setUp(self):
+        super(TestCommandLog, self).setUp()
+        self.path = self.get_path(command_log.COMMAND_LOG_EXTENSION)
+
+    def test_read_turns(self):
+        states = self.play_and_log(command_log.CommandLogWriter(self.path, keyframe_interval=2), change_money=False)
+        with command_log.CommandLogReader(self.path, keyframe_interval=3) as reader:
+            self.assertEqual(reader.turns, sorted(states))
+            for turn in [4, 10, 2, 9, 9, 1, 7]:
+                self.assertEqual(command_log.state_hash(reader.get_state(turn)), command_log.state_hash(states[turn]))
+            self.assertEqual(reader.get_commands(1)['country 1'][0]['name'], 'move')
+
+    def test_detects_diverging_games(self):
+        self.play_and_log(command_log.CommandLogWriter(self.path, keyframe_interval=2), turns=4,
+                          change_money=False)
+        with gzip.open(self.path, 'rt', encoding='utf8') as log_file:
+            lines = [json.loads(line) for line in log_file]
+        # The tank doesn't move in turn 2 anymore.
+        lines[2]['commands'] = {}
+        with gzip.open(self.path, 'wt', encoding='utf8') as log_file:
+            log_file.writelines(json.dumps(line) + '\n' for line in lines)
+        with command_log.CommandLogReader(self.path) as reader:
+            reader.get_state(1)
+            with self.assertRaises(ValueError):
+                reader.get_state(4)
+
+    def test_restores_moving_pieces(self):
+        airplane = engine.Airplane(self.game, self.game.tiles[1][1], self.country1)
+        iron_dome = engine.IronDome(self.game, self.game.tiles[1][1], self.country1)
+        # The airplane takes off and the iron dome turns on, so only the airplane can move in turn 3.
+        turns = [
+            [commands.TakeOffCommand(airplane.id), commands.TurnOnProtection(iron_dome.id)],
+            [],
+            [commands.MoveCommand(airplane.id, Coordinates(3, 3)),
+             commands.MoveCommand(iron_dome.id, Coordinates(1, 2))],
+            [],
+        ]
+        # No checkpoint is logged in turn 3.
+        writer = command_log.CommandLogWriter(self.path, keyframe_interval=4)
+        writer.write_info({'seed': self.game.seed, 'map': self.game.to_dict()})
+        states = {}
+        for turn_commands in turns:
+            command_dicts = [command.to_dict() for command in turn_commands]
+            self.game.apply_turn({self.country1: command_dicts})
+            writer.write_turn(self.game, {self.country1.name: command_dicts})
+            states[self.game.turns] = self.game.to_dict()
+        writer.close()
+        self.assertEqual(airplane.tile, self.game.tiles[3][3])
+        self.assertEqual(iron_dome.tile, self.game.tiles[1][1])
+        with command_log.CommandLogReader(self.path, keyframe_interval=2) as reader:
+            # Turn 3 is played again from the game restored from turn 2.
+            for turn in [3, 2, 3]:
+                self.assertEqual(command_log.state_hash(reader.get_state(turn)), command_log.state_hash(states[turn]))
+
+    def test_rejects_non_positive_keyframe_interval(self):
+        with self.assertRaises(ValueError):
+            command_log.CommandLogWriter(self.path, keyframe_interval=0)
+
+    def test_state_hash_ignores_piece_order(self):
+        engine.Builder(self.game, self.tank.tile, self.country1)
+        state = self.game.to_dict()
+        reordered_state = dict(state, tiles=[[dict(tile_dict, pieces=list(reversed(tile_dict['pieces'])))
+                                              for tile_dict in tile_row] for tile_row in state['tiles']])
+        self.assertNotEqual(reordered_state, state)
+        self.assertEqual(command_log.state_hash(reordered_state), command_log.state_hash(state))
+
+
+if __name__ == '__main__':
+    unittest.main()
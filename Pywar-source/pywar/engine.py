@@ -1,9 +1,15 @@
 """pyWar"""
 
-from collections import defaultdict
+from collections import Counter, defaultdict
+import functools
 import itertools
+import json
 import random
-import uuid
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 import commands
 from common_types import Coordinates
@@ -39,16 +45,40 @@ PARTIAL_VISIBILITY = 2
 # This visibility level is applied if the country has a spy on this tile.
 FULL_VISIBILITY = 3
 
+# Maximal amount of tile neighborhoods cached by every game.
+NEIGHBORHOOD_CACHE_SIZE = 16384
+
 
 class Game(object):
-    def __init__(self, width, height):
+    def __init__(self, width, height, visibility_backend='python', next_piece_id=1, seed=None):
+        """Initializes an empty game board.
+
+        visibility_backend selects how visibility levels are computed, and is
+        either 'python' or 'numpy'. The python backend updates the levels by the
+        pieces that changed, while the numpy one computes the whole board every
+        turn, which only pays off when most of the board changes.
+
+        Pieces get increasing integer IDs, starting at next_piece_id.
+
+        seed is the seed of the random generator used for battles. Given the same
+        seed, state and commands, a game always reaches the same results. If seed
+        is None, a random seed is chosen, and is available as the seed attribute.
+        """
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.random = random.Random(seed)
         self.countries = set()
         self.battles_in_queue = defaultdict(list)  # dict: tile -> attackers
         self.tiles = [[LandTile(self, Coordinates(x=x, y=y)) for y in range(height)] for x in range(width)]
         self.width = width
         self.height = height
         self.pieces = {}  # dict: piece ID -> piece
+        self.next_piece_id = next_piece_id
         self.turns = 0
+        self._neighborhoods = functools.lru_cache(maxsize=NEIGHBORHOOD_CACHE_SIZE)(self._compute_neighborhood)
+        self.visibility = VISIBILITY_BACKENDS[visibility_backend](self)
+        self.defender_index = DefenderIndex(self)
 
     def add_country(self, *args, **kwargs):
         country = Country(self, *args, **kwargs)
@@ -61,26 +91,106 @@ class Game(object):
                 return country
         return None
 
-    def get_new_id(self):
-        return str(uuid.uuid4())
+    def _compute_neighborhood(self, coordinates, dist):
+        return tuple(self.tiles[coordinates.x + dx][coordinates.y + dy] for dx, dy in diamond_offsets(dist)
+                     if 0 <= coordinates.x + dx < self.width and 0 <= coordinates.y + dy < self.height)
 
-    def to_dict(self):
+    def get_neighborhood(self, coordinates, dist):
+        """Returns a tuple of all tiles within the given distance of the given coordinates."""
+        return self._neighborhoods(coordinates, dist)
+
+    def get_new_id(self):
+        piece_id = self.next_piece_id
+        self.next_piece_id += 1
+        return piece_id
+
+    def reserve_id(self, piece_id):
+        """Makes sure the given ID, taken from a previous game state, is never returned by get_new_id."""
+        if piece_id in self.pieces:
+            raise ValueError('Piece ID {} is already in use'.format(piece_id))
+        self.next_piece_id = max(self.next_piece_id, piece_id + 1)
+        return piece_id
+
+    def state_fields(self):
+        """Returns the fields of to_dict(), except for the tiles."""
         return {
             'countries': [country.name for country in self.countries],
-            'tiles': [[tile.to_dict() for tile in tile_row] for tile_row in self.tiles],
             'width': self.width,
             'height': self.height,
+            'nextPieceId': self.next_piece_id,
         }
 
-    def to_dict_as_seen_by(self, country):
+    def to_dict(self):
+        result = self.state_fields()
+        result['tiles'] = [[tile.to_dict() for tile in tile_row] for tile_row in self.tiles]
+        return result
+
+    def to_json(self):
+        """Returns the JSON encoding of to_dict(), reusing the cached encodings of unchanged tiles."""
+        encoded_tiles = '[{}]'.format(', '.join('[{}]'.format(', '.join(tile.to_json() for tile in tile_row))
+                                                for tile_row in self.tiles))
+        return dumps_with_encoded_field(self.state_fields(), 'tiles', encoded_tiles)
+
+    def view_fields_as_seen_by(self, country):
+        """Returns the fields of to_dict_as_seen_by(country), except for the tiles."""
         return {
-            'tiles': [tile.to_dict_as_seen_by(country) for tile in itertools.chain.from_iterable(self.tiles)],
             'country': country.name,
             'all_countries': [c.name for c in self.countries],
             'width': self.width,
             'height': self.height,
         }
 
+    def to_dict_as_seen_by(self, country, columnar=False):
+        """Returns a JSON-like dictionary of the game, as seen by the given country.
+
+        By default, the tiles are given as a list of tile dicts. If columnar is
+        True, the tiles are given as row-major lists of their owners, money and
+        visibility levels, and the visible pieces are given as a separate list.
+        Countries of tiles and pieces are then given by their index in
+        all_countries, or -1 for no country.
+        """
+        if columnar:
+            result = self._to_columnar_dict_as_seen_by(country)
+        else:
+            result = {'tiles': [tile.to_dict_as_seen_by(country)
+                                for tile in itertools.chain.from_iterable(self.tiles)]}
+        result.update(self.view_fields_as_seen_by(country))
+        return result
+
+    def _to_columnar_dict_as_seen_by(self, country):
+        # view_fields_as_seen_by lists the countries in the same order.
+        country_index = {c: i for i, c in enumerate(self.countries)}
+        owners = []
+        money = []
+        visibility_levels = []
+        pieces = []
+        for tile in itertools.chain.from_iterable(self.tiles):
+            visibility = self.visibility.get_level(tile, country)
+            owners.append(country_index.get(tile.country, -1))
+            money.append(tile.money if visibility >= PARTIAL_VISIBILITY else None)
+            visibility_levels.append(visibility)
+            for piece in tile.get_visible_pieces(country, visibility):
+                piece_dict = piece.to_dict()
+                piece_dict['country'] = country_index[piece.country]
+                piece_dict['x'], piece_dict['y'] = tile.coordinates
+                pieces.append(piece_dict)
+        return {
+            'format': 'columnar',
+            'owners': owners,
+            'money': money,
+            'visibility': visibility_levels,
+            'pieces': pieces,
+        }
+
+    def encode_tiles_as_seen_by(self, country):
+        """Returns the list of JSON encoded tiles of to_dict_as_seen_by(country)."""
+        return [tile.to_json_as_seen_by(country) for tile in itertools.chain.from_iterable(self.tiles)]
+
+    def to_json_as_seen_by(self, country):
+        """Returns the JSON encoding of to_dict_as_seen_by(country), reusing the cached encodings of tiles."""
+        encoded_tiles = '[{}]'.format(', '.join(self.encode_tiles_as_seen_by(country)))
+        return dumps_with_encoded_field(self.view_fields_as_seen_by(country), 'tiles', encoded_tiles)
+
     def apply_turn(self, commands_by_country):
         self.turns += 1
         commanded_pieces = set()
@@ -97,42 +207,24 @@ class Game(object):
             except Exception as e:
                 print('Country has an exception, skipping commands: ', e)
         self.perform_battles()
-        country_to_satelite_visible_tiles = defaultdict(set)
-        country_to_visible_tiles = defaultdict(set)
-        country_to_tiles_with_its_own_spies = defaultdict(set)
         for piece in self.pieces.values():
             piece.turn_done()
-            if isinstance(piece, Satelite):
-                country_to_satelite_visible_tiles[piece.country].update(piece.tile.neighbors(SATELITE_SIGHTING_RANGE))
-                continue
-            country_to_visible_tiles[piece.country].add(piece.tile)
-            country_to_visible_tiles[piece.country].update(piece.tile.neighbors())
-            if isinstance(piece, Spy):
-                country_to_tiles_with_its_own_spies[piece.country].add(piece.tile)
-            elif isinstance(piece, Tower):
-                country_to_visible_tiles[piece.country].update(piece.tile.neighbors(TOWER_SIGHTING_RANGE))
-
-        # Set visibility level for each tile per country.
-        for tile in itertools.chain.from_iterable(self.tiles):
-            tile.visibility_level_per_country = {
-                country: FULL_VISIBILITY if tile in country_to_tiles_with_its_own_spies[country] else
-                PARTIAL_VISIBILITY if tile.country is country or tile in country_to_visible_tiles[
-                    country] else NO_VISIBILITY
-                for country in self.countries}
+        self.visibility.refresh()
 
     def perform_battles(self):
         all_battles = []
         for tile, attackers in self.battles_in_queue.items():
-            defenders = tile.get_defenders()
-            passives = tile.pieces.difference(attackers).difference(defenders)
+            # Defenders and passives come from sets, so they are sorted to keep the shuffle reproducible.
+            defenders = sorted(tile.get_defenders(), key=lambda piece: piece.id)
+            passives = sorted(tile.pieces.difference(attackers).difference(defenders), key=lambda piece: piece.id)
             tile_participants = list(itertools.chain(
                 ((piece, ATTACKER_ROLE) for piece in attackers),
                 ((piece, DEFENDER_ROLE) for piece in defenders),
                 ((piece, PASSIVE_ROLE) for piece in passives if not isinstance(piece, (Spy, Satelite, Builder)))))
-            random.shuffle(tile_participants)
+            self.random.shuffle(tile_participants)
             all_battles.append((tile, tile_participants))
         self.battles_in_queue = defaultdict(list)
-        random.shuffle(all_battles)
+        self.random.shuffle(all_battles)
         for tile, participants in all_battles:
             perform_battle_in_tile(tile, participants)
 
@@ -166,6 +258,206 @@ def perform_battle_in_tile(tile, participants):
             piece.kill()
 
 
+class VisibilityTracker(object):
+    """Keeps per-country reference counts of the sighting sources of every tile.
+
+    Pieces register their sightings when they are created, and update them when
+    they move, die or change their country. Tiles report owner changes. Every
+    change marks the affected tiles as dirty, and refresh() recomputes the
+    visibility levels of the dirty tiles only, so the cost of a turn depends on
+    the amount of changes in it rather than on the size of the board.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.visible_tiles = defaultdict(Counter)  # dict: country -> tile -> amount of sighting pieces
+        self.satelite_visible_tiles = defaultdict(Counter)  # dict: country -> tile -> amount of satelites
+        self.tiles_with_own_spies = defaultdict(Counter)  # dict: country -> tile -> amount of spies
+        self._dirty_tiles = set()
+        self._levels = {}  # dict: tile -> country -> visibility level, as of the last refresh
+
+    def _update_piece(self, piece, delta):
+        country = piece.country
+        tile = piece.tile
+        if isinstance(piece, Satelite):
+            counters = [(self.satelite_visible_tiles[country], tile.neighbors(SATELITE_SIGHTING_RANGE))]
+        else:
+            sighting_range = TOWER_SIGHTING_RANGE if isinstance(piece, Tower) else 1
+            counters = [(self.visible_tiles[country], tile.neighbors(sighting_range))]
+            if isinstance(piece, Spy):
+                counters.append((self.tiles_with_own_spies[country], [tile]))
+        for counter, tiles in counters:
+            for sighted_tile in tiles:
+                counter[sighted_tile] += delta
+                if counter[sighted_tile] == 0:
+                    del counter[sighted_tile]
+                self._dirty_tiles.add(sighted_tile)
+
+    def add_piece(self, piece):
+        """Registers the sightings of the given piece, from its current tile."""
+        self._update_piece(piece, 1)
+
+    def remove_piece(self, piece):
+        """Unregisters the sightings of the given piece, from its current tile."""
+        self._update_piece(piece, -1)
+
+    def tile_owner_changed(self, tile):
+        self._dirty_tiles.add(tile)
+
+    def get_level(self, tile, country):
+        """Returns the visibility level of the given tile for the given country, as of the last refresh."""
+        return self._levels.get(tile, {}).get(country, NO_VISIBILITY)
+
+    def get_levels(self, tile):
+        """Returns a dict from country to its visibility level of the given tile, as of the last refresh."""
+        return self._levels.get(tile, {})
+
+    def _current_level(self, tile, country):
+        if self.tiles_with_own_spies[country][tile] > 0:
+            return FULL_VISIBILITY
+        if tile.country is country or self.visible_tiles[country][tile] > 0:
+            return PARTIAL_VISIBILITY
+        return NO_VISIBILITY
+
+    def refresh(self):
+        """Updates the visibility levels of all tiles that changed since the last refresh."""
+        for tile in self._dirty_tiles:
+            self._levels[tile] = {country: self._current_level(tile, country) for country in self.game.countries}
+        self._dirty_tiles = set()
+
+
+class NumpyVisibilityTracker(object):
+    """Computes the visibility levels of all tiles with numpy array operations.
+
+    The tracker keeps per-country grids counting the sighting sources on every
+    tile, grouped by their sighting range, and a grid of tile owners. On
+    refresh(), the sources are expanded to Manhattan diamonds of their range,
+    and the visibility levels are derived from the resulting masks. The levels
+    are identical to the ones computed by VisibilityTracker.
+    """
+
+    def __init__(self, game):
+        if np is None:
+            raise ImportError('numpy is required for the numpy visibility backend')
+        self.game = game
+        self._country_index = {}  # dict: country -> index in the grids
+        self._owners = np.full((game.width, game.height), -1, dtype=np.int32)
+        # Each grid is indexed by [country index, x, y].
+        self._sources = {sighting_range: self._new_grid() for sighting_range in
+                         (1, TOWER_SIGHTING_RANGE, SATELITE_SIGHTING_RANGE)}
+        self._spies = self._new_grid()
+        self._levels = {}  # dict: country -> nested lists of visibility levels, as of the last refresh
+
+    def _new_grid(self):
+        return np.zeros((len(self._country_index), self.game.width, self.game.height), dtype=np.int32)
+
+    def _get_country_index(self, country):
+        index = self._country_index.get(country)
+        if index is None:
+            index = self._country_index[country] = len(self._country_index)
+            empty_layer = np.zeros((1, self.game.width, self.game.height), dtype=np.int32)
+            for sighting_range, grid in self._sources.items():
+                self._sources[sighting_range] = np.concatenate((grid, empty_layer))
+            self._spies = np.concatenate((self._spies, empty_layer))
+        return index
+
+    def _update_piece(self, piece, delta):
+        index = self._get_country_index(piece.country)
+        x, y = piece.tile.coordinates
+        if isinstance(piece, Satelite):
+            self._sources[SATELITE_SIGHTING_RANGE][index, x, y] += delta
+            return
+        self._sources[TOWER_SIGHTING_RANGE if isinstance(piece, Tower) else 1][index, x, y] += delta
+        if isinstance(piece, Spy):
+            self._spies[index, x, y] += delta
+
+    def add_piece(self, piece):
+        self._update_piece(piece, 1)
+
+    def remove_piece(self, piece):
+        self._update_piece(piece, -1)
+
+    def tile_owner_changed(self, tile):
+        x, y = tile.coordinates
+        self._owners[x, y] = -1 if tile.country is None else self._get_country_index(tile.country)
+
+    @staticmethod
+    def _expand(sources, sighting_range):
+        """Returns a mask of all tiles within sighting_range of a positive cell in sources."""
+        result = sources > 0
+        for _ in range(sighting_range):
+            grown = result.copy()
+            grown[:, 1:, :] |= result[:, :-1, :]
+            grown[:, :-1, :] |= result[:, 1:, :]
+            grown[:, :, 1:] |= result[:, :, :-1]
+            grown[:, :, :-1] |= result[:, :, 1:]
+            result = grown
+        return result
+
+    @property
+    def satelite_visibility(self):
+        """A mask of the tiles sighted by satelites, indexed by [country index, x, y]."""
+        return self._expand(self._sources[SATELITE_SIGHTING_RANGE], SATELITE_SIGHTING_RANGE)
+
+    def get_level(self, tile, country):
+        levels = self._levels.get(country)
+        if levels is None:
+            return NO_VISIBILITY
+        return levels[tile.coordinates.x][tile.coordinates.y]
+
+    def get_levels(self, tile):
+        return {country: self.get_level(tile, country) for country in self._levels}
+
+    def refresh(self):
+        for country in self.game.countries:
+            self._get_country_index(country)
+        visible = (self._expand(self._sources[1], 1) |
+                   self._expand(self._sources[TOWER_SIGHTING_RANGE], TOWER_SIGHTING_RANGE))
+        owned = self._owners[np.newaxis, :, :] == np.arange(len(self._country_index))[:, np.newaxis, np.newaxis]
+        levels = np.where(self._spies > 0, FULL_VISIBILITY,
+                          np.where(visible | owned, PARTIAL_VISIBILITY, NO_VISIBILITY))
+        self._levels = {country: levels[self._country_index[country]].tolist() for country in self.game.countries}
+
+
+VISIBILITY_BACKENDS = {
+    'python': VisibilityTracker,
+    'numpy': NumpyVisibilityTracker,
+}
+
+
+class DefenderIndex(object):
+    """Maps every tile to the pieces that can currently defend it.
+
+    Pieces update their entries whenever anything that affects their ability to
+    defend changes, such as moving, attacking or turning on an iron dome, so
+    finding the defenders of a tile does not require scanning its neighborhood.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self._defenders = defaultdict(set)  # dict: tile -> pieces that can defend it
+        self._defended_tiles = {}  # dict: piece -> tiles it is registered as a defender of
+
+    def update(self, piece):
+        """Updates the tiles of which the given piece is registered as a defender."""
+        for tile in self._defended_tiles.pop(piece, ()):
+            defenders = self._defenders[tile]
+            defenders.remove(piece)
+            if not defenders:
+                del self._defenders[tile]
+        if piece.id not in self.game.pieces:
+            return
+        defended_tiles = piece.defended_tiles()
+        if defended_tiles:
+            self._defended_tiles[piece] = defended_tiles
+            for tile in defended_tiles:
+                self._defenders[tile].add(piece)
+
+    def get_defenders(self, tile):
+        """Returns the set of pieces that can currently defend the given tile."""
+        return self._defenders.get(tile, set())
+
+
 class Country(object):
     def __init__(self, game, name):
         self.game = game
@@ -174,6 +466,19 @@ class Country(object):
         self.pieces = set()
 
 
+def dumps_with_encoded_field(fields, name, encoded_value):
+    """Returns the JSON encoding of the fields dict, with an additional first field that is already encoded."""
+    encoded_fields = json.dumps(fields)
+    return '{{{}: {}{}{}'.format(json.dumps(name), encoded_value, ', ' if fields else '', encoded_fields[1:])
+
+
+@functools.lru_cache(maxsize=None)
+def diamond_offsets(dist):
+    """Returns the (dx, dy) offsets of all coordinates within the given distance of (0, 0)."""
+    return tuple((dx, dy) for dx in range(-dist, dist + 1)
+                 for dy in range(-(dist - abs(dx)), dist - abs(dx) + 1))
+
+
 def distance(a, b):
     if not isinstance(a, Coordinates):
         a = a.coordinates
@@ -187,10 +492,12 @@ class LandTile(object):
         self.game = game
         self._coordinates = coordinates
         self._coordinates_dict = coordinates._asdict()
-        self.money = money
+        self._money = money
         self._country = None
         self.pieces = set()
-        self.visibility_level_per_country = {}
+        # JSON encodings of this tile, by the visibility they were encoded for. Encodings
+        # for partial visibility that hide pieces are keyed by the country instead.
+        self._encoded = {}
 
     def __repr__(self):
         return '<Tile at {}{}>'.format(self.coordinates,
@@ -204,6 +511,23 @@ class LandTile(object):
     def coordinates_dict(self):
         return self._coordinates_dict
 
+    @property
+    def visibility_level_per_country(self):
+        return self.game.visibility.get_levels(self)
+
+    @property
+    def money(self):
+        return self._money
+
+    @money.setter
+    def money(self, value):
+        self._money = value
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Discards the cached encodings of this tile. Must be called whenever the tile or its pieces change."""
+        self._encoded = {}
+
     @property
     def country(self):
         return self._country
@@ -215,63 +539,94 @@ class LandTile(object):
         self._country = value
         if value is not None:
             value.tiles.add(self)
+        self.game.visibility.tile_owner_changed(self)
+        self.invalidate_cache()
 
     def neighbors(self, dist=1):
-        result = []
-        for x in range(max(0, self.coordinates.x - dist), min(self.game.width, self.coordinates.x + dist + 1)):
-            for y in range(max(0, self.coordinates.y - dist), min(self.game.height, self.coordinates.y + dist + 1)):
-                tile = self.game.tiles[x][y]
-                if distance(self, tile) > dist:
-                    continue
-                yield tile
+        return self.game.get_neighborhood(self._coordinates, dist)
 
     def get_defenders(self):
         defenders = []
-        for tile in self.neighbors(MAX_DEFENDER_RANGE):
-            for piece in tile.pieces:
-                if piece.can_defend(self):
-                    if isinstance(piece, Bunker):
-                        defenders.extend([piece] * (BUNKER_DEFEND_MULTIPLIER - 1))
-                    defenders.append(piece)
+        for piece in self.game.defender_index.get_defenders(self):
+            if piece.can_defend(self):
+                if isinstance(piece, Bunker):
+                    defenders.extend([piece] * (BUNKER_DEFEND_MULTIPLIER - 1))
+                defenders.append(piece)
         return defenders
 
     def to_dict(self):
         return {
-            'coordinate': self.coordinates_dict,
+            'coordinate': dict(self._coordinates_dict),
             'money': self.money,
             'country': self.country.name if self.country else None,
             'pieces': [piece.to_dict() for piece in self.pieces]
         }
 
-    def to_dict_as_seen_by(self, country):
-        visibility = self.visibility_level_per_country.get(country, NO_VISIBILITY)
+    def get_visible_pieces(self, country, visibility):
+        """Returns the pieces on this tile seen by the given country, which has the given visibility level of it."""
         if visibility == FULL_VISIBILITY:
-            pieces_to_return = [piece.to_dict() for piece in self.pieces]
+            return self.pieces
         elif visibility == PARTIAL_VISIBILITY:
-            pieces_to_return = [piece.to_dict() for piece in self.pieces if
-                                piece.country == country or not isinstance(piece, (Spy, Satelite))]
+            return [piece for piece in self.pieces if
+                    piece.country == country or not isinstance(piece, (Spy, Satelite))]
         else:
-            pieces_to_return = []
+            return []
+
+    def to_dict_as_seen_by(self, country):
+        visibility = self.game.visibility.get_level(self, country)
         return {
-            'coordinate': self.coordinates_dict,
+            'coordinate': dict(self._coordinates_dict),
             'money': self.money if visibility >= PARTIAL_VISIBILITY else None,
             'country': self.country.name if self.country else None,
-            'pieces': pieces_to_return
+            'pieces': [piece.to_dict() for piece in self.get_visible_pieces(country, visibility)]
         }
 
+    def to_json(self):
+        """Returns the JSON encoding of to_dict(), cached until this tile changes."""
+        return self.to_json_as_seen_by(None, FULL_VISIBILITY)
+
+    def to_json_as_seen_by(self, country, visibility=None):
+        """Returns the JSON encoding of to_dict_as_seen_by(country), cached until this tile changes.
+
+        A partial view of a tile is the same as its full view, unless the tile has
+        spies or satelites of other countries. All countries that get the same view
+        share its encoding.
+        """
+        if visibility is None:
+            visibility = self.game.visibility.get_level(self, country)
+        key = visibility
+        if visibility == PARTIAL_VISIBILITY:
+            if any(piece.country != country and isinstance(piece, (Spy, Satelite)) for piece in self.pieces):
+                key = country
+            else:
+                key = visibility = FULL_VISIBILITY
+        result = self._encoded.get(key)
+        if result is None:
+            if visibility == FULL_VISIBILITY:
+                result = json.dumps(self.to_dict())
+            else:
+                result = json.dumps(self.to_dict_as_seen_by(country))
+            self._encoded[key] = result
+        return result
+
 
 class BasePiece(object):
-    def __init__(self, game, tile, country, max_speed, piece_type):
+    # Pieces are the most numerous objects in a game, so they avoid a per-instance __dict__.
+    __slots__ = ('game', '_id', '_tile', '_country', 'max_speed', 'piece_type')
+
+    def __init__(self, game, tile, country, max_speed, piece_type, piece_id=None):
         self.game = game
-        self._id = game.get_new_id()
+        self._id = game.get_new_id() if piece_id is None else game.reserve_id(piece_id)
         self._tile = tile
         self._country = country
         self.max_speed = max_speed
         self.piece_type = piece_type
-        self.dict = {'id': self.id, 'type': self.piece_type, 'country': self.country.name}
         game.pieces[self._id] = self
         tile.pieces.add(self)
+        tile.invalidate_cache()
         country.pieces.add(self)
+        game.visibility.add_piece(self)
+        game.defender_index.update(self)
 
     @property
     def id(self):
@@ -285,9 +640,14 @@ class BasePiece(object):
     def tile(self, value):
         if distance(self._tile, value) > self.max_speed:
             raise ValueError('Cannot move piece to requested tile')
+        self.game.visibility.remove_piece(self)
         self._tile.pieces.remove(self)
+        self._tile.invalidate_cache()
         self._tile = value
         value.pieces.add(self)
+        value.invalidate_cache()
+        self.game.visibility.add_piece(self)
+        self.game.defender_index.update(self)
 
     @property
     def country(self):
@@ -295,10 +655,12 @@ class BasePiece(object):
 
     @country.setter
     def country(self, value):
+        self.game.visibility.remove_piece(self)
         self._country.pieces.remove(self)
         self._country = value
         self._country.pieces.add(self)
-        self.dict['country'] = value.name
+        self._tile.invalidate_cache()
+        self.game.visibility.add_piece(self)
 
     def turn_done(self):
         """Method for deriving classes to override if cleanup is needed when a turn is done."""
@@ -308,11 +670,22 @@ class BasePiece(object):
         """Returns True iff this piece can defend the given tile."""
         return False
 
+    def defended_tiles(self):
+        """Returns the tiles this piece can currently defend.
+
+        Deriving classes that override can_defend must override this as well, and
+        update the game's defender index whenever the result may change.
+        """
+        return ()
+
     def kill(self):
         if self._id in self.game.pieces.keys():
             del self.game.pieces[self._id]
             self.tile.pieces.remove(self)
+            self.tile.invalidate_cache()
             self.country.pieces.remove(self)
+            self.game.visibility.remove_piece(self)
+            self.game.defender_index.update(self)
 
     def should_die_in_battle(self, role, tile, participants):
         """Returns True iff this piece should die in the given battle.
@@ -329,7 +702,7 @@ class BasePiece(object):
 
     def to_dict(self):
         """Returns a JSON-like dictionary representing this piece."""
-        return self.dict
+        return {'id': self._id, 'type': self.piece_type, 'country': self._country.name}
 
     def additional_load_from_dict(self, piece_dict):
         """Method for deriving class to override if it could load additional state from the piece dict."""
@@ -337,65 +710,81 @@ class BasePiece(object):
 
 
 class FlyingPiece(BasePiece):
+    __slots__ = ('in_air', 'time_in_air', 'max_time_in_air', 'theoretical_max_speed')
+
     def __init__(self, max_time_in_air, *args, **kwargs):
         super(FlyingPiece, self).__init__(*args, **kwargs)
-        self.in_air = self.dict['inAir'] = False
+        self.in_air = False
         self.time_in_air = -1
         self.max_time_in_air = max_time_in_air
         self.theoretical_max_speed = self.max_speed
         self.max_speed = 0
 
     def take_off(self):
-        self.in_air = self.dict['inAir'] = True
-        self.time_in_air = self.dict['timeInAir'] = max(0, self.time_in_air)
+        self.in_air = True
+        self.time_in_air = max(0, self.time_in_air)
         self.max_speed = self.theoretical_max_speed
+        self.tile.invalidate_cache()
 
     def land(self):
         if not self.in_air:
             return
         if self.tile.country is not None and self.country != self.tile.country:
             self.country = self.tile.country
-        self.in_air = self.dict['inAir'] = False
+        self.in_air = False
         self.time_in_air = -1
-        del self.dict['timeInAir']
         self.max_speed = 0
+        self.tile.invalidate_cache()
 
     def turn_done(self):
         if self.in_air:
             self.time_in_air += 1
-            self.dict['timeInAir'] += 1
+            self.tile.invalidate_cache()
             if self.time_in_air > self.max_time_in_air:
                 self.land()
 
     def additional_load_from_dict(self, piece_dict):
         super(FlyingPiece, self).additional_load_from_dict(piece_dict)
-        self.in_air = self.dict['inAir'] = piece_dict['inAir']
-        if 'timeInAir' in piece_dict:
-            self.time_in_air = self.dict['timeInAir'] = piece_dict['timeInAir']
-        else:
-            self.time_in_air = -1
-            if 'timeInAir' in self.dict:
-                del self.dict['timeInAir']
+        self.in_air = piece_dict['inAir']
+        self.time_in_air = piece_dict.get('timeInAir', -1)
+        # Flying pieces move only while in the air, see take_off and land.
+        self.max_speed = self.theoretical_max_speed if self.in_air else 0
+        self.tile.invalidate_cache()
+
+    def to_dict(self):
+        result = super(FlyingPiece, self).to_dict()
+        result['inAir'] = self.in_air
+        # A negative time in air means the piece is on the ground.
+        if self.time_in_air >= 0:
+            result['timeInAir'] = self.time_in_air
+        return result
 
 
 class Tank(BasePiece):
+    __slots__ = ('is_attacking',)
     PRICE = TANK_PRICE
 
     def __init__(self, *args, **kwargs):
-        super(Tank, self).__init__(max_speed=TANK_SPEED, piece_type='tank', *args, **kwargs)
         self.is_attacking = False
+        super(Tank, self).__init__(max_speed=TANK_SPEED, piece_type='tank', *args, **kwargs)
 
     def attack(self):
         assert (not self.is_attacking), 'Tank cannot attack twice in a turn'
         self.game.battles_in_queue[self.tile].append(self)
         self.is_attacking = True
+        self.game.defender_index.update(self)
 
     def turn_done(self):
-        self.is_attacking = False
+        if self.is_attacking:
+            self.is_attacking = False
+            self.game.defender_index.update(self)
 
     def can_defend(self, tile):
         return tile == self.tile and not self.is_attacking
 
+    def defended_tiles(self):
+        return () if self.is_attacking else (self.tile,)
+
     def should_die_in_battle(self, role, tile, participants):
         assert (role != PASSIVE_ROLE), 'A tank cannot be passive!'
         for participant, other_role in participants:
@@ -417,6 +806,7 @@ class Tank(BasePiece):
 
 
 class Airplane(FlyingPiece):
+    __slots__ = ('is_attacking',)
     PRICE = AIRPLANE_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -454,11 +844,12 @@ class Airplane(FlyingPiece):
 
 
 class Artillery(BasePiece):
+    __slots__ = ('is_attacking',)
     PRICE = ARTILLERY_PRICE
 
     def __init__(self, *args, **kwargs):
-        super(Artillery, self).__init__(max_speed=ARTILLERY_SPEED, piece_type='artillery', *args, **kwargs)
         self.is_attacking = False
+        super(Artillery, self).__init__(max_speed=ARTILLERY_SPEED, piece_type='artillery', *args, **kwargs)
 
     def attack(self, destination):
         assert (not self.is_attacking), 'Artillery cannot attack twice in a turn'
@@ -466,13 +857,21 @@ class Artillery(BasePiece):
             raise ValueError('Artillery cannot get that far')
         self.game.battles_in_queue[self.game.tiles[destination.x][destination.y]].append(self)
         self.is_attacking = True
+        self.game.defender_index.update(self)
 
     def turn_done(self):
-        self.is_attacking = False
+        if self.is_attacking:
+            self.is_attacking = False
+            self.game.defender_index.update(self)
 
     def can_defend(self, tile):
         return distance(tile, self.tile) <= ARTILLERY_DEFEND_RANGE and self.tile != tile and not self.is_attacking
 
+    def defended_tiles(self):
+        if self.is_attacking:
+            return ()
+        return tuple(tile for tile in self.tile.neighbors(ARTILLERY_DEFEND_RANGE) if tile != self.tile)
+
     def should_die_in_battle(self, role, tile, participants):
         if tile != self.tile:
             assert (role != PASSIVE_ROLE), 'Artillery cannot be passive outsite its own tile!'
@@ -486,6 +885,7 @@ class Artillery(BasePiece):
 
 
 class Helicopter(FlyingPiece):
+    __slots__ = ('is_attacking',)
     PRICE = HELICOPTER_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -528,6 +928,7 @@ class Helicopter(FlyingPiece):
 
 
 class Antitank(BasePiece):
+    __slots__ = ()
     PRICE = ANTITANK_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -536,6 +937,9 @@ class Antitank(BasePiece):
     def can_defend(self, tile):
         return tile == self.tile
 
+    def defended_tiles(self):
+        return (self.tile,)
+
     def should_die_in_battle(self, role, tile, participants):
         assert (role == DEFENDER_ROLE), 'An antitank must be a defender!'
         for participant, other_role in participants:
@@ -545,23 +949,31 @@ class Antitank(BasePiece):
 
 
 class IronDome(BasePiece):
+    __slots__ = ('is_defending',)
     PRICE = IRONDOME_PRICE
 
     def __init__(self, *args, **kwargs):
+        self.is_defending = False
         super(IronDome, self).__init__(max_speed=IRONDOME_SPEED, piece_type='irondome', *args, **kwargs)
-        self.is_defending = self.dict['isDefending'] = False
 
     def turn_on(self):
-        self.is_defending = self.dict['isDefending'] = True
+        self.is_defending = True
         self.max_speed = 0
+        self.game.defender_index.update(self)
+        self.tile.invalidate_cache()
 
     def turn_off(self):
-        self.is_defending = self.dict['isDefending'] = False
+        self.is_defending = False
         self.max_speed = IRONDOME_SPEED
+        self.game.defender_index.update(self)
+        self.tile.invalidate_cache()
 
     def can_defend(self, tile):
         return self.is_defending and distance(tile, self.tile) <= IRONDOME_DEFEND_RANGE
 
+    def defended_tiles(self):
+        return self.tile.neighbors(IRONDOME_DEFEND_RANGE) if self.is_defending else ()
+
     def should_die_in_battle(self, role, tile, participants):
         assert (role != ATTACKER_ROLE), 'Iron dome cannot attack!'
         if role == PASSIVE_ROLE:
@@ -578,10 +990,20 @@ class IronDome(BasePiece):
 
     def additional_load_from_dict(self, piece_dict):
         super(IronDome, self).additional_load_from_dict(piece_dict)
-        self.is_defending = self.dict['isDefending'] = piece_dict['isDefending']
+        self.is_defending = piece_dict['isDefending']
+        # Iron domes don't move while defending, see turn_on and turn_off.
+        self.max_speed = 0 if self.is_defending else IRONDOME_SPEED
+        self.game.defender_index.update(self)
+        self.tile.invalidate_cache()
+
+    def to_dict(self):
+        result = super(IronDome, self).to_dict()
+        result['isDefending'] = self.is_defending
+        return result
 
 
 class Bunker(BasePiece):
+    __slots__ = ('hits',)
     PRICE = BUNKER_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -594,6 +1016,9 @@ class Bunker(BasePiece):
     def can_defend(self, tile):
         return self.tile == tile
 
+    def defended_tiles(self):
+        return (self.tile,)
+
     def should_die_in_battle(self, role, tile, participants):
         assert (role == DEFENDER_ROLE), 'A bunker must be a defender!'
         for participant, other_role in participants:
@@ -605,6 +1030,7 @@ class Bunker(BasePiece):
 
 
 class Spy(BasePiece):
+    __slots__ = ()
     PRICE = SPY_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -612,6 +1038,7 @@ class Spy(BasePiece):
 
 
 class Tower(BasePiece):
+    __slots__ = ()
     PRICE = TOWER_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -619,6 +1046,7 @@ class Tower(BasePiece):
 
 
 class Satelite(BasePiece):
+    __slots__ = ()
     PRICE = SATELITE_PRICE
 
     def __init__(self, *args, **kwargs):
@@ -626,19 +1054,21 @@ class Satelite(BasePiece):
 
 
 class Builder(BasePiece):
+    __slots__ = ('_money',)
     PRICE = BUILDER_PRICE
 
     def __init__(self, *args, **kwargs):
         super(Builder, self).__init__(max_speed=BUILDER_SPEED, piece_type='builder', *args, **kwargs)
-        self.dict['money'] = 0
+        self.money = 0
 
     @property
     def money(self):
-        return self.dict['money']
+        return self._money
 
     @money.setter
     def money(self, value):
-        self.dict['money'] = value
+        self._money = value
+        self.tile.invalidate_cache()
 
     def collect_money(self, amount):
         if amount < 0:
@@ -672,7 +1102,12 @@ class Builder(BasePiece):
 
     def additional_load_from_dict(self, piece_dict):
         super(Builder, self).additional_load_from_dict(piece_dict)
-        self.dict['money'] = piece_dict['money']
+        self.money = piece_dict['money']
+
+    def to_dict(self):
+        result = super(Builder, self).to_dict()
+        result['money'] = self.money
+        return result
 
 
 TYPE_TO_CLASS = {
@@ -692,13 +1127,19 @@ TYPE_TO_CLASS = {
 
 def piece_from_dict(game, tile, country, piece_dict):
     piece_class = TYPE_TO_CLASS.get(piece_dict['type'])
-    result = piece_class(game=game, tile=tile, country=country)
+    # The ID is kept so that it stays stable across reloads of the game. Maps created
+    # before pieces had integer IDs carry UUID strings, which are replaced.
+    piece_id = piece_dict['id']
+    if not isinstance(piece_id, int) or piece_id in game.pieces:
+        piece_id = None
+    result = piece_class(game=game, tile=tile, country=country, piece_id=piece_id)
     result.additional_load_from_dict(piece_dict)
     return result
 
 
-def game_from_dict(game_dict):
-    game = Game(game_dict['width'], game_dict['height'])
+def game_from_dict(game_dict, seed=None, visibility_backend='python'):
+    game = Game(game_dict['width'], game_dict['height'], visibility_backend=visibility_backend,
+                next_piece_id=game_dict.get('nextPieceId', 1), seed=seed)
     game.countries = {Country(game, country_name) for country_name in game_dict['countries']}
     country_by_name = {country.name: country for country in game.countries}
     for tile_row, dicts_tile_row in zip(game.tiles, game_dict['tiles']):
@@ -1,3 +1,4 @@
+import json
 import unittest
 
 from common_types import Coordinates
@@ -164,6 +165,13 @@ class TestGameGeneral(unittest.TestCase):
         }
         self.assertEqual(neighbors, expected_neighbors)
 
+    def test_tile_neighbors_with_large_distance(self):
+        tile = self.game.tiles[2][4]
+        expected_neighbors = {other_tile for tile_row in self.game.tiles for other_tile in tile_row
+                              if engine.distance(tile, other_tile) <= constants.MAX_DEFENDER_RANGE}
+        self.assertEqual(set(tile.neighbors(constants.MAX_DEFENDER_RANGE)), expected_neighbors)
+        self.assertIs(tile.neighbors(constants.MAX_DEFENDER_RANGE), tile.neighbors(constants.MAX_DEFENDER_RANGE))
+
     def test_tile_to_dict_empty_tile(self):
         tile = self.game.tiles[2][4]
         expected_dict = {
@@ -209,6 +217,53 @@ class TestGameGeneral(unittest.TestCase):
         }
         self.assertEqual(tile.to_dict(), expected_dict)
 
+    def test_tile_to_json(self):
+        country = self.game.add_country('Israel')
+        tile = self.game.tiles[2][4]
+        builder = engine.Builder(self.game, tile, country)
+        self.assertEqual(json.loads(tile.to_json()), tile.to_dict())
+        builder.money = 5
+        self.assertEqual(json.loads(tile.to_json()), tile.to_dict())
+        builder.tile = self.game.tiles[2][5]
+        self.assertEqual(json.loads(tile.to_json()), tile.to_dict())
+
+    def test_tile_to_json_as_seen_by_hides_spies(self):
+        country1 = self.game.add_country('country 1')
+        country2 = self.game.add_country('country 2')
+        country3 = self.game.add_country('country 3')
+        tile = self.game.tiles[2][4]
+        engine.Tank(self.game, tile, country1)
+        engine.Tank(self.game, tile, country2)
+        engine.Spy(self.game, tile, country3)
+        self.game.apply_turn({})
+        for country in (country1, country2, country3):
+            self.assertEqual(json.loads(tile.to_json_as_seen_by(country)), tile.to_dict_as_seen_by(country))
+        self.assertEqual(len(json.loads(tile.to_json_as_seen_by(country1))['pieces']), 2)
+
+    def test_game_to_json_as_seen_by(self):
+        country = self.game.add_country('Israel')
+        engine.Tank(self.game, self.game.tiles[2][4], country)
+        self.game.apply_turn({})
+        self.assertEqual(self.game.to_json_as_seen_by(country), json.dumps(self.game.to_dict_as_seen_by(country)))
+        self.assertEqual(json.loads(self.game.to_json()), self.game.to_dict())
+
+    def test_game_to_columnar_dict_as_seen_by(self):
+        game = engine.Game(2, 3)
+        country = game.add_country('Israel')
+        game.tiles[1][0].country = country
+        game.tiles[1][0].money = 7
+        tank = engine.Tank(game, game.tiles[0][2], country)
+        game.apply_turn({})
+        view = game.to_dict_as_seen_by(country, columnar=True)
+        self.assertEqual(view['format'], 'columnar')
+        self.assertEqual(view['all_countries'], ['Israel'])
+        self.assertEqual(view['owners'], [-1, -1, -1, 0, -1, -1])
+        self.assertEqual(view['money'], [None, 0, 0, 7, None, 0])
+        self.assertEqual(view['visibility'], [engine.NO_VISIBILITY, engine.PARTIAL_VISIBILITY,
+                                              engine.PARTIAL_VISIBILITY, engine.PARTIAL_VISIBILITY,
+                                              engine.NO_VISIBILITY, engine.PARTIAL_VISIBILITY])
+        self.assertEqual(view['pieces'], [{'id': tank.id, 'type': 'tank', 'country': 0, 'x': 0, 'y': 2}])
+
     def test_base_piece_basic_containments(self):
         country = self.game.add_country('Israel')
         tile = self.game.tiles[2][4]
@@ -264,6 +319,30 @@ class TestGameGeneral(unittest.TestCase):
         }
         self.assertEqual(piece.to_dict(), expected_dict)
 
+    def test_game_pieces_have_no_instance_dict(self):
+        country = self.game.add_country('Israel')
+        tile = self.game.tiles[2][4]
+        for piece_class in engine.TYPE_TO_CLASS.values():
+            piece = piece_class(game=self.game, tile=tile, country=country)
+            self.assertFalse(hasattr(piece, '__dict__'))
+
+    def test_piece_ids_are_increasing_integers(self):
+        country = self.game.add_country('Israel')
+        tile = self.game.tiles[2][4]
+        first_piece = TestPiece(self.game, tile, country)
+        second_piece = TestPiece(self.game, tile, country)
+        self.assertEqual(first_piece.id, 1)
+        self.assertEqual(second_piece.id, 2)
+
+    def test_piece_ids_are_kept_when_loading_game(self):
+        country = self.game.add_country('Israel')
+        tile = self.game.tiles[2][4]
+        tank = engine.Tank(self.game, tile, country)
+        engine.Tank(self.game, tile, country).kill()
+        game = engine.game_from_dict(self.game.to_dict())
+        self.assertEqual(list(game.pieces), [tank.id])
+        self.assertEqual(game.get_new_id(), 3)
+
     def test_flying_piece_on_ground_initially(self):
         country = self.game.add_country('Israel')
         tile = self.game.tiles[2][4]
@@ -521,6 +600,17 @@ class TestGameGeneral(unittest.TestCase):
         new_airplane = engine.piece_from_dict(self.game, new_tile, country, airplane_dict)
         self.assertIsInstance(new_airplane, engine.Airplane)
 
+    def test_airplane_serialization_in_air(self):
+        country = self.game.add_country('Israel')
+        airplane = engine.Airplane(self.game, self.game.tiles[2][4], country)
+        airplane.take_off()
+        new_airplane = engine.piece_from_dict(self.game, self.game.tiles[4][2], country, airplane.to_dict())
+        self.assertTrue(new_airplane.in_air)
+        self.assertEqual(new_airplane.max_speed, constants.AIRPLANE_SPEED)
+        new_airplane.land()
+        new_airplane = engine.piece_from_dict(self.game, self.game.tiles[4][2], country, new_airplane.to_dict())
+        self.assertEqual(new_airplane.max_speed, 0)
+
     def test_artillery_speed(self):
         country = self.game.add_country('Israel')
         tile = self.game.tiles[2][4]
@@ -757,6 +847,15 @@ class TestGameGeneral(unittest.TestCase):
         }
         self.assertEqual(iron_dome.to_dict(), expected_dict)
 
+    def test_iron_dome_serialization_turned_on(self):
+        country = self.game.add_country('Israel')
+        iron_dome = engine.IronDome(self.game, self.game.tiles[2][4], country)
+        iron_dome.turn_on()
+        new_iron_dome = engine.piece_from_dict(self.game, self.game.tiles[4][2], country, iron_dome.to_dict())
+        self.assertTrue(new_iron_dome.is_defending)
+        with self.assertRaises(ValueError):
+            new_iron_dome.tile = self.game.tiles[4][3]
+
     def test_bunker_cannot_move(self):
         country = self.game.add_country('Israel')
         tile = self.game.tiles[2][4]
@@ -2237,6 +2336,141 @@ class TestGameGeneral(unittest.TestCase):
             self.assertEqual(bunker.hits, 1)
             bunker.turn_done()
 
+    def test_visibility_of_piece_neighbors(self):
+        self.set_up_for_battle()
+        engine.Tank(self.game, self.tile, self.country1)
+        self.game.apply_turn({})
+        self.assertEqual(self.tile.visibility_level_per_country[self.country1], engine.PARTIAL_VISIBILITY)
+        self.assertEqual(self.other_tile.visibility_level_per_country[self.country1], engine.PARTIAL_VISIBILITY)
+        self.assertEqual(self.game.tiles[4][4].visibility_level_per_country.get(self.country1, engine.NO_VISIBILITY),
+                         engine.NO_VISIBILITY)
+        self.assertEqual(self.tile.visibility_level_per_country[self.country2], engine.NO_VISIBILITY)
+
+    def test_visibility_of_owned_tile(self):
+        self.set_up_for_battle()
+        self.tile.country = self.country2
+        self.game.apply_turn({})
+        self.assertEqual(self.tile.visibility_level_per_country[self.country2], engine.PARTIAL_VISIBILITY)
+        self.tile.country = self.country1
+        self.game.apply_turn({})
+        self.assertEqual(self.tile.visibility_level_per_country[self.country2], engine.NO_VISIBILITY)
+        self.assertEqual(self.tile.visibility_level_per_country[self.country1], engine.PARTIAL_VISIBILITY)
+
+    def test_visibility_of_spy_tile(self):
+        self.set_up_for_battle()
+        engine.Spy(self.game, self.tile, self.country1)
+        self.game.apply_turn({})
+        self.assertEqual(self.tile.visibility_level_per_country[self.country1], engine.FULL_VISIBILITY)
+        self.assertEqual(self.other_tile.visibility_level_per_country[self.country1], engine.PARTIAL_VISIBILITY)
+
+    def test_visibility_of_tower(self):
+        self.set_up_for_battle()
+        engine.Tower(self.game, self.tile, self.country1)
+        self.game.apply_turn({})
+        self.assertEqual(self.game.tiles[2][9].visibility_level_per_country[self.country1],
+                         engine.PARTIAL_VISIBILITY)
+        self.assertEqual(self.game.tiles[4][8].visibility_level_per_country.get(self.country1, engine.NO_VISIBILITY),
+                         engine.NO_VISIBILITY)
+
+    def test_visibility_updates_when_piece_moves(self):
+        self.set_up_for_battle()
+        tank = engine.Tank(self.game, self.tile, self.country1)
+        self.game.apply_turn({})
+        tank.tile = self.other_tile
+        self.game.apply_turn({})
+        self.assertEqual(self.game.tiles[4][4].visibility_level_per_country[self.country1], engine.PARTIAL_VISIBILITY)
+        self.assertEqual(self.game.tiles[1][4].visibility_level_per_country[self.country1], engine.NO_VISIBILITY)
+
+    def test_visibility_updates_when_piece_dies(self):
+        self.set_up_for_battle()
+        tank = engine.Tank(self.game, self.tile, self.country1)
+        self.game.apply_turn({})
+        tank.kill()
+        self.game.apply_turn({})
+        self.assertEqual(self.tile.visibility_level_per_country[self.country1], engine.NO_VISIBILITY)
+
+    def test_visibility_updates_when_piece_changes_country(self):
+        self.set_up_for_battle()
+        tank = engine.Tank(self.game, self.tile, self.country1)
+        engine.Tank(self.game, self.other_tile, self.country1)
+        self.game.apply_turn({})
+        tank.country = self.country2
+        self.game.apply_turn({})
+        self.assertEqual(self.tile.visibility_level_per_country[self.country1], engine.PARTIAL_VISIBILITY)
+        self.assertEqual(self.game.tiles[1][4].visibility_level_per_country[self.country1], engine.NO_VISIBILITY)
+        self.assertEqual(self.game.tiles[1][4].visibility_level_per_country[self.country2], engine.PARTIAL_VISIBILITY)
+
+    @unittest.skipIf(engine.np is None, 'numpy is not installed')
+    def test_numpy_visibility_matches_python_visibility(self):
+        games = [engine.Game(10, 10, visibility_backend=backend) for backend in ('python', 'numpy')]
+        for game in games:
+            country1 = game.add_country('country 1')
+            country2 = game.add_country('country 2')
+            for x in range(5):
+                game.tiles[x][x].country = country1
+            engine.Tower(game, game.tiles[2][4], country1)
+            engine.Spy(game, game.tiles[7][7], country2)
+            engine.Satelite(game, game.tiles[5][5], country2)
+            tank = engine.Tank(game, game.tiles[0][9], country2)
+            game.apply_turn({})
+            tank.tile = game.tiles[1][9]
+            game.tiles[3][3].country = country2
+            game.apply_turn({})
+        python_game, numpy_game = games
+        for country in ('country 1', 'country 2'):
+            for python_row, numpy_row in zip(python_game.tiles, numpy_game.tiles):
+                for python_tile, numpy_tile in zip(python_row, numpy_row):
+                    self.assertEqual(python_game.visibility.get_level(python_tile, python_game.get_country(country)),
+                                     numpy_game.visibility.get_level(numpy_tile, numpy_game.get_country(country)))
+
+    def test_get_defenders(self):
+        self.set_up_for_battle()
+        tank = engine.Tank(self.game, self.tile, self.country1)
+        artillery = engine.Artillery(self.game, self.game.tiles[2][6], self.country1)
+        bunker = engine.Bunker(self.game, self.tile, self.country1)
+        engine.Artillery(self.game, self.game.tiles[2][7], self.country1)
+        defenders = self.tile.get_defenders()
+        self.assertEqual(len(defenders), 2 + constants.BUNKER_DEFEND_MULTIPLIER)
+        self.assertEqual(set(defenders), {tank, artillery, bunker})
+
+    def test_get_defenders_without_attacking_pieces(self):
+        self.set_up_for_battle()
+        tank = engine.Tank(self.game, self.tile, self.country1)
+        artillery = engine.Artillery(self.game, self.other_tile, self.country1)
+        tank.attack()
+        artillery.attack(self.other_tile.coordinates)
+        self.assertEqual(self.tile.get_defenders(), [])
+        tank.turn_done()
+        artillery.turn_done()
+        self.assertEqual(set(self.tile.get_defenders()), {tank, artillery})
+
+    def test_get_defenders_with_iron_dome(self):
+        self.set_up_for_battle()
+        iron_dome = engine.IronDome(self.game, self.other_tile, self.country1)
+        self.assertEqual(self.tile.get_defenders(), [])
+        iron_dome.turn_on()
+        self.assertEqual(self.tile.get_defenders(), [iron_dome])
+        self.assertEqual(self.game.tiles[9][9].get_defenders(), [])
+        iron_dome.turn_off()
+        iron_dome.tile = self.game.tiles[4][4]
+        iron_dome.turn_on()
+        self.assertEqual(self.game.tiles[9][9].get_defenders(), [iron_dome])
+        iron_dome.kill()
+        self.assertEqual(self.tile.get_defenders(), [])
+
+    def test_battles_are_reproducible_with_seed(self):
+        survivors = []
+        for _ in range(2):
+            self.game = engine.Game(10, 10, seed=1234)
+            self.set_up_for_battle()
+            for _ in range(5):
+                engine.Tank(self.game, self.tile, self.country1).attack()
+                engine.Tank(self.game, self.tile, self.country2)
+            self.game.perform_battles()
+            survivors.append(sorted(self.game.pieces))
+        self.assertEqual(survivors[0], survivors[1])
+        self.assertEqual(self.game.seed, 1234)
+
 
 # TODO: Test additional_load_from_dict
 
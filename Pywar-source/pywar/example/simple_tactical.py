@@ -6,6 +6,11 @@ import strategic_api
 tank_to_coordinate_to_attack = {}
 
 
+def reset_game():
+    """Called by the slave before every new game."""
+    tank_to_coordinate_to_attack.clear()
+
+
 def move_tank_to_destination(tank, dest):
     """Returns True if the tank's mission is complete."""
     if dest is None:
@@ -0,0 +1,305 @@
+"""Game logs, recording the state of the game and the commands of the countries in every turn.
+
+A game log is a gzipped tarball. Besides game-info.json, it has a turn-N.json
+member for every turn, with the commands given in the turn, and either the full
+game state after it (a keyframe) or only the tiles that changed since the
+previous turn (a delta). Keyframes are written every few turns, so any turn is
+reconstructed from the keyframe before it and a few deltas. Logs that have only
+keyframes, as written by older masters, are read the same way.
+"""
+import bisect
+import collections
+import io
+import itertools
+import json
+import queue
+import tarfile
+import threading
+
+import engine
+
+# Turns between keyframes, by default.
+KEYFRAME_INTERVAL = 64
+# Turns captured but not yet written by a BackgroundGameLogWriter, by default.
+MAX_PENDING_TURNS = 16
+GAME_INFO_NAME = 'game-info.json'
+TURN_NAME_PREFIX = 'turn-'
+TURN_NAME_SUFFIX = '.json'
+
+
+# A turn of the game, as captured for the log. encoded_tiles are in the row-major order of the game.
+_CapturedTurn = collections.namedtuple('_CapturedTurn', ['turn', 'fields', 'commands_info', 'encoded_tiles'])
+
+
+def capture_state(turn, state, commands_info):
+    """Returns a turn captured from its game state dict, as returned by engine.Game.to_dict, like capture_turn."""
+    fields = {name: value for name, value in state.items() if name != 'tiles'}
+    return _CapturedTurn(turn, fields, commands_info,
+                         [json.dumps(tile_dict) for tile_dict in itertools.chain.from_iterable(state['tiles'])])
+
+
+def get_turn_name(turn, padding=0):
+    return '{}{}{}'.format(TURN_NAME_PREFIX, str(turn).zfill(padding), TURN_NAME_SUFFIX)
+
+
+def iter_turn_entries(path):
+    """Yields (turn, log entry) pairs of a gzipped tarball game log, in the order they were written.
+
+    The log is read as a stream, without listing its members first, so the
+    first turns are available right away.
+    """
+    with tarfile.open(path, mode='r|gz') as tar:
+        for member in tar:
+            if member.name.startswith(TURN_NAME_PREFIX) and member.name.endswith(TURN_NAME_SUFFIX):
+                with tar.extractfile(member) as member_file:
+                    yield int(member.name[len(TURN_NAME_PREFIX):-len(TURN_NAME_SUFFIX)]), json.load(member_file)
+
+
+class GameLogWriter(object):
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL, expected_turns=0):
+        """Opens a new game log for writing.
+
+        A keyframe is written every keyframe_interval turns, and in the first
+        turn. expected_turns only pads the turn numbers in the member names, so
+        they sort in order.
+        """
+        super(GameLogWriter, self).__init__()
+        if keyframe_interval < 1:
+            raise ValueError('The keyframe interval must be positive, not {}'.format(keyframe_interval))
+        self.keyframe_interval = keyframe_interval
+        self._turn_name_padding = len(str(expected_turns))
+        self._open(path)
+        # The encoded tiles of the last logged turn, by the row-major order of the game.
+        self._logged_tiles = None
+
+    def _open(self, path):
+        self._tar = tarfile.open(path, mode='w:gz')
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def write_info(self, info):
+        """Writes the dict of information required for reproducing the game."""
+        self._add(GAME_INFO_NAME, json.dumps(info).encode('utf8'))
+
+    def capture_turn(self, game, commands_info):
+        """Returns a snapshot of the current turn of the game, to be encoded later by encode_captured_turn.
+
+        The snapshot holds only the encodings of the tiles, which the engine
+        caches, so capturing a turn is cheap and the game may go on meanwhile.
+        """
+        return _CapturedTurn(game.turns, game.state_fields(), commands_info,
+                             [tile.to_json() for tile in itertools.chain.from_iterable(game.tiles)])
+
+    def encode_captured_turn(self, captured_turn):
+        """Returns the encoded log entry of a turn captured by capture_turn.
+
+        Turns must be encoded in order, as deltas are taken from the previous one.
+        """
+        fields = {'commands': captured_turn.commands_info}
+        encoded_tiles = captured_turn.encoded_tiles
+        if self._logged_tiles is None or captured_turn.turn % self.keyframe_interval == 0:
+            width, height = captured_turn.fields['width'], captured_turn.fields['height']
+            state = engine.dumps_with_encoded_field(captured_turn.fields, 'tiles', '[{}]'.format(', '.join(
+                '[{}]'.format(', '.join(encoded_tiles[x * height:(x + 1) * height])) for x in range(width))))
+            entry = engine.dumps_with_encoded_field(fields, 'state', state)
+        else:
+            changed_tiles = [tile for tile, logged_tile in zip(encoded_tiles, self._logged_tiles)
+                             if tile != logged_tile]
+            delta = engine.dumps_with_encoded_field({'nextPieceId': captured_turn.fields['nextPieceId']}, 'tiles',
+                                                    '[{}]'.format(', '.join(changed_tiles)))
+            entry = engine.dumps_with_encoded_field(fields, 'delta', delta)
+        self._logged_tiles = encoded_tiles
+        return entry.encode('utf8')
+
+    def encode_turn(self, game, commands_info):
+        """Returns the encoded log entry of the current turn of the game, given the commands of its countries."""
+        return self.encode_captured_turn(self.capture_turn(game, commands_info))
+
+    def write_captured_turn(self, captured_turn):
+        """Writes the log entry of a turn captured by capture_turn."""
+        self._add(get_turn_name(captured_turn.turn, self._turn_name_padding), self.encode_captured_turn(captured_turn))
+
+    def write_turn(self, game, commands_info):
+        """Writes the log entry of the current turn of the game, given the commands of its countries."""
+        self.write_captured_turn(self.capture_turn(game, commands_info))
+
+    def close(self):
+        self._tar.close()
+
+
+class BackgroundGameLogWriter(object):
+    """Writes a game log like writer_class, but encodes and compresses the turns in a background thread.
+
+    Turns are captured in the calling thread and handed to the writer thread
+    through a queue of at most max_pending_turns turns, so a master that runs
+    ahead of the writer waits for it. An error of the writer thread is raised by
+    the next write, or by close, which waits until all turns are written.
+    """
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL, expected_turns=0,
+                 max_pending_turns=MAX_PENDING_TURNS, writer_class=GameLogWriter):
+        super(BackgroundGameLogWriter, self).__init__()
+        self._writer = writer_class(path, keyframe_interval=keyframe_interval, expected_turns=expected_turns)
+        self._queue = queue.Queue(maxsize=max_pending_turns)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_pending, name='game-log-writer', daemon=True)
+        self._thread.start()
+
+    def _write_pending(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep taking the items, so writes don't block on a full queue.
+                continue
+            write, argument = item
+            try:
+                write(argument)
+            except Exception as e:
+                self._error = e
+
+    def _put(self, write, argument):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((write, argument))
+
+    def write_info(self, info):
+        """Writes the dict of information required for reproducing the game."""
+        self._put(self._writer.write_info, info)
+
+    def write_turn(self, game, commands_info):
+        """Writes the log entry of the current turn of the game, given the commands of its countries."""
+        self._put(self._writer.write_captured_turn, self._writer.capture_turn(game, commands_info))
+
+    def close(self):
+        """Waits for the pending turns to be written, and closes the log."""
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        if self._error is not None:
+            raise self._error
+
+
+class TurnLogReader(object):
+    """Reconstructs the game state in any turn of a log of keyframes and deltas.
+
+    Subclasses give the logged turns, and read the log entry of each of them.
+    Reading the turns in order applies a single delta to the previous state for
+    each of them. Reading a turn before the last one read starts over from the
+    keyframe before it.
+    """
+
+    def __init__(self, turns):
+        super(TurnLogReader, self).__init__()
+        self.turns = sorted(turns)
+        # The last reconstructed turn, and its game state dict.
+        self._turn = None
+        self._state = None
+        # The last loaded turn, and its log entry.
+        self._entry_turn = None
+        self._entry = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_entry(self, turn):
+        """Returns the decoded log entry of the given turn."""
+        raise NotImplementedError()
+
+    def _load_entry(self, turn):
+        if turn != self._entry_turn:
+            self._entry = self._read_entry(turn)
+            self._entry_turn = turn
+        return self._entry
+
+    def get_info(self):
+        """Returns the dict of game information, or an empty dict for logs that have none."""
+        return {}
+
+    def get_commands(self, turn):
+        """Returns a dict from country name to the commands it gave in the given turn."""
+        return self._load_entry(turn)['commands']
+
+    def _apply(self, entry):
+        if 'state' in entry:
+            # The entry may be loaded again, so the deltas are applied to a copy of its rows.
+            self._state = dict(entry['state'], tiles=[list(tile_row) for tile_row in entry['state']['tiles']])
+            return
+        delta = entry['delta']
+        self._state['nextPieceId'] = delta['nextPieceId']
+        for tile_dict in delta['tiles']:
+            coordinates = tile_dict['coordinate']
+            self._state['tiles'][coordinates['x']][coordinates['y']] = tile_dict
+
+    def get_state(self, turn):
+        """Returns the game state after the given turn, as returned by engine.Game.to_dict."""
+        index = bisect.bisect_left(self.turns, turn)
+        if index == len(self.turns) or self.turns[index] != turn:
+            raise KeyError('No turn {} in the game log'.format(turn))
+        if self._turn is not None and self._turn <= turn:
+            start = bisect.bisect_left(self.turns, self._turn) + 1
+        else:
+            start = 0
+            self._state = None
+        entries = []
+        for earlier_turn in reversed(self.turns[start:index + 1]):
+            entry = self._load_entry(earlier_turn)
+            entries.append(entry)
+            if 'state' in entry:
+                break
+        else:
+            if self._state is None:
+                raise ValueError('No keyframe before turn {} in the game log'.format(turn))
+        for entry in reversed(entries):
+            self._apply(entry)
+        self._turn = turn
+        # The rows are replaced by the following deltas, so the caller gets its own copy of them.
+        return dict(self._state, tiles=[list(tile_row) for tile_row in self._state['tiles']])
+
+    def get_game(self, turn, seed=None):
+        """Returns the game after the given turn, as an engine.Game."""
+        return engine.game_from_dict(self.get_state(turn), seed=seed)
+
+    def close(self):
+        pass
+
+
+class GameLogReader(TurnLogReader):
+    """Reads a gzipped tarball game log.
+
+    The tar members are listed when the log is opened, which decompresses all of
+    it. Logs that should be read out of order are better converted to replay
+    archives, see replay.convert_game_log.
+    """
+
+    def __init__(self, path):
+        self._tar = tarfile.open(path, mode='r:gz')
+        # dict: turn -> tar member
+        self._members = {}
+        self._info_member = None
+        for member in self._tar.getmembers():
+            if member.name == GAME_INFO_NAME:
+                self._info_member = member
+            elif member.name.startswith(TURN_NAME_PREFIX) and member.name.endswith(TURN_NAME_SUFFIX):
+                self._members[int(member.name[len(TURN_NAME_PREFIX):-len(TURN_NAME_SUFFIX)])] = member
+        super(GameLogReader, self).__init__(self._members)
+
+    def _load(self, member):
+        with self._tar.extractfile(member) as member_file:
+            return json.load(member_file)
+
+    def _read_entry(self, turn):
+        return self._load(self._members[turn])
+
+    def get_info(self):
+        return {} if self._info_member is None else self._load(self._info_member)
+
+    def close(self):
+        self._tar.close()
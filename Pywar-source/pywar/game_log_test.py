@@ -0,0 +1,58 @@
+import unittest
+
+import game_log
+from game_log_testing import LoggedGameTestCase
+
+
+class TestGameLog(LoggedGameTestCase):
+    def setUp(self):
+        super(TestGameLog, self).setUp()
+        self.path = self.get_path('.tar.gz')
+
+    def test_read_turns_in_order(self):
+        states = self.play_and_log(game_log.GameLogWriter(self.path, keyframe_interval=4, expected_turns=10))
+        with game_log.GameLogReader(self.path) as reader:
+            self.assertEqual(reader.get_info()['seed'], 1)
+            self.assertEqual(reader.turns, sorted(states))
+            for turn in reader.turns:
+                self.assertEqual(reader.get_state(turn), states[turn])
+            self.assertEqual(reader.get_commands(1)['country 1'][0]['name'], 'move')
+
+    def test_read_turns_out_of_order(self):
+        states = self.play_and_log(game_log.GameLogWriter(self.path, keyframe_interval=4, expected_turns=10))
+        with game_log.GameLogReader(self.path) as reader:
+            for turn in [7, 3, 10, 10, 1, 9]:
+                self.assertEqual(reader.get_state(turn), states[turn])
+            self.assertEqual(reader.get_game(5).to_dict()['tiles'], states[5]['tiles'])
+
+    def test_background_writer(self):
+        states = self.play_and_log(game_log.BackgroundGameLogWriter(self.path, keyframe_interval=4))
+        with game_log.GameLogReader(self.path) as reader:
+            self.assertEqual(reader.get_info()['seed'], 1)
+            self.assertEqual(reader.turns, sorted(states))
+            for turn in reader.turns:
+                self.assertEqual(reader.get_state(turn), states[turn])
+
+    def test_background_writer_raises_errors_on_close(self):
+        writer = game_log.BackgroundGameLogWriter(self.path, max_pending_turns=1)
+        writer.write_turn(self.game, {'country 1': [object()]})
+        with self.assertRaises(TypeError):
+            writer.close()
+
+    def test_rejects_non_positive_keyframe_interval(self):
+        with self.assertRaises(ValueError):
+            game_log.GameLogWriter(self.path, keyframe_interval=0)
+
+    def test_deltas_are_smaller_than_keyframes(self):
+        writer = game_log.GameLogWriter(self.path, keyframe_interval=4)
+        keyframe = writer.encode_turn(self.game, {})
+        self.game.apply_turn({})
+        delta = writer.encode_turn(self.game, {})
+        writer.close()
+        self.assertIn(b'"state"', keyframe)
+        self.assertIn(b'"delta"', delta)
+        self.assertLess(len(delta), len(keyframe) // 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
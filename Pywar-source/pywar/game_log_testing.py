@@ -0,0 +1,54 @@
+"""A small logged game, shared by the tests of the game log formats and their readers."""
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+from common_types import Coordinates
+import commands
+import engine
+
+
+class LoggedGameTestCase(unittest.TestCase):
+    """Sets up a game of two countries, in which a tank of the first one moves back and forth every turn."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.game = engine.Game(5, 5, seed=1)
+        self.country1 = self.game.add_country('country 1')
+        self.country2 = self.game.add_country('country 2')
+        for tile in itertools.chain.from_iterable(self.game.tiles):
+            tile.country = self.country1 if tile.coordinates.x < 3 else self.country2
+            tile.money = 10
+        self.tank = engine.Tank(self.game, self.game.tiles[0][0], self.country1)
+        builder = engine.Builder(self.game, self.game.tiles[4][4], self.country2)
+        builder.money = 100
+
+    def get_path(self, extension):
+        """Returns the path of a log with the given file extension, in the temporary directory of the test."""
+        return os.path.join(self.directory, 'game' + extension)
+
+    def play_and_log(self, writer, turns=10, change_money=True):
+        """Plays and logs the given amount of turns, and returns the game states after them, by turn.
+
+        writer has the interface of game_log.GameLogWriter, and is closed once
+        the turns are logged. Unless change_money is False, the money of a tile
+        is changed outside of the commands every turn, which command logs can't
+        reproduce.
+        """
+        states = {}
+        writer.write_info({'seed': self.game.seed, 'map': self.game.to_dict()})
+        for turn in range(turns):
+            tank_coordinates = self.tank.tile.coordinates
+            turn_commands = {self.country1: [commands.MoveCommand(
+                self.tank.id, Coordinates(tank_coordinates.x, tank_coordinates.y ^ 1)).to_dict()]}
+            if change_money:
+                self.game.tiles[turn % 5][2].money += 1
+            self.game.apply_turn(turn_commands)
+            writer.write_turn(self.game, {country.name: country_commands
+                                          for country, country_commands in turn_commands.items()})
+            states[self.game.turns] = self.game.to_dict()
+        writer.close()
+        return states
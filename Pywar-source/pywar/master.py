@@ -1,21 +1,35 @@
 import argparse
-import codecs
-import http.client
-import io
+import array
+import asyncio
+import concurrent.futures
+import importlib.util
 import json
+import mmap
 import os.path
-import socket
+import pickle
+import selectors
+import shutil
 import subprocess
 import sys
-import tarfile
+import tempfile
 import time
+import traceback
 
+import codec
+from command_log import CommandLogWriter, COMMAND_LOG_EXTENSION
 import engine
-
-TIMEOUT = 10
-REQUEST_HEADERS = {
-    'Content-type': 'application/json'
-}
+from game_log import BackgroundGameLogWriter, GameLogWriter, KEYFRAME_INTERVAL, MAX_PENDING_TURNS
+import replay
+from slave import RESET_HOOK
+from tactical_api import TurnContext
+import transports
+
+# Formats of the game view sent to the slaves, see engine.Game.to_dict_as_seen_by and SharedView.
+WIRE_FORMATS = ['tiles', 'columnar', 'shared']
+# Modes of running the bots in the master process, see InProcessSlave.
+IN_PROCESS_MODES = ['inline', 'thread']
+# Shared views are placed in memory backed files, if possible.
+SHARED_VIEW_DIR = '/dev/shm'
 COUNTRY_NAMES = [
     'Absurdistan',
     'Berzerkistan',
@@ -32,13 +46,61 @@ def parse_args():
                         help='Path to a JSON file mapping a country name to the slave module path.')
     parser.add_argument('-t', '--turns', metavar='NUM', type=int, default=1024,
                         help='Amount of turns to play in the game.')
+    parser.add_argument('-g', '--games', metavar='NUM', type=int, default=1,
+                        help='Amount of games to play one after the other, reusing the slave processes. '
+                             'The logs of the games are numbered, and so are their seeds, if one is given.')
     parser.add_argument('-l', '--game-log', metavar='FILE', type=str, default='log/game.tar.gz',
-                        help='Gzipped tarball file for dumping game log.')
+                        help='Gzipped tarball file for dumping game log. Paths ending with {} get a replay archive '
+                             'instead, see replay.py, and paths ending with {} get a log of the commands only, see '
+                             'command_log.py.'.format(replay.REPLAY_EXTENSION, COMMAND_LOG_EXTENSION))
+    parser.add_argument('--keyframe-interval', metavar='NUM', type=int, default=KEYFRAME_INTERVAL,
+                        help='Turns between the full game states in the game log. Other turns log only the tiles '
+                             'that changed.')
+    parser.add_argument('--log-queue', metavar='NUM', type=int, default=MAX_PENDING_TURNS,
+                        help='Turns that may wait for the game log writer thread before the game waits for it. '
+                             'With 0, the game log is written in the turn loop.')
     parser.add_argument('--slaves-timeout', metavar='TIME', type=float, default=None,
                         help='Timeout for waiting for slaves to be ready.')
     parser.add_argument('--slaves-output', metavar='DIR', type=str, default='log/',
                         help='Directory for storing STDOUT and STDERR files of slave processes.')
-    return parser.parse_args()
+    parser.add_argument('--delta-turns', action='store_true',
+                        help='Send slaves only the tiles that changed since their previous turn.')
+    parser.add_argument('--seed', metavar='NUM', type=int, default=None,
+                        help='Seed for the random choices of the game engine. Chosen randomly by default.')
+    parser.add_argument('--visibility-backend', choices=sorted(engine.VISIBILITY_BACKENDS), default='python',
+                        help='How the engine computes visibility levels. The numpy backend requires numpy, and '
+                             'computes the whole board every turn.')
+    parser.add_argument('--transport', choices=sorted(transports.TRANSPORTS), default='http',
+                        help='How turns are exchanged with the slaves. Slaves reached over HTTP run a Flask server, '
+                             'while the pipe and unix transports skip HTTP for slaves on this host.')
+    parser.add_argument('--turn-timeout', metavar='TIME', type=float, default=transports.TIMEOUT,
+                        help='Time for the slaves to respond to each turn, counted from the start of the turn, '
+                             'after which they lose the turn. Encoding the turn requests takes from this time.')
+    parser.add_argument('--parallel-encoding', action='store_true',
+                        help='Encode the game views of the countries in parallel worker processes. The workers are '
+                             'forked from the master, so this requires --log-queue 0, and no in-process bots in '
+                             'threads.')
+    parser.add_argument('--codec', choices=sorted(codec.CODECS), default=codec.JSON.name,
+                        help='Encoding of the turn requests and results. Codecs other than JSON require the tiles '
+                             'format.')
+    parser.add_argument('--wire-format', choices=WIRE_FORMATS, default='tiles',
+                        help='Format of the game view sent to the slaves. Delta turns require the tiles format, and '
+                             'the shared format requires slaves on this host, so it does not work over HTTP.')
+    parser.add_argument('--compress-threshold', metavar='BYTES', type=int, default=None,
+                        help='Compress turn requests and results of at least this size, for slaves on other hosts. '
+                             'Requires the HTTP transport.')
+    parser.add_argument('--in-process', choices=IN_PROCESS_MODES, default=None,
+                        help='Run the bots in the master process instead of in slave processes, inline or in a '
+                             'thread per country. Meant for simulations and profiling, bots are not isolated.')
+    args = parser.parse_args()
+    if args.keyframe_interval < 1:
+        parser.error('the keyframe interval must be positive')
+    if args.wire_format == 'shared' and args.transport == 'http':
+        parser.error('the shared wire format requires the pipe or unix transport')
+    if args.parallel_encoding and (args.log_queue > 0 or args.in_process == 'thread'):
+        parser.error('parallel encoding forks the master, so it requires --log-queue 0 and no in-process bots in '
+                     'threads')
+    return args
 
 
 def ensure_python3():
@@ -46,15 +108,6 @@ def ensure_python3():
         raise SystemExit('You must run this with pyhon3.')
 
 
-def get_open_port():
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind(('127.0.0.1', 0))
-    s.listen(1)
-    port = s.getsockname()[1]
-    s.close()
-    return port
-
-
 def get_slave_file():
     current_dir = os.path.dirname(__file__)
     py_file = os.path.join(current_dir, 'slave.py')
@@ -67,10 +120,128 @@ def get_slave_file():
         raise FileNotFoundError('Could not find slave script')
 
 
+def _run_worker(write_fd, encode):
+    exit_code = 1
+    try:
+        with open(write_fd, 'wb') as output:
+            pickle.dump(encode(), output, pickle.HIGHEST_PROTOCOL)
+        exit_code = 0
+    except Exception:
+        traceback.print_exc()
+    finally:
+        os._exit(exit_code)
+
+
+async def encode_in_worker(encode):
+    """Runs encode in a forked worker process, and returns its result.
+
+    encode should return a list of encoded strings or bytes. The worker sees a
+    copy-on-write snapshot of the master, so changes it makes are lost. Only
+    the calling thread is forked, so locks held by other threads stay locked in
+    the worker, which is why the master doesn't fork while it runs threads of
+    its own.
+    """
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _run_worker(write_fd, encode)
+    os.close(write_fd)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    with open(read_fd, 'rb') as pipe:
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        try:
+            data = await reader.read()
+        finally:
+            transport.close()
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise ChildProcessError('Encoding worker failed with status {}'.format(status))
+    return pickle.loads(data)
+
+
+class SharedView(object):
+    """A memory mapped file, through which a slave on the same host reads its game views.
+
+    The owners, money (-1 if unknown) and visibility levels of the tiles are
+    written as native int arrays, followed by the JSON encoded pieces. The turn
+    request itself only carries the other view fields, and where to find the
+    rest. See tactical_api.TurnContext for the reading side.
+    """
+
+    def __init__(self):
+        super(SharedView, self).__init__()
+        self._directory = tempfile.mkdtemp(prefix='pywar-',
+                                           dir=SHARED_VIEW_DIR if os.path.isdir(SHARED_VIEW_DIR) else None)
+        self.path = os.path.join(self._directory, 'view')
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def write(self, view):
+        """Writes a columnar view, as returned by Game.to_dict_as_seen_by, and returns the turn request."""
+        columns = [array.array('i', view.pop('owners')),
+                   array.array('i', [-1 if money is None else money for money in view.pop('money')]),
+                   array.array('i', view.pop('visibility')),
+                   json.dumps(view.pop('pieces')).encode('utf8')]
+        sizes = [memoryview(column).nbytes for column in columns]
+        # A slave still reading a turn it missed may see a mix of two views, but
+        # the result of that turn is discarded anyway.
+        if os.fstat(self._fd).st_size < sum(sizes):
+            os.ftruncate(self._fd, sum(sizes))
+        with mmap.mmap(self._fd, sum(sizes)) as mapping:
+            offset = 0
+            for column, size in zip(columns, sizes):
+                mapping[offset:offset + size] = memoryview(column).cast('B')
+                offset += size
+        view.update(format='shared', path=self.path, piecesLength=sizes[-1])
+        return json.dumps(view)
+
+    def close(self):
+        os.close(self._fd)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
 class Slave(object):
-    def __init__(self, tactical_module_path, strategic_module_path, output_location=None):
+    def __init__(self, tactical_module_path, strategic_module_path, output_location=None, delta_turns=False,
+                 wire_format='tiles', transport='http', codec_name='json', compress_threshold=None,
+                 turn_timeout=transports.TIMEOUT):
+        """Starts a slave process.
+
+        transport is one of the names in transports.TRANSPORTS. Over HTTP, a turn
+        is given up after turn_timeout seconds without a response.
+
+        If compress_threshold is not None, turn requests and results of at least
+        this many bytes are compressed. This is supported only over HTTP.
+
+        If delta_turns is True, only the first turn request carries the full game
+        view, and the following ones carry only the tiles that changed since the
+        previous request.
+
+        wire_format is one of WIRE_FORMATS.
+
+        codec_name is one of the names in codec.CODECS. Codecs other than JSON
+        support only the tiles wire format.
+        """
         super(Slave, self).__init__()
-        self.port = get_open_port()
+        if delta_turns and wire_format != 'tiles':
+            raise ValueError('Delta turns are supported only in the tiles wire format')
+        if codec_name != codec.JSON.name and wire_format != 'tiles':
+            raise ValueError('The {} codec supports only the tiles wire format'.format(codec_name))
+        if wire_format == 'shared' and transport == 'http':
+            raise ValueError('The shared wire format is supported only for slaves on this host, and not over HTTP')
+        self.codec = codec.CODECS[codec_name]
+        self.delta_turns = delta_turns
+        self.wire_format = wire_format
+        self._sent_tiles = None  # The tiles of the last turn request, if the slave handled it.
+        self.shared_view = SharedView() if wire_format == 'shared' else None
+        if compress_threshold is not None and transport != 'http':
+            raise ValueError('Compression is supported only over HTTP')
+        if transport == 'http':
+            self.transport = transports.HttpTransport(compress_threshold=compress_threshold, timeout=turn_timeout)
+        else:
+            self.transport = transports.TRANSPORTS[transport]()
         if output_location is not None:
             dir_name = os.path.dirname(output_location)
             if not os.path.isdir(dir_name):
@@ -80,43 +251,102 @@ class Slave(object):
         else:
             self.stdout = None
             self.stderr = None
+        # The slave writes transports.READY_TOKEN to this pipe once it's ready.
+        self.ready_fd, ready_write_fd = os.pipe()
+        self._signaled_ready = False
         self.subprocess = subprocess.Popen(
-            [sys.executable, get_slave_file(), '--port', str(self.port),
-             '--tactical-module-path', tactical_module_path,
-             '--strategic-module-path', strategic_module_path],
-            stdout=self.stdout, stderr=self.stderr)
-        self.conn = None
+            [sys.executable, get_slave_file()] + self.transport.slave_args +
+            ['--tactical-module-path', tactical_module_path,
+             '--strategic-module-path', strategic_module_path,
+             '--ready-fd', str(ready_write_fd)],
+            stdout=self.stdout, stderr=self.stderr, pass_fds=self.transport.pass_fds + (ready_write_fd,))
+        os.close(ready_write_fd)
+        self.transport.slave_started()
 
     def is_dead(self):
         return self.subprocess.poll() is not None
 
+    def read_ready_token(self):
+        """Reads the ready pipe, once it's readable, and returns whether the slave signaled it's ready."""
+        self._signaled_ready = os.read(self.ready_fd, len(transports.READY_TOKEN)) == transports.READY_TOKEN
+        os.close(self.ready_fd)
+        self.ready_fd = None
+        return self._signaled_ready
+
     def is_ready(self):
-        if self.subprocess.poll() is not None:
-            return False
-        try:
-            conn = http.client.HTTPConnection('localhost', self.port, timeout=0.5)
-            conn.request('HEAD', '/isup')
-            response = conn.getresponse()
-            return response.status == 200
-        except:
+        if not self._signaled_ready or self.subprocess.poll() is not None:
             return False
+        return self.transport.is_ready()
 
-    def send_turn_request(self, turn_data):
-        assert self.conn is None
-        self.conn = http.client.HTTPConnection('localhost', self.port, timeout=TIMEOUT)
-        self.conn.request('POST', '/turn', json.dumps(turn_data), REQUEST_HEADERS)
+    def encode_view(self, game, country):
+        """Returns the game view of the given country as a list of encoded parts, for build_turn_request.
 
-    def get_turn_response(self):
-        assert self.conn is not None
-        response = self.conn.getresponse()
-        self.conn = None
-        if response.status != 200:
-            raise ValueError(response.reason)
-        return json.load(codecs.getreader('utf-8')(response))
+        These are the tiles encoded by the codec of the slave in the tiles wire
+        format, or a single JSON encoded part in the other ones. This leaves the
+        slave unchanged (besides the contents of its shared view), so it may run
+        in a worker process.
+        """
+        if self.wire_format == 'columnar':
+            return [json.dumps(game.to_dict_as_seen_by(country, columnar=True))]
+        if self.wire_format == 'shared':
+            return [self.shared_view.write(game.to_dict_as_seen_by(country, columnar=True))]
+        if self.codec is codec.JSON:
+            # The engine caches the JSON encodings of tiles.
+            return game.encode_tiles_as_seen_by(country)
+        view = game.to_dict_as_seen_by(country)
+        return self.codec.encode_tiles(view['tiles'], view['all_countries'])
+
+    def build_turn_request(self, game, country, view_parts):
+        """Returns the turn request of the given country, given its view as returned by encode_view."""
+        if self.wire_format != 'tiles':
+            return view_parts[0].encode('utf8')
+        view_fields = game.view_fields_as_seen_by(country)
+        encoded_tiles = tiles_to_send = view_parts
+        if self.delta_turns:
+            if self._sent_tiles is not None:
+                view_fields = dict(view_fields, delta=True)
+                tiles_to_send = [tile for tile, sent_tile in zip(encoded_tiles, self._sent_tiles) if tile != sent_tile]
+            self._sent_tiles = encoded_tiles
+        return self.codec.encode_turn_request(view_fields, tiles_to_send)
+
+    def encode_turn_request(self, game, country):
+        """Returns the encoded game view of the given country, in the wire format and codec of this slave."""
+        return self.build_turn_request(game, country, self.encode_view(game, country))
+
+    async def play_turn(self, turn_data):
+        """Sends a turn request, as returned by encode_turn_request, and returns the commands of the slave."""
+        try:
+            return await self.transport.exchange_turn(turn_data, self.codec)
+        except (Exception, asyncio.CancelledError):
+            # The slave may have missed this turn (or the master gave up on it), so the next request must carry the
+            # full view.
+            self._sent_tiles = None
+            raise
+
+    def abandon_turn(self):
+        """Gives up on the turn in flight, after it missed the turn deadline."""
+        self._sent_tiles = None
+        self.transport.reset()
+
+    def reset_game(self):
+        """Gets the slave ready for a new game, raising transports.TransportError if it can't.
+
+        This fails if the bot modules of the slave still hold global state from
+        the previous game, after their reset hooks were called.
+        """
+        self._sent_tiles = None
+        self.transport.reset_game()
 
     def kill(self):
         self.subprocess.kill()
         self.subprocess.wait()
+        self.transport.close()
+        if self.ready_fd is not None:
+            os.close(self.ready_fd)
+            self.ready_fd = None
+        if self.shared_view is not None:
+            self.shared_view.close()
+            self.shared_view = None
         if self.stdout is not None:
             self.stdout.close()
             self.stdout = None
@@ -125,23 +355,231 @@ class Slave(object):
             self.stderr = None
 
 
+def load_bot_module(module_path, module_name):
+    """Loads the bot module at the given path under the given name, without sharing it with other bots."""
+    module_dir = os.path.dirname(os.path.abspath(module_path))
+    # The bot may import its neighbouring modules.
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class InProcessSlave(object):
+    """Runs the bot of a country in the master process, handing it the game view without encoding it.
+
+    Each country loads its own copy of the bot modules, though modules they
+    import are shared. In the inline mode, turns block the event loop of the
+    master, so the turn deadline can't cut them short. In the thread mode,
+    every slave plays its turns in a thread of its own, and a late turn only
+    loses its commands.
+    """
+
+    def __init__(self, tactical_module_path, strategic_module_path, module_prefix, mode='inline',
+                 wire_format='tiles'):
+        super(InProcessSlave, self).__init__()
+        if mode not in IN_PROCESS_MODES:
+            raise ValueError('Unknown in-process mode {}'.format(mode))
+        if wire_format not in ('tiles', 'columnar'):
+            raise ValueError('In-process bots support only the tiles and columnar wire formats')
+        self.wire_format = wire_format
+        self.bot_modules = [load_bot_module(tactical_module_path, module_prefix + '_tactical'),
+                            load_bot_module(strategic_module_path, module_prefix + '_strategic')]
+        self.tactical_callback = self.bot_modules[0].get_strategic_implementation
+        self.strategic_callback = self.bot_modules[1].do_turn
+        self.ready_fd = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if mode == 'thread' else None
+
+    def is_dead(self):
+        return False
+
+    def is_ready(self):
+        return True
+
+    def encode_view(self, game, country):
+        # The engine builds the view dicts anew, without sharing its own, so the bot may keep or change them.
+        return [game.to_dict_as_seen_by(country, columnar=self.wire_format == 'columnar')]
+
+    def build_turn_request(self, game, country, view_parts):
+        return view_parts[0]
+
+    def encode_turn_request(self, game, country):
+        return self.build_turn_request(game, country, self.encode_view(game, country))
+
+    def _play_turn(self, view):
+        context = TurnContext(view)
+        self.strategic_callback(self.tactical_callback(context))
+        return context.get_result()
+
+    async def play_turn(self, view):
+        """Plays a turn given the game view, and returns the commands of the bot."""
+        if self._executor is None:
+            return self._play_turn(view)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._play_turn, view)
+
+    def abandon_turn(self):
+        pass
+
+    def reset_game(self):
+        """Calls the reset hooks of the bot modules, like the reset of a slave process before a new game."""
+        for module in self.bot_modules:
+            reset_hook = getattr(module, RESET_HOOK, None)
+            if reset_hook is not None:
+                reset_hook()
+
+    def kill(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class SlavePool(object):
+    """Keeps warm slave processes, with their bot modules loaded, and hands them to successive games.
+
+    Slaves that come back from a game are reset, and replaced by fresh ones if
+    they died or if their bot modules leaked global state.
+    """
+
+    def __init__(self, output_dir=None, **slave_options):
+        """slave_options are passed to every Slave, besides the module paths and output location."""
+        super(SlavePool, self).__init__()
+        self.output_dir = output_dir
+        self.slave_options = slave_options
+        # dict: (tactical module path, strategic module path) -> idle slaves
+        self._idle_slaves = {}
+        # dict: slave -> its module paths
+        self._module_paths = {}
+        self._started_slaves = 0
+
+    def _start_slave(self, module_paths):
+        self._started_slaves += 1
+        output_location = os.path.join(self.output_dir, 'slave-{}'.format(
+            self._started_slaves)) if self.output_dir else None
+        slave = Slave(*module_paths, output_location=output_location, **self.slave_options)
+        self._module_paths[slave] = module_paths
+        return slave
+
+    def acquire(self, tactical_module_path, strategic_module_path):
+        """Returns an idle slave running the given modules, starting one if needed."""
+        module_paths = (tactical_module_path, strategic_module_path)
+        idle_slaves = self._idle_slaves.get(module_paths, [])
+        while idle_slaves:
+            slave = idle_slaves.pop()
+            if not slave.is_dead():
+                return slave
+            self._discard(slave)
+        return self._start_slave(module_paths)
+
+    def release(self, slave, reuse=True):
+        """Takes back a slave after its game, and resets it for the next one.
+
+        If reuse is False, there is no next game, so the slave is killed instead.
+        """
+        if not reuse:
+            self._discard(slave)
+            return
+        try:
+            if slave.is_dead():
+                raise transports.TransportError('The slave exited')
+            slave.reset_game()
+        except Exception as e:
+            print('Replacing slave of {}: {}'.format(self._module_paths[slave][0], e))
+            module_paths = self._module_paths[slave]
+            self._discard(slave)
+            # Start the replacement right away, so it's warm by the next game.
+            slave = self._start_slave(module_paths)
+        self._idle_slaves.setdefault(self._module_paths[slave], []).append(slave)
+
+    def _discard(self, slave):
+        del self._module_paths[slave]
+        try:
+            slave.kill()
+        except Exception:
+            pass
+
+    def close(self):
+        for slave in list(self._module_paths):
+            self._discard(slave)
+        self._idle_slaves.clear()
+
+
 class Master(object):
-    def __init__(self, game, slaves, slaves_output_dir=None, game_log=None, expected_turns=0):
+    def __init__(self, game, slaves, slaves_output_dir=None, game_log=None, expected_turns=0, delta_turns=False,
+                 wire_format='tiles', transport='http', turn_timeout=transports.TIMEOUT, parallel_encoding=False,
+                 codec_name='json', slave_pool=None, in_process=None, compress_threshold=None,
+                 keyframe_interval=KEYFRAME_INTERVAL, log_queue=MAX_PENDING_TURNS):
         """Initializes the master game.
 
         slaves is a dict from country name to their code module path.
+
+        If slave_pool is given, the slaves are taken from it, and given back to it
+        by finalize, instead of being started and killed by the master. Its
+        options then apply instead of the slave options given here.
+
+        game_log is the path of the game log, see game_log.GameLogWriter for the
+        meaning of keyframe_interval. Paths ending with replay.REPLAY_EXTENSION get
+        a replay archive instead of a gzipped tarball, and paths ending with
+        command_log.COMMAND_LOG_EXTENSION get a command log. If log_queue is positive, the log is written
+        by a background thread, with at most log_queue turns waiting for it.
+
+        If in_process is one of IN_PROCESS_MODES, the bots run in this process,
+        see InProcessSlave. Only the wire format applies to them then.
+
+        turn_timeout is the time (in seconds) the slaves have for responding to
+        each turn, counted from its start, so it includes encoding the requests.
+
+        If parallel_encoding is True, the views of the countries are encoded by
+        worker processes, which pays off on large maps with enough CPUs. They are
+        forked, which is unsafe while other threads run, so this rules out a
+        background log writer and in-process bots in threads.
         """
         super(Master, self).__init__()
+        if parallel_encoding and ((game_log is not None and log_queue > 0) or in_process == 'thread'):
+            raise ValueError('Parallel encoding forks the master, so it rules out the game log writer thread and '
+                             'in-process bots in threads')
         self.game = game
-        self.slaves = {game.get_country(country): Slave(module_paths['tactical'], module_paths['strategic'],
-                                                        output_location=os.path.join(slaves_output_dir,
-                                                                                     country) if slaves_output_dir else None)
-                       for country, module_paths in slaves.items()}
+        self.turn_timeout = turn_timeout
+        self.parallel_encoding = parallel_encoding and hasattr(os, 'fork')
+        self.loop = asyncio.new_event_loop()
+        self.slave_pool = slave_pool
+        if in_process is not None:
+            self.slaves = {game.get_country(country): InProcessSlave(module_paths['tactical'],
+                                                                     module_paths['strategic'],
+                                                                     'pywar_bot_{}'.format(i),
+                                                                     mode=in_process,
+                                                                     wire_format=wire_format)
+                           for i, (country, module_paths) in enumerate(slaves.items())}
+        elif slave_pool is not None:
+            self.slaves = {game.get_country(country): slave_pool.acquire(module_paths['tactical'],
+                                                                         module_paths['strategic'])
+                           for country, module_paths in slaves.items()}
+        else:
+            self.slaves = {game.get_country(country): Slave(module_paths['tactical'], module_paths['strategic'],
+                                                            output_location=os.path.join(slaves_output_dir, country)
+                                                            if slaves_output_dir else None,
+                                                            delta_turns=delta_turns,
+                                                            wire_format=wire_format,
+                                                            transport=transport,
+                                                            codec_name=codec_name,
+                                                            compress_threshold=compress_threshold,
+                                                            turn_timeout=turn_timeout)
+                           for country, module_paths in slaves.items()}
+        writer_class = GameLogWriter
+        if game_log is not None and game_log.endswith(replay.REPLAY_EXTENSION):
+            writer_class = replay.ReplayWriter
+        elif game_log is not None and game_log.endswith(COMMAND_LOG_EXTENSION):
+            writer_class = CommandLogWriter
         if game_log is None:
             self.game_log = None
+        elif log_queue > 0:
+            self.game_log = BackgroundGameLogWriter(game_log, keyframe_interval=keyframe_interval,
+                                                    expected_turns=expected_turns, max_pending_turns=log_queue,
+                                                    writer_class=writer_class)
         else:
-            self.game_log = tarfile.open(game_log, mode='w:gz')
-        self._turn_name_padding = len(str(expected_turns))
+            self.game_log = writer_class(game_log, keyframe_interval=keyframe_interval,
+                                         expected_turns=expected_turns)
+        self.log_game_info()
 
     def wait_for_ready_slaves(self, timeout=None):
         """Block until all slaves are ready.
@@ -150,20 +588,23 @@ class Master(object):
         the slaves.
 
         If all slaves are ready, True is returned. If we've reached the given
-        timeout, False is returned.
+        timeout, or a slave exited before getting ready, False is returned.
         """
-        start_time = time.time()
-        while timeout is None or time.time() - start_time < timeout:
+        deadline = None if timeout is None else time.time() + timeout
+        with selectors.DefaultSelector() as selector:
             for slave in self.slaves.values():
-                if slave.is_dead():
+                if slave.ready_fd is not None:
+                    selector.register(slave.ready_fd, selectors.EVENT_READ, slave)
+            while selector.get_map():
+                events = selector.select(None if deadline is None else max(deadline - time.time(), 0))
+                if not events:
                     return False
-                if not slave.is_ready():
-                    break
-            else:
-                return True
-            print('Slaves are not ready yet, sleeping for 1 second...')
-            time.sleep(1)
-        return False
+                for key, _ in events:
+                    selector.unregister(key.fd)
+                    # A slave that exits closes the pipe without a token.
+                    if not key.data.read_ready_token():
+                        return False
+        return all(slave.is_ready() for slave in self.slaves.values())
 
     def get_non_ready_slaves(self):
         """Returns the list of country names whose corresponding slaves that are not ready.
@@ -172,47 +613,67 @@ class Master(object):
         """
         return [country.name for country, slave in self.slaves.items() if not slave.is_ready()]
 
-    def run_turn(self):
-        for country, slave in self.slaves.items():
-            turn_data = self.game.to_dict_as_seen_by(country)
-            slave.send_turn_request(turn_data)
-
-        turn_commands = {}
-        for country, slave in self.slaves.items():
-            try:
-                commands = slave.get_turn_response()
-            except Exception as e:
-                print('Failed getting country {} commands: {}'.format(country.name, e))
-                turn_commands[country] = []
-            else:
-                turn_commands[country] = commands
-
-        self.game.apply_turn(turn_commands)
-        self.log_turn(turn_commands)
-
-    def countries_in_game(self):
-        """Returns the list of countries that still participate in the game.
-
-        A country participates in the game if and only if it has at least one tile,
-        or at least one piece.
+    async def _encode_view(self, country, slave):
+        try:
+            return country, await encode_in_worker(lambda: slave.encode_view(self.game, country))
+        except Exception as e:
+            print('Failed encoding the view of country {} in a worker: {}'.format(country.name, e))
+            return country, slave.encode_view(self.game, country)
+
+    async def encode_turn_requests(self):
+        """Yields (country, turn request) pairs, as soon as each request is encoded."""
+        if not self.parallel_encoding:
+            for country, slave in self.slaves.items():
+                yield country, slave.encode_turn_request(self.game, country)
+            return
+        for view in asyncio.as_completed([self._encode_view(country, slave)
+                                          for country, slave in self.slaves.items()]):
+            country, view_parts = await view
+            yield country, self.slaves[country].build_turn_request(self.game, country, view_parts)
+
+    async def collect_turn_commands(self):
+        """Sends the turn requests to all slaves at once, and returns a dict from country to its commands.
+
+        The dict is ordered like the slaves, whatever order the requests were
+        encoded in. Slaves that fail, or miss the turn deadline, get an empty
+        command list. The deadline is turn_timeout seconds from the start of the
+        turn, before the requests are encoded.
         """
-        return [country for country in self.game.countries if len(country.tiles) > 0 and len(country.pieces) > 0]
-
-    def run_turn(self):
-        for country, slave in self.slaves.items():
-            turn_data = self.game.to_dict_as_seen_by(country)
-            slave.send_turn_request(turn_data)
-
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.turn_timeout
+        tasks = {}
+        async for country, turn_data in self.encode_turn_requests():
+            tasks[country] = asyncio.ensure_future(self.slaves[country].play_turn(turn_data))
+            # Let the slave start on its request while the next ones are encoded.
+            await asyncio.sleep(0)
+        if not tasks:
+            return {}
+        _, late_tasks = await asyncio.wait(tasks.values(), timeout=max(deadline - loop.time(), 0))
+        for task in late_tasks:
+            task.cancel()
+        await asyncio.gather(*late_tasks, return_exceptions=True)
+
+        # The engine applies the commands by the order of the countries, so it mustn't depend on which request
+        # was encoded first.
         turn_commands = {}
-        for country, slave in self.slaves.items():
-            try:
-                commands = slave.get_turn_response()
-            except Exception as e:
-                print('Failed getting country {} commands: {}'.format(country.name, e))
+        for country in self.slaves:
+            task = tasks[country]
+            if task in late_tasks:
+                print('Country {} missed the turn deadline'.format(country.name))
+                self.slaves[country].abandon_turn()
+                turn_commands[country] = []
+            elif task.cancelled():
+                print('The turn of country {} was cancelled'.format(country.name))
+                turn_commands[country] = []
+            elif task.exception() is not None:
+                print('Failed getting country {} commands: {}'.format(country.name, task.exception()))
                 turn_commands[country] = []
             else:
-                turn_commands[country] = commands
+                turn_commands[country] = task.result()
+        return turn_commands
 
+    def run_turn(self):
+        turn_commands = self.loop.run_until_complete(self.collect_turn_commands())
         commands_info = {country.name: self.add_piece_data(country, commands) for country, commands in
                          turn_commands.items()}
         self.game.apply_turn(turn_commands)
@@ -226,17 +687,16 @@ class Master(object):
         """
         return [country for country in self.game.countries if len(country.tiles) > 0 and len(country.pieces) > 0]
 
+    def log_game_info(self):
+        """Logs the information required for reproducing the game."""
+        if self.game_log is None:
+            return
+        self.game_log.write_info({'seed': self.game.seed, 'map': self.game.to_dict()})
+
     def log_turn(self, commands_info):
         if self.game_log is None:
             return
-        turn_dict = {
-            'state': self.game.to_dict(),
-            'commands': commands_info,
-        }
-        turn_data = json.dumps(turn_dict).encode('utf8')
-        info = tarfile.TarInfo('turn-{}.json'.format(str(self.game.turns).zfill(self._turn_name_padding)))
-        info.size = len(turn_data)
-        self.game_log.addfile(info, io.BytesIO(turn_data))
+        self.game_log.write_turn(self.game, commands_info)
 
     def add_piece_data(self, country, commands):
         def mapping(command):
@@ -251,34 +711,56 @@ class Master(object):
 
         return list(map(mapping, commands))
 
-    def finalize(self):
+    def finalize(self, reuse_slaves=True):
+        """Ends the game. Slaves of a slave pool are given back to it, to be reused if reuse_slaves is True."""
         for slave in self.slaves.values():
+            if self.slave_pool is not None:
+                self.slave_pool.release(slave, reuse=reuse_slaves)
+                continue
             try:
                 slave.kill()
             except:
                 pass
         if self.game_log is not None:
-            self.game_log.close()
-            self.game_log = None
+            game_log, self.game_log = self.game_log, None
+            try:
+                # Waits for the turns that the log writer thread didn't write yet.
+                game_log.close()
+            except Exception as e:
+                print('Failed writing the game log: {}'.format(e))
+        self.loop.close()
 
 
-def main(args):
-    print('Loading map JSON...')
-    with open(args.map, 'r') as map_file:
-        game_dict = json.load(map_file)
-    print('Loading slaves configuration...')
-    with open(args.slaves, 'r') as slaves_file:
-        slaves_dict = json.load(slaves_file)
+def get_numbered_path(path, number):
+    """Returns the path with the given number added to the file name, such as log/game-2.tar.gz."""
+    directory, file_name = os.path.split(path)
+    base_name, dot, extensions = file_name.partition('.')
+    return os.path.join(directory, '{}-{}{}{}'.format(base_name, number, dot, extensions))
+
+
+def play_game(args, game_dict, slaves_dict, seed, game_log, slave_pool=None, last_game=True):
     print('Initializing game...')
-    game = engine.game_from_dict(game_dict)
+    game = engine.game_from_dict(game_dict, seed=seed, visibility_backend=args.visibility_backend)
+    print('Game seed is {}.'.format(game.seed))
     print('Initializing slaves...')
     master = Master(game, slaves_dict,
                     slaves_output_dir=args.slaves_output,
-                    game_log=args.game_log,
-                    expected_turns=args.turns)
+                    game_log=game_log,
+                    expected_turns=args.turns,
+                    delta_turns=args.delta_turns,
+                    wire_format=args.wire_format,
+                    transport=args.transport,
+                    turn_timeout=args.turn_timeout,
+                    parallel_encoding=args.parallel_encoding,
+                    codec_name=args.codec,
+                    slave_pool=slave_pool,
+                    in_process=args.in_process,
+                    compress_threshold=args.compress_threshold,
+                    keyframe_interval=args.keyframe_interval,
+                    log_queue=args.log_queue)
     try:
         print('Waiting for slaves to be ready...')
-        if not master.wait_for_ready_slaves():
+        if not master.wait_for_ready_slaves(args.slaves_timeout):
             non_ready_slaves = master.get_non_ready_slaves()
             print('Game over automatically for the countries: {}'.format(', '.join(non_ready_slaves)))
             return
@@ -294,7 +776,38 @@ def main(args):
         game_end_time = time.time()
         print('Game completed after {:.3} seconds.'.format(game_end_time - game_start_time))
     finally:
-        master.finalize()
+        master.finalize(reuse_slaves=not last_game)
+
+
+def main(args):
+    print('Loading map JSON...')
+    with open(args.map, 'r') as map_file:
+        game_dict = json.load(map_file)
+    print('Loading slaves configuration...')
+    with open(args.slaves, 'r') as slaves_file:
+        slaves_dict = json.load(slaves_file)
+    slave_pool = None
+    # In-process bots are loaded anew for every game, without the pool.
+    if args.games > 1 and args.in_process is None:
+        slave_pool = SlavePool(output_dir=args.slaves_output,
+                               delta_turns=args.delta_turns,
+                               wire_format=args.wire_format,
+                               transport=args.transport,
+                               codec_name=args.codec,
+                               compress_threshold=args.compress_threshold,
+                               turn_timeout=args.turn_timeout)
+    try:
+        for game_num in range(1, args.games + 1):
+            if args.games == 1:
+                seed, game_log = args.seed, args.game_log
+            else:
+                print('Playing game {}...'.format(game_num))
+                seed = None if args.seed is None else args.seed + game_num - 1
+                game_log = get_numbered_path(args.game_log, game_num)
+            play_game(args, game_dict, slaves_dict, seed, game_log, slave_pool, last_game=game_num == args.games)
+    finally:
+        if slave_pool is not None:
+            slave_pool.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,542 @@
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import codec
+import command_log
+from common_types import Coordinates
+import commands
+import engine
+import master
+from tactical_api import TurnContext
+import transports
+
+TACTICAL_BOT = '''
+def get_strategic_implementation(context):
+    return context
+'''
+# The pieces of a view come from sets, so they are sorted to give the commands in the same order in every game.
+STRATEGIC_BOT = '''
+def do_turn(context):
+    for piece in sorted(context.my_pieces.values(), key=lambda piece: piece.id):
+        piece.attack()
+'''
+
+
+class TestMaster(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.module_paths = {'tactical': os.path.join(directory, 'tactical.py'),
+                             'strategic': os.path.join(directory, 'strategic.py')}
+        with open(self.module_paths['tactical'], 'w') as tactical_file:
+            tactical_file.write(TACTICAL_BOT)
+        with open(self.module_paths['strategic'], 'w') as strategic_file:
+            strategic_file.write(STRATEGIC_BOT)
+
+    def create_master(self, seed, in_process='inline', **master_options):
+        """Creates a master for a game with tanks of two countries attacking each other, once its slaves are ready.
+
+        The bots run in-process by default.
+        """
+        game = engine.Game(5, 5, seed=seed)
+        countries = [game.add_country('country 1'), game.add_country('country 2')]
+        for tile in itertools.chain.from_iterable(game.tiles):
+            tile.country = countries[tile.coordinates.x > 2]
+        # Which of the two tanks of the first country survives depends on the order of the commands.
+        for y in range(5):
+            engine.Tank(game, game.tiles[2][y], countries[0])
+            engine.Tank(game, game.tiles[2][y], countries[0])
+            engine.Tank(game, game.tiles[2][y], countries[1])
+        game_master = master.Master(game, {country.name: self.module_paths for country in sorted(
+            game.countries, key=lambda country: country.name)}, in_process=in_process, **master_options)
+        self.addCleanup(game_master.finalize)
+        self.assertTrue(game_master.wait_for_ready_slaves(timeout=10))
+        # The view of the first country is encoded last, when encoded in parallel.
+        first_slave = next(iter(game_master.slaves.values()))
+        encode_view = first_slave.encode_view
+
+        def slow_encode_view(game, country):
+            time.sleep(0.05)
+            return encode_view(game, country)
+
+        first_slave.encode_view = slow_encode_view
+        return game_master
+
+    def play(self, seed, turns, **master_options):
+        """Plays the given amount of turns, and returns the hash of the resulting game state."""
+        game_master = self.create_master(seed, **master_options)
+        for _ in range(turns):
+            game_master.run_turn()
+        return command_log.state_hash(game_master.game.to_dict())
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'parallel encoding requires fork')
+    def test_parallel_encoding_keeps_country_order(self):
+        game_master = self.create_master(1, parallel_encoding=True)
+        turn_commands = game_master.loop.run_until_complete(game_master.collect_turn_commands())
+        self.assertEqual(list(turn_commands), list(game_master.slaves))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'parallel encoding requires fork')
+    def test_parallel_encoding_plays_like_serial_encoding(self):
+        for seed in range(5):
+            self.assertEqual(self.play(seed, 3, parallel_encoding=True), self.play(seed, 3))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'parallel encoding requires fork')
+    def test_parallel_encoding_refuses_threads(self):
+        log_path = os.path.join(tempfile.mkdtemp(), 'game.tar.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(log_path))
+        with self.assertRaises(ValueError):
+            self.create_master(1, in_process='thread', parallel_encoding=True)
+        with self.assertRaises(ValueError):
+            self.create_master(1, game_log=log_path, parallel_encoding=True)
+        game_master = self.create_master(1, game_log=log_path, parallel_encoding=True, log_queue=0)
+        self.assertTrue(game_master.parallel_encoding)
+
+    def test_slave_processes_play_like_in_process_bots(self):
+        for transport in ['pipe', 'unix']:
+            with self.subTest(transport=transport):
+                self.assertEqual(self.play(1, 3, in_process=None, transport=transport), self.play(1, 3))
+
+
+# Counts its turns and resets, and changes the view it gets, which mustn't change the game.
+COUNTING_STRATEGIC_BOT = '''
+turns = []
+resets = []
+
+
+def do_turn(context):
+    turns.append(context.my_country)
+    context._turn_data['tiles'][0]['coordinate']['x'] = -1
+    for piece in context.my_pieces.values():
+        piece.attack()
+
+
+def reset_game():
+    resets.append(len(turns))
+'''
+
+
+class TestInProcessSlave(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.tactical_path = os.path.join(directory, 'tactical.py')
+        self.strategic_path = os.path.join(directory, 'strategic.py')
+        with open(self.tactical_path, 'w') as tactical_file:
+            tactical_file.write(TACTICAL_BOT)
+        with open(self.strategic_path, 'w') as strategic_file:
+            strategic_file.write(COUNTING_STRATEGIC_BOT)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_play_turns_and_reset(self):
+        for mode in master.IN_PROCESS_MODES:
+            with self.subTest(mode=mode):
+                game = engine.Game(3, 3, seed=1)
+                country = game.add_country('country 1')
+                game.tiles[0][0].country = country
+                tank = engine.Tank(game, game.tiles[0][0], country)
+                game.apply_turn({})
+                slave = master.InProcessSlave(self.tactical_path, self.strategic_path, 'test_bot_' + mode, mode=mode)
+                self.addCleanup(slave.kill)
+                for _ in range(3):
+                    turn_commands = self.loop.run_until_complete(
+                        slave.play_turn(slave.encode_turn_request(game, country)))
+                    self.assertEqual(turn_commands, [{'name': 'meleeAttack', 'pieceId': tank.id}])
+                    game.apply_turn({country: turn_commands})
+                self.assertEqual(game.tiles[0][0].to_dict()['coordinate'], {'x': 0, 'y': 0})
+                strategic_module = slave.bot_modules[1]
+                self.assertEqual(strategic_module.turns, ['country 1'] * 3)
+                slave.reset_game()
+                self.assertEqual(strategic_module.resets, [3])
+
+
+class FakeSlave(object):
+    def __init__(self):
+        super(FakeSlave, self).__init__()
+        self.resets = 0
+        self.killed = False
+
+    def is_dead(self):
+        return self.killed
+
+    def reset_game(self):
+        self.resets += 1
+
+    def kill(self):
+        self.killed = True
+
+
+class TestSlavePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = master.SlavePool()
+        self.pool._start_slave = self.start_slave
+        self.addCleanup(self.pool.close)
+
+    def start_slave(self, module_paths):
+        slave = FakeSlave()
+        self.pool._module_paths[slave] = module_paths
+        return slave
+
+    def test_reuses_released_slaves(self):
+        slave = self.pool.acquire('tactical.py', 'strategic.py')
+        self.pool.release(slave)
+        self.assertEqual(slave.resets, 1)
+        self.assertIs(self.pool.acquire('tactical.py', 'strategic.py'), slave)
+
+    def test_kills_slaves_after_last_game(self):
+        slave = self.pool.acquire('tactical.py', 'strategic.py')
+        self.pool.release(slave, reuse=False)
+        self.assertEqual(slave.resets, 0)
+        self.assertTrue(slave.killed)
+        self.assertIsNot(self.pool.acquire('tactical.py', 'strategic.py'), slave)
+
+
+# Remembers the coordinates of its pieces across turns, and forgets them on reset only if RESET_HOOK is set.
+LEAKING_STRATEGIC_BOT = '''
+tank_to_coordinate_to_attack = {}
+
+
+def do_turn(context):
+    for piece in context.my_pieces.values():
+        tank_to_coordinate_to_attack[piece.id] = piece.tile.coordinates
+'''
+RESET_HOOK = '''
+
+def reset_game():
+    tank_to_coordinate_to_attack.clear()
+'''
+
+
+class TestSlavePoolProcesses(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pool = master.SlavePool(transport='pipe')
+        self.addCleanup(self.pool.close)
+
+    def play_game(self, strategic_bot):
+        """Plays a turn with a pooled slave running the given strategic bot, and returns the slave and its paths."""
+        module_paths = {'tactical': os.path.join(self.directory, 'tactical.py'),
+                        'strategic': os.path.join(self.directory, 'strategic.py')}
+        with open(module_paths['tactical'], 'w') as tactical_file:
+            tactical_file.write(TACTICAL_BOT)
+        with open(module_paths['strategic'], 'w') as strategic_file:
+            strategic_file.write(strategic_bot)
+        game = engine.Game(3, 3, seed=1)
+        country = game.add_country('country 1')
+        game.tiles[0][0].country = country
+        engine.Tank(game, game.tiles[0][0], country)
+        game.apply_turn({})
+        game_master = master.Master(game, {country.name: module_paths}, slave_pool=self.pool)
+        try:
+            self.assertTrue(game_master.wait_for_ready_slaves(timeout=10))
+            game_master.run_turn()
+        finally:
+            game_master.finalize()
+        return game_master.slaves[country], module_paths
+
+    def test_replaces_slaves_leaking_globals(self):
+        slave, module_paths = self.play_game(LEAKING_STRATEGIC_BOT)
+        self.assertTrue(slave.is_dead())
+        self.assertIsNot(self.pool.acquire(module_paths['tactical'], module_paths['strategic']), slave)
+
+    def test_reuses_slaves_resetting_globals(self):
+        slave, module_paths = self.play_game(LEAKING_STRATEGIC_BOT + RESET_HOOK)
+        self.assertFalse(slave.is_dead())
+        self.assertIs(self.pool.acquire(module_paths['tactical'], module_paths['strategic']), slave)
+
+
+def summarize_context(context):
+    """Returns the fields of a turn context, with its tiles and pieces as comparable tuples."""
+    return {
+        'tiles': {coordinates: (tile.money, tile.country, sorted((piece.id, piece.type, piece.country)
+                                                                 for piece in tile.pieces))
+                  for coordinates, tile in context.tiles.items()},
+        'my_pieces': sorted(context.my_pieces),
+        'all_pieces': sorted(context.all_pieces),
+        'size': (context.game_width, context.game_height),
+        'countries': (context.my_country, context.all_countries),
+    }
+
+
+class TestSharedView(unittest.TestCase):
+    def setUp(self):
+        self.shared_view = master.SharedView()
+        self.addCleanup(self.shared_view.close)
+
+    def test_shared_view_matches_tiles_format(self):
+        game = engine.Game(12, 10, seed=1)
+        countries = [game.add_country('country 1'), game.add_country('country 2')]
+        for tile in itertools.chain.from_iterable(game.tiles):
+            tile.country = countries[tile.coordinates.x >= 6] if tile.coordinates.y < 8 else None
+            tile.money = tile.coordinates.x * 10 + tile.coordinates.y
+        engine.Tank(game, game.tiles[5][2], countries[0])
+        engine.Builder(game, game.tiles[5][2], countries[0])
+        engine.Artillery(game, game.tiles[6][3], countries[1])
+        engine.Tank(game, game.tiles[11][9], countries[1])
+        game.apply_turn({})
+        for country in countries:
+            tiles_context = TurnContext(json.loads(game.to_json_as_seen_by(country)))
+            shared_context = TurnContext(json.loads(self.shared_view.write(
+                game.to_dict_as_seen_by(country, columnar=True))))
+            # Tiles out of sight have no money, which the shared view marks separately.
+            self.assertIn(None, [tile.money for tile in tiles_context.tiles.values()])
+            self.assertEqual(summarize_context(shared_context), summarize_context(tiles_context))
+
+
+class TestReadiness(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def create_master(self, strategic_bot):
+        """Creates a master with a slave process per country, given the code of the strategic bot of the second one."""
+        module_paths = []
+        for i, bot in enumerate([STRATEGIC_BOT, strategic_bot]):
+            paths = {'tactical': os.path.join(self.directory, 'tactical.py'),
+                     'strategic': os.path.join(self.directory, 'strategic{}.py'.format(i))}
+            with open(paths['tactical'], 'w') as tactical_file:
+                tactical_file.write(TACTICAL_BOT)
+            with open(paths['strategic'], 'w') as strategic_file:
+                strategic_file.write(bot)
+            module_paths.append(paths)
+        game = engine.Game(3, 3, seed=1)
+        countries = [game.add_country('country 1'), game.add_country('country 2')]
+        game_master = master.Master(game, {country.name: paths for country, paths in zip(countries, module_paths)},
+                                    transport='pipe')
+        self.addCleanup(game_master.finalize)
+        return game_master
+
+    def test_ready_slaves(self):
+        game_master = self.create_master(STRATEGIC_BOT)
+        self.assertTrue(game_master.wait_for_ready_slaves(timeout=10))
+        self.assertEqual(game_master.get_non_ready_slaves(), [])
+
+    def test_slave_exiting_before_ready(self):
+        game_master = self.create_master('raise SystemExit(1)\n')
+        start_time = time.time()
+        self.assertFalse(game_master.wait_for_ready_slaves(timeout=10))
+        self.assertLess(time.time() - start_time, 5)
+        self.assertIn('country 2', game_master.get_non_ready_slaves())
+
+    def test_hung_slave(self):
+        game_master = self.create_master('import time\ntime.sleep(60)\n')
+        start_time = time.time()
+        self.assertFalse(game_master.wait_for_ready_slaves(timeout=0.5))
+        self.assertLess(time.time() - start_time, 5)
+
+
+class ScriptedTransport(object):
+    """Stands for the transport of a slave, answering turns after a delay, or failing."""
+
+    def __init__(self, transport, delay=0, error=None):
+        super(ScriptedTransport, self).__init__()
+        self._transport = transport
+        self.delay = delay
+        self.error = error
+        self.resets = 0
+
+    async def exchange_turn(self, turn_data, turn_codec):
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [{'name': 'meleeAttack', 'pieceId': 1}]
+
+    def reset(self):
+        self.resets += 1
+
+    def close(self):
+        self._transport.close()
+
+
+class TestTurnDeadline(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        module_paths = {'tactical': os.path.join(directory, 'tactical.py'),
+                        'strategic': os.path.join(directory, 'strategic.py')}
+        with open(module_paths['tactical'], 'w') as tactical_file:
+            tactical_file.write(TACTICAL_BOT)
+        with open(module_paths['strategic'], 'w') as strategic_file:
+            strategic_file.write(STRATEGIC_BOT)
+        game = engine.Game(3, 3, seed=1)
+        self.countries = [game.add_country('country {}'.format(i)) for i in range(1, 4)]
+        self.master = master.Master(game, {country.name: module_paths for country in self.countries},
+                                    transport='pipe', turn_timeout=0.4)
+        self.addCleanup(self.master.finalize)
+        self.assertTrue(self.master.wait_for_ready_slaves(timeout=10))
+        self.slaves = [self.master.slaves[country] for country in self.countries]
+
+    def collect_turn_commands(self):
+        """Returns the commands of a turn, and how long it took."""
+        start_time = time.time()
+        turn_commands = self.master.loop.run_until_complete(self.master.collect_turn_commands())
+        return turn_commands, time.time() - start_time
+
+    def test_failing_and_late_slaves_lose_their_turn(self):
+        on_time, crashing, late = self.slaves
+        on_time.transport = ScriptedTransport(on_time.transport)
+        crashing.transport = ScriptedTransport(crashing.transport, error=ConnectionResetError('The slave crashed'))
+        late.transport = ScriptedTransport(late.transport, delay=10)
+        turn_commands, duration = self.collect_turn_commands()
+        self.assertEqual(turn_commands, dict(zip(self.countries, [[{'name': 'meleeAttack', 'pieceId': 1}], [], []])))
+        self.assertLess(duration, 2)
+        self.assertEqual([slave.transport.resets for slave in self.slaves], [0, 0, 1])
+        # The late slave plays the next turn as usual.
+        late.transport.delay = 0
+        turn_commands, _ = self.collect_turn_commands()
+        self.assertEqual(turn_commands[self.countries[2]], [{'name': 'meleeAttack', 'pieceId': 1}])
+
+    def test_deadline_starts_before_encoding(self):
+        slow_encoding, late, _ = self.slaves
+        encode_turn_request = slow_encoding.encode_turn_request
+
+        def slow_encode_turn_request(game, country):
+            time.sleep(0.3)
+            return encode_turn_request(game, country)
+
+        slow_encoding.encode_turn_request = slow_encode_turn_request
+        for slave in self.slaves:
+            slave.transport = ScriptedTransport(slave.transport)
+        late.transport.delay = 10
+        turn_commands, duration = self.collect_turn_commands()
+        # Counting the deadline from the end of encoding would take 0.3 + 0.4 seconds.
+        self.assertLess(duration, 0.6)
+        self.assertEqual(turn_commands[self.countries[0]], [{'name': 'meleeAttack', 'pieceId': 1}])
+        self.assertEqual(turn_commands[self.countries[1]], [])
+
+
+class ContextKeepingTransport(object):
+    """Stands for the transport of a slave, keeping the turn context that the slave builds from the requests."""
+
+    def __init__(self, transport):
+        super(ContextKeepingTransport, self).__init__()
+        self._transport = transport
+        self.context = None
+        self.requests = []
+        # Whether the slave misses the next turns, without seeing their requests.
+        self.failing = False
+
+    async def exchange_turn(self, turn_data, turn_codec):
+        request = turn_codec.decode_turn_request(turn_data)
+        self.requests.append(request)
+        if self.failing:
+            raise transports.TransportError('The slave missed the turn')
+        if request.get('delta', False):
+            self.context.apply_delta(request)
+        else:
+            self.context = TurnContext(request)
+        return []
+
+    def reset(self):
+        pass
+
+    def close(self):
+        self._transport.close()
+
+
+class TestDeltaTurns(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.tactical_path = os.path.join(directory, 'tactical.py')
+        self.strategic_path = os.path.join(directory, 'strategic.py')
+        with open(self.tactical_path, 'w') as tactical_file:
+            tactical_file.write(TACTICAL_BOT)
+        with open(self.strategic_path, 'w') as strategic_file:
+            strategic_file.write(STRATEGIC_BOT)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def create_slave(self, codec_name):
+        slave = master.Slave(self.tactical_path, self.strategic_path, delta_turns=True, transport='pipe',
+                             codec_name=codec_name)
+        self.addCleanup(slave.kill)
+        slave.transport = ContextKeepingTransport(slave.transport)
+        return slave
+
+    def test_delta_turns_keep_the_view_of_the_slave(self):
+        for codec_name in sorted(codec.CODECS):
+            with self.subTest(codec=codec_name):
+                game = engine.Game(6, 6, seed=1)
+                country1 = game.add_country('country 1')
+                country2 = game.add_country('country 2')
+                for tile in itertools.chain.from_iterable(game.tiles):
+                    tile.country = country1 if tile.coordinates.x < 3 else country2
+                    tile.money = 10
+                tank1 = engine.Tank(game, game.tiles[0][0], country1)
+                tank2 = engine.Tank(game, game.tiles[0][1], country1)
+                scout = engine.Tank(game, game.tiles[2][2], country1)
+                builder = engine.Builder(game, game.tiles[1][4], country1)
+                # Seen only while the scout is in the territory of the other country.
+                engine.Tank(game, game.tiles[4][2], country2)
+                game.apply_turn({})
+
+                def move(piece, x, y):
+                    return commands.MoveCommand(piece.id, Coordinates(x, y)).to_dict()
+
+                collect = commands.TakeMoneyCommand(builder.id, 5).to_dict()
+                # (commands, whether the slave misses the turn) by turn.
+                turns = [
+                    # The tanks swap tiles, and the scout sees into the other country.
+                    ([move(tank1, 0, 1), move(tank2, 0, 0), move(scout, 3, 2)], False),
+                    # The tiles around the scout lose visibility.
+                    ([move(tank1, 0, 0), move(tank2, 0, 1), move(scout, 2, 2), collect], False),
+                    ([move(scout, 3, 2)], True),
+                    ([collect], False),
+                    ([move(scout, 2, 2)], False),
+                    ([], False),
+                ]
+                slave = self.create_slave(codec_name)
+                for turn_commands, failing in turns:
+                    slave.transport.failing = failing
+                    turn_data = slave.encode_turn_request(game, country1)
+                    if failing:
+                        with self.assertRaises(transports.TransportError):
+                            self.loop.run_until_complete(slave.play_turn(turn_data))
+                    else:
+                        self.loop.run_until_complete(slave.play_turn(turn_data))
+                        fresh_context = TurnContext(json.loads(game.to_json_as_seen_by(country1)))
+                        self.assertEqual(summarize_context(slave.transport.context), summarize_context(fresh_context))
+                    game.apply_turn({country1: turn_commands})
+                requests = slave.transport.requests
+                self.assertEqual([request.get('delta', False) for request in requests],
+                                 [False, True, True, False, True, True])
+                self.assertLess(len(requests[1]['tiles']), 6 * 6)
+                # The turn after the missed one carries the full view.
+                self.assertEqual(len(requests[3]['tiles']), 6 * 6)
+
+    def test_abandoned_turn_sends_full_view(self):
+        game = engine.Game(3, 3, seed=1)
+        country = game.add_country('country 1')
+        engine.Tank(game, game.tiles[0][0], country)
+        slave = self.create_slave(codec.JSON.name)
+        for _ in range(2):
+            self.loop.run_until_complete(slave.play_turn(slave.encode_turn_request(game, country)))
+            game.apply_turn({})
+        slave.abandon_turn()
+        self.loop.run_until_complete(slave.play_turn(slave.encode_turn_request(game, country)))
+        self.assertEqual([request.get('delta', False) for request in slave.transport.requests], [False, True, False])
+
+    def test_cancelled_turn_sends_full_view(self):
+        game = engine.Game(3, 3, seed=1)
+        country = game.add_country('country 1')
+        slave = self.create_slave(codec.JSON.name)
+        self.loop.run_until_complete(slave.play_turn(slave.encode_turn_request(game, country)))
+        turn_data = slave.encode_turn_request(game, country)
+        slave.transport = ScriptedTransport(slave.transport, delay=10)
+        task = self.loop.create_task(slave.play_turn(turn_data))
+        self.loop.call_later(0.01, task.cancel)
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+        self.assertFalse(json.loads(slave.encode_turn_request(game, country)).get('delta', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
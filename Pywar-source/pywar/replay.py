@@ -0,0 +1,134 @@
+"""Replay archives, game logs that are read turn by turn in any order.
+
+A replay archive starts with a magic header, followed by a block for every
+logged turn, each compressed on its own. The blocks hold the same entries as
+the turn members of a game log (see game_log), so a turn is reconstructed from
+the keyframe before it and the deltas after that. The archive ends with a
+compressed index of the game information and the offsets of the blocks, and
+a fixed size trailer locating the index. Readers map the archive to memory, and
+only decompress the blocks of the turns they read.
+"""
+import argparse
+import json
+import mmap
+import struct
+import zlib
+
+import game_log
+
+MAGIC = b'PYWAR-REPLAY-1\n'
+# The offset and length of the index, and the magic again, to detect truncated archives.
+TRAILER = struct.Struct('<QQ{}s'.format(len(MAGIC)))
+# File extension of replay archives, by which the master chooses to write one.
+REPLAY_EXTENSION = '.pwr'
+COMPRESSION_LEVEL = 6
+
+
+class ReplayWriter(game_log.GameLogWriter):
+    """Writes a replay archive, with the interface of game_log.GameLogWriter."""
+
+    def _open(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._info = {}
+        # list of [turn, offset, length] of the turn blocks.
+        self._blocks = []
+
+    def write_info(self, info):
+        self._info = info
+
+    def write_captured_turn(self, captured_turn):
+        data = zlib.compress(self.encode_captured_turn(captured_turn), COMPRESSION_LEVEL)
+        self._blocks.append([captured_turn.turn, self._file.tell(), len(data)])
+        self._file.write(data)
+
+    def close(self):
+        index = zlib.compress(json.dumps({'info': self._info, 'turns': self._blocks}).encode('utf8'),
+                              COMPRESSION_LEVEL)
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(TRAILER.pack(index_offset, len(index), MAGIC))
+        self._file.close()
+
+
+class ReplayReader(game_log.TurnLogReader):
+    """Reads a replay archive, mapped to memory."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError('{} is not a replay archive'.format(path))
+        if len(self._map) < len(MAGIC) + TRAILER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('{} is not a replay archive'.format(path))
+        index_offset, index_length, magic = TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is a truncated replay archive'.format(path))
+        index = json.loads(zlib.decompress(self._map[index_offset:index_offset + index_length]))
+        self._info = index['info']
+        # dict: turn -> (offset, length) of its block
+        self._blocks = {turn: (offset, length) for turn, offset, length in index['turns']}
+        super(ReplayReader, self).__init__(self._blocks)
+
+    def read_block(self, turn):
+        """Returns the compressed block of the given turn."""
+        offset, length = self._blocks[turn]
+        return self._map[offset:offset + length]
+
+    def _read_entry(self, turn):
+        return json.loads(zlib.decompress(self.read_block(turn)))
+
+    def get_info(self):
+        return self._info
+
+    def turn(self, turn):
+        """Returns the game state after the given turn, see get_state."""
+        return self.get_state(turn)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def open_replay(path):
+    """Opens a replay archive for reading."""
+    return ReplayReader(path)
+
+
+def convert_game_log(game_log_path, replay_path, keyframe_interval=game_log.KEYFRAME_INTERVAL):
+    """Converts a gzipped tarball game log to a replay archive, and returns the amount of turns in it."""
+    with game_log.GameLogReader(game_log_path) as reader:
+        writer = ReplayWriter(replay_path, keyframe_interval=keyframe_interval)
+        try:
+            writer.write_info(reader.get_info())
+            for turn in reader.turns:
+                state = reader.get_state(turn)
+                writer.write_captured_turn(game_log.capture_state(turn, state, reader.get_commands(turn)))
+        finally:
+            writer.close()
+        return len(reader.turns)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Converts a PyWar game log to a replay archive.')
+    parser.add_argument('game_log', metavar='GAME_LOG', type=str,
+                        help='Gzipped tarball game log, as written by the master.')
+    parser.add_argument('replay', metavar='REPLAY', type=str,
+                        help='Path of the replay archive to write.')
+    parser.add_argument('--keyframe-interval', metavar='NUM', type=int, default=game_log.KEYFRAME_INTERVAL,
+                        help='Turns between the full game states in the replay archive.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    turns = convert_game_log(args.game_log, args.replay, keyframe_interval=args.keyframe_interval)
+    print('Converted {} turns.'.format(turns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import os
+import unittest
+
+import game_log
+from game_log_testing import LoggedGameTestCase
+import replay
+
+
+class TestReplay(LoggedGameTestCase):
+    def test_read_turns_out_of_order(self):
+        path = self.get_path(replay.REPLAY_EXTENSION)
+        states = self.play_and_log(replay.ReplayWriter(path, keyframe_interval=4))
+        with replay.open_replay(path) as reader:
+            self.assertEqual(reader.get_info()['seed'], 1)
+            self.assertEqual(reader.turns, sorted(states))
+            for turn in [7, 3, 10, 10, 1, 9, 4]:
+                self.assertEqual(reader.turn(turn), states[turn])
+            self.assertEqual(reader.get_commands(1)['country 1'][0]['name'], 'move')
+
+    def test_convert_game_log(self):
+        game_log_path = self.get_path('.tar.gz')
+        replay_path = self.get_path(replay.REPLAY_EXTENSION)
+        states = self.play_and_log(game_log.GameLogWriter(game_log_path, keyframe_interval=3))
+        self.assertEqual(replay.convert_game_log(game_log_path, replay_path, keyframe_interval=4), len(states))
+        with replay.open_replay(replay_path) as reader:
+            self.assertEqual(reader.get_info()['seed'], 1)
+            for turn in [5, 2, 10]:
+                self.assertEqual(reader.turn(turn), states[turn])
+
+    def test_rejects_truncated_archives(self):
+        path = self.get_path(replay.REPLAY_EXTENSION)
+        self.play_and_log(replay.ReplayWriter(path))
+        with open(path, 'r+b') as replay_file:
+            replay_file.truncate(os.path.getsize(path) - 1)
+        with self.assertRaises(ValueError):
+            replay.open_replay(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
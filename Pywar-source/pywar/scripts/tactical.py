@@ -11,6 +11,12 @@ piece_to_coordinate_to_attack = {}
 builder_to_coordinate_with_money = {}
 
 
+def reset_game():
+    """Called by the slave before every new game."""
+    piece_to_coordinate_to_attack.clear()
+    builder_to_coordinate_with_money.clear()
+
+
 def move_piece_to_destination(piece, destinations_dict):
     dest = destinations_dict.get(piece.id)
     if dest is None:
@@ -1,21 +1,50 @@
 import argparse
 import importlib
+import inspect
 import os.path
+import pickle
 import sys
+import threading
 
-from flask import Flask, request, jsonify
-
+import codec
 from tactical_api import TurnContext
+import transports
 
-app = Flask(__name__)
 tactical_callback = None
 strategic_callback = None
+# The tactical and strategic modules of the bot.
+bot_modules = []
+# The global state of the bot modules once they were loaded, see get_bot_state.
+initial_bot_state = None
+# Name of an optional function in the bot modules, called before every new game.
+RESET_HOOK = 'reset_game'
+# The context of the last turn, retained for applying turn deltas.
+turn_context = None
+# Flask serves requests in threads, and a turn the master gave up on may still be running.
+turn_lock = threading.Lock()
+
+
+class MissingTurnContextError(Exception):
+    pass
+
+
+class LeakedStateError(Exception):
+    pass
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='PyWar slave worker, representing a country.')
-    parser.add_argument('-p', '--port', metavar='PORT', type=int, required=True,
-                        help='Port number to listen on.')
+    transport_group = parser.add_mutually_exclusive_group(required=True)
+    transport_group.add_argument('-p', '--port', metavar='PORT', type=int,
+                                 help='Port number to listen on for HTTP requests.')
+    transport_group.add_argument('--pipe-fds', metavar='READ_FD,WRITE_FD', type=str,
+                                 help='File descriptors of inherited pipes to exchange turn frames over.')
+    transport_group.add_argument('--unix-socket', metavar='PATH', type=str,
+                                 help='Path of a Unix domain socket to listen on for turn frames.')
+    parser.add_argument('--compress-threshold', metavar='BYTES', type=int, default=None,
+                        help='Compress HTTP turn results of at least this size, if the master accepts it.')
+    parser.add_argument('--ready-fd', metavar='FD', type=int, default=None,
+                        help='File descriptor of an inherited pipe to signal the master through once ready.')
     parser.add_argument('-t', '--tactical-module-path', metavar='FILE', type=str, required=True,
                         help='Path to the module containing the stategic API implementation, exporting a get_strategic_implementation function.')
     parser.add_argument('-s', '--strategic-module-path', metavar='FILE', type=str, required=True,
@@ -23,22 +52,115 @@ def parse_args():
     return parser.parse_args()
 
 
-@app.route('/isup')
-def is_up():
-    return 'Up and running.'
-
-
-@app.route('/')
-def index():
-    return 'Hello world from pyWar!'
-
-
-@app.route('/turn', methods=['POST'])
-def turn():
-    turn_context = TurnContext(request.json)
+def handle_turn(turn_data):
+    """Plays a turn given the turn request of the master, and returns the turn result."""
+    global turn_context
+    if turn_data.get('delta', False):
+        if turn_context is None:
+            raise MissingTurnContextError('Got a turn delta without a previous turn.')
+        turn_context.apply_delta(turn_data)
+    else:
+        turn_context = TurnContext(turn_data)
     strategic_api = tactical_callback(turn_context)
     strategic_callback(strategic_api)
-    return jsonify(turn_context.get_result())
+    return turn_context.get_result()
+
+
+def get_bot_state():
+    """Returns a dict from (module name, global name) to a snapshot of each global variable of the bot modules."""
+    state = {}
+    for module in bot_modules:
+        for name, value in vars(module).items():
+            if name.startswith('__') or inspect.ismodule(value) or inspect.isclass(value) or inspect.isroutine(value):
+                continue
+            try:
+                state[module.__name__, name] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                state[module.__name__, name] = repr(value)
+    return state
+
+
+def handle_reset():
+    """Gets ready for a new game, by calling the reset hooks of the bot modules.
+
+    LeakedStateError is raised if the bot modules still hold global state from
+    the previous game, in which case the master should replace this slave.
+    """
+    global turn_context
+    turn_context = None
+    for module in bot_modules:
+        reset_hook = getattr(module, RESET_HOOK, None)
+        if reset_hook is not None:
+            reset_hook()
+    state = get_bot_state()
+    leaked = sorted('{}.{}'.format(*key) for key in set(state) | set(initial_bot_state)
+                    if state.get(key) != initial_bot_state.get(key))
+    if leaked:
+        raise LeakedStateError('The bot modules leaked global state across games: {}'.format(', '.join(leaked)))
+
+
+def create_app(compress_threshold=None):
+    """Creates the Flask app serving turns over HTTP.
+
+    Compressed turn requests are decompressed transparently. If
+    compress_threshold is not None, turn results of at least this many bytes
+    are compressed for masters that accept it.
+    """
+    # Flask is only needed for HTTP, so other transports don't pay for importing it.
+    from flask import Flask, request
+
+    app = Flask(__name__)
+
+    @app.route('/isup')
+    def is_up():
+        return 'Up and running.'
+
+    @app.route('/')
+    def index():
+        return 'Hello world from pyWar!'
+
+    @app.route('/turn', methods=['POST'])
+    def turn():
+        turn_codec = codec.CODECS_BY_CONTENT_TYPE.get(request.mimetype)
+        if turn_codec is None:
+            return 'Unsupported turn request type {}.'.format(request.mimetype), 415
+        try:
+            turn_data = transports.decompress(request.get_data(), request.headers.get('Content-Encoding'))
+        except transports.TransportError as e:
+            return str(e), 415
+        try:
+            with turn_lock:
+                result = handle_turn(turn_codec.decode_turn_request(turn_data))
+        except MissingTurnContextError as e:
+            return str(e), 409
+        accepts_compression = transports.COMPRESSED_ENCODING in request.headers.get('Accept-Encoding', '')
+        body, encoding = transports.compress(turn_codec.encode_turn_result(result),
+                                             compress_threshold if accepts_compression else None)
+        response = app.response_class(body, mimetype=turn_codec.content_type)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    @app.route('/reset', methods=['POST'])
+    def reset():
+        try:
+            with turn_lock:
+                handle_reset()
+        except LeakedStateError as e:
+            return str(e), 409
+        return ''
+
+    return app
+
+
+def serve_http(port, compress_threshold=None, ready_fd=None):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    # Keep the connection to the master alive between turns.
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    server = make_server('127.0.0.1', port, create_app(compress_threshold), threaded=True)
+    transports.signal_ready(ready_fd)
+    server.serve_forever()
 
 
 def load_tactical_callback(module_path):
@@ -46,6 +168,7 @@ def load_tactical_callback(module_path):
     sys.path.insert(0, os.path.dirname(module_path))
     module = importlib.import_module(os.path.splitext(os.path.basename(module_path))[0])
     tactical_callback = module.get_strategic_implementation
+    bot_modules.append(module)
 
 
 def load_strategic_callback(module_path):
@@ -53,13 +176,22 @@ def load_strategic_callback(module_path):
     sys.path.insert(0, os.path.dirname(module_path))
     module = importlib.import_module(os.path.splitext(os.path.basename(module_path))[0])
     strategic_callback = module.do_turn
+    bot_modules.append(module)
 
 
 def main():
+    global initial_bot_state
     args = parse_args()
     load_tactical_callback(args.tactical_module_path)
     load_strategic_callback(args.strategic_module_path)
-    app.run(host='127.0.0.1', port=args.port)
+    initial_bot_state = get_bot_state()
+    if args.pipe_fds is not None:
+        read_fd, write_fd = map(int, args.pipe_fds.split(','))
+        transports.serve_pipe(read_fd, write_fd, handle_turn, handle_reset, args.ready_fd)
+    elif args.unix_socket is not None:
+        transports.serve_unix_socket(args.unix_socket, handle_turn, handle_reset, args.ready_fd)
+    else:
+        serve_http(args.port, args.compress_threshold, args.ready_fd)
 
 
 if __name__ == '__main__':
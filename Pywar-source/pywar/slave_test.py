@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import threading
+import types
+import unittest
+from unittest import mock
+
+try:
+    import flask
+except ImportError:
+    flask = None
+
+import codec
+import engine
+import slave
+import transports
+
+
+class TestHandleTurn(unittest.TestCase):
+    def test_delta_without_previous_turn(self):
+        # The master resyncs by sending the full view once the slave refuses the delta.
+        with mock.patch.object(slave, 'turn_context', None):
+            with self.assertRaises(slave.MissingTurnContextError):
+                slave.handle_turn({'delta': True, 'tiles': []})
+
+
+class TestHandleReset(unittest.TestCase):
+    def setUp(self):
+        # A bot module that remembers its targets across turns.
+        self.module = types.ModuleType('leaking_bot')
+        self.module.tank_to_coordinate_to_attack = {}
+        self.module.turns = 0
+        patchers = [mock.patch.object(slave, 'bot_modules', [self.module]),
+                    mock.patch.object(slave, 'initial_bot_state', None),
+                    mock.patch.object(slave, 'turn_context', None)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        slave.initial_bot_state = slave.get_bot_state()
+
+    def play_turn(self):
+        self.module.tank_to_coordinate_to_attack[1] = (2, 3)
+        self.module.turns += 1
+
+    def test_leaked_globals_refuse_reset(self):
+        self.play_turn()
+        with self.assertRaises(slave.LeakedStateError) as context:
+            slave.handle_reset()
+        self.assertIn('leaking_bot.tank_to_coordinate_to_attack', str(context.exception))
+        self.assertIn('leaking_bot.turns', str(context.exception))
+
+    def test_reset_hook_clears_globals(self):
+        def reset_game():
+            self.module.tank_to_coordinate_to_attack.clear()
+            self.module.turns = 0
+
+        setattr(self.module, slave.RESET_HOOK, reset_game)
+        slave.initial_bot_state = slave.get_bot_state()
+        self.play_turn()
+        slave.handle_reset()
+        self.assertEqual(self.module.tank_to_coordinate_to_attack, {})
+
+
+@unittest.skipIf(flask is None, 'flask is not installed')
+class TestHttpServer(unittest.TestCase):
+    def setUp(self):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        patchers = [mock.patch.object(slave, 'tactical_callback', lambda context: context),
+                    mock.patch.object(slave, 'strategic_callback', self.do_turn),
+                    mock.patch.object(slave, 'turn_context', None),
+                    mock.patch.object(WSGIRequestHandler, 'protocol_version', 'HTTP/1.1')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.threshold = 100
+        self.transport = transports.HttpTransport(compress_threshold=self.threshold)
+        self.addCleanup(self.transport.close)
+        server = make_server('127.0.0.1', self.transport.port, slave.create_app(self.threshold), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    @staticmethod
+    def do_turn(context):
+        for piece_id in sorted(context.my_pieces):
+            context.my_pieces[piece_id].attack()
+
+    def test_compressed_turn_round_trip(self):
+        game = engine.Game(10, 10, seed=1)
+        country = game.add_country('country 1')
+        for tile in itertools.chain.from_iterable(game.tiles):
+            tile.country = country
+        tanks = [engine.Tank(game, tile, country) for tile in game.tiles[0]]
+        game.apply_turn({})
+        turn_data = game.to_json_as_seen_by(country).encode('utf8')
+        with mock.patch.object(transports, 'decompress', wraps=transports.decompress) as decompress:
+            turn_commands = self.loop.run_until_complete(self.transport.exchange_turn(turn_data, codec.JSON))
+        self.assertEqual(turn_commands, [{'name': 'meleeAttack', 'pieceId': tank.id} for tank in tanks])
+        # Both the turn request and the turn result were large enough to be compressed.
+        self.assertGreater(len(codec.JSON.encode_turn_result(turn_commands)), self.threshold)
+        self.assertEqual([call[0][1] for call in decompress.call_args_list], [transports.COMPRESSED_ENCODING] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
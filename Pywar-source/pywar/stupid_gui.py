@@ -1,18 +1,56 @@
-import json
-import tarfile
-import time
+"""Plays a game log in the terminal.
+
+The log is streamed turn by turn, and only the tiles that changed since the
+previous frame are drawn again, by moving the cursor to them. In a terminal,
+playback is controlled by the keys in the status line. Seeking back in a
+gzipped tarball log reads it again from the start, while replay archives and
+command logs seek to any turn by themselves.
+"""
+import argparse
+import bisect
+import collections
+import itertools
+import os
+import select
 import sys
+import time
 
-import engine
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+from command_log import CommandLogReader, COMMAND_LOG_EXTENSION
+import game_log
+import replay
 
 RESET_COLOR = '\x1b[0m'
+CLEAR_SCREEN = '\x1b[2J'
+CLEAR_LINE_END = '\x1b[K'
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
 BLUE = 123
 DARK_BLUE = 68
 RED = 210
 DARK_RED = 1
+GREEN = 120
+DARK_GREEN = 28
+YELLOW = 229
+DARK_YELLOW = 136
+PURPLE = 183
+DARK_PURPLE = 90
+ORANGE = 216
+DARK_ORANGE = 130
+# Foreground and background colors of the countries, by the order of their names.
+# More countries than colors reuse them.
 COUNTRY_COLORS = [
     (BLUE, DARK_BLUE),
     (RED, DARK_RED),
+    (GREEN, DARK_GREEN),
+    (YELLOW, DARK_YELLOW),
+    (PURPLE, DARK_PURPLE),
+    (ORANGE, DARK_ORANGE),
 ]
 
 PIECE_TYPE_TO_CHAR = {
@@ -28,6 +66,18 @@ PIECE_TYPE_TO_CHAR = {
     'satelite': 'S',
     'builder': 'B',
 }
+# Pieces shown in every tile, each by a single character.
+CELL_WIDTH = 4
+# Turns per second, by default.
+DEFAULT_SPEED = 10
+# Turns moved by each seeking key.
+SEEK_KEYS = {
+    ',': -1,
+    '.': 1,
+    '[': -10,
+    ']': 10,
+}
+HELP = '[space] pause  [+/-] speed  [,/.] step  [[/]] jump  [q] quit'
 
 
 def set_bg_to_color(color):
@@ -38,52 +88,261 @@ def set_fg_to_color(color):
     return '\x1b[38;5;{}m'.format(color)
 
 
-def print_piece(piece):
-    return set_fg_to_color(piece.country.foreground) + PIECE_TYPE_TO_CHAR[piece.dict['type']]
+def move_cursor(row, column):
+    return '\x1b[{};{}H'.format(row, column)
+
+
+def decode_cell(tile_dict):
+    """Returns the displayed fields of a tile dict: its country, and the (type, country) of its pieces, by ID."""
+    return tile_dict['country'], tuple((piece_dict['type'], piece_dict['country'])
+                                       for piece_dict in sorted(tile_dict['pieces'], key=lambda piece: piece['id']))
+
+
+class Board(object):
+    """The displayed fields of a game state, without the engine objects of its tiles and pieces.
+
+    cells are the decoded tiles (see decode_cell) in row-major order, and the
+    tiles and pieces of every country are counted as the cells change.
+    """
+
+    def __init__(self, state):
+        super(Board, self).__init__()
+        self.width = state['width']
+        self.height = state['height']
+        self.countries = sorted(state['countries'])
+        self.cells = [None] * (self.width * self.height)
+        self.tile_counts = collections.Counter()
+        self.piece_counts = collections.Counter()
+        self.update_tiles(itertools.chain.from_iterable(state['tiles']))
+
+    def _count(self, cell, sign):
+        country, pieces = cell
+        self.tile_counts[country] += sign
+        for _, piece_country in pieces:
+            self.piece_counts[piece_country] += sign
+
+    def update_tiles(self, tile_dicts):
+        """Sets the cells of the given tile dicts."""
+        for tile_dict in tile_dicts:
+            coordinates = tile_dict['coordinate']
+            index = coordinates['x'] * self.height + coordinates['y']
+            cell = decode_cell(tile_dict)
+            if self.cells[index] is not None:
+                self._count(self.cells[index], -1)
+            self._count(cell, 1)
+            self.cells[index] = cell
+
+
+class GameLogSource(object):
+    """Streams the turns of a gzipped tarball game log, decoding only the changed tiles of deltas."""
+
+    def __init__(self, path):
+        super(GameLogSource, self).__init__()
+        self.path = path
+
+    def iter_turns(self, start=0):
+        """Yields (turn, board) pairs of the turns from the given one. The board is updated in place."""
+        board = None
+        for turn, entry in game_log.iter_turn_entries(self.path):
+            if 'state' in entry:
+                board = Board(entry['state'])
+            elif board is None:
+                raise ValueError('No keyframe before turn {} in the game log'.format(turn))
+            else:
+                board.update_tiles(entry['delta']['tiles'])
+            if turn >= start:
+                yield turn, board
+
+    def close(self):
+        pass
+
+
+class ReaderSource(object):
+    """Reads the turns of a replay archive or a command log, through its reader."""
+
+    def __init__(self, reader):
+        super(ReaderSource, self).__init__()
+        self.reader = reader
+
+    def iter_turns(self, start=0):
+        """Yields (turn, board) pairs of the turns from the given one."""
+        for turn in self.reader.turns[bisect.bisect_left(self.reader.turns, start):]:
+            yield turn, Board(self.reader.get_state(turn))
+
+    def close(self):
+        self.reader.close()
+
+
+def open_source(path):
+    """Opens a game log, replay archive or command log for playing, by its file extension."""
+    if path.endswith(replay.REPLAY_EXTENSION):
+        return ReaderSource(replay.open_replay(path))
+    if path.endswith(COMMAND_LOG_EXTENSION):
+        return ReaderSource(CommandLogReader(path))
+    return GameLogSource(path)
+
+
+class TerminalRenderer(object):
+    """Draws boards in the terminal, drawing again only the cells that changed since the previous board."""
+
+    def __init__(self, output=sys.stdout):
+        super(TerminalRenderer, self).__init__()
+        self.output = output
+        # The width, height and countries of the drawn board, and its drawn cells.
+        self._layout = None
+        self._drawn_cells = None
+        # dict: country name -> (foreground, background)
+        self._colors = {}
+
+    def format_cell(self, cell):
+        country, pieces = cell
+        chars = [set_fg_to_color(self._colors[piece_country][0]) + PIECE_TYPE_TO_CHAR[piece_type]
+                 for piece_type, piece_country in pieces[:CELL_WIDTH]]
+        chars.extend('*' * (CELL_WIDTH - len(chars)))
+        bg = '' if country is None else set_bg_to_color(self._colors[country][1])
+        return bg + ''.join(chars) + RESET_COLOR
+
+    def draw(self, board, status):
+        parts = []
+        layout = (board.width, board.height, board.countries)
+        if layout != self._layout:
+            parts.append(CLEAR_SCREEN)
+            self._layout = layout
+            self._drawn_cells = [None] * len(board.cells)
+            self._colors = {country: COUNTRY_COLORS[i % len(COUNTRY_COLORS)]
+                            for i, country in enumerate(board.countries)}
+        parts.append(move_cursor(1, 1) + status + CLEAR_LINE_END)
+        for row, country in enumerate(board.countries, 2):
+            legend = '{}: {} tiles, {} pieces'.format(country, board.tile_counts[country], board.piece_counts[country])
+            parts.append(move_cursor(row, 1) + set_bg_to_color(self._colors[country][1]) + legend + RESET_COLOR +
+                         CLEAR_LINE_END)
+        board_top = len(board.countries) + 3
+        for index, (cell, drawn_cell) in enumerate(zip(board.cells, self._drawn_cells)):
+            if cell is not drawn_cell and cell != drawn_cell:
+                x, y = divmod(index, board.height)
+                parts.append(move_cursor(board_top + x, y * CELL_WIDTH + 1) + self.format_cell(cell))
+                self._drawn_cells[index] = cell
+        parts.append(move_cursor(board_top + board.width, 1))
+        self.output.write(''.join(parts))
+        self.output.flush()
+
+
+class KeyboardControls(object):
+    """Reads single key presses from the terminal, if the input is one, without waiting for Enter."""
+
+    def __init__(self, input_file=sys.stdin):
+        super(KeyboardControls, self).__init__()
+        self.enabled = termios is not None and input_file.isatty()
+        self._fd = input_file.fileno() if self.enabled else None
+        self._terminal_attributes = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._terminal_attributes = termios.tcgetattr(self._fd)
+            tty.setcbreak(self._fd)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._terminal_attributes is not None:
+            termios.tcsetattr(self._fd, termios.TCSADRAIN, self._terminal_attributes)
+            self._terminal_attributes = None
+
+    def read_key(self, timeout=None):
+        """Returns the next key pressed within the timeout (in seconds, or None for no timeout), or None."""
+        if not self.enabled:
+            time.sleep(timeout or 0)
+            return None
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        return os.read(self._fd, 1).decode('utf8', 'replace') if readable else None
+
 
+class Player(object):
+    """Plays the turns of a source, moving through them as the keys say."""
 
-def print_tile(tile):
-    pieces = [print_piece(piece) for piece in tile.pieces][:4]
-    while len(pieces) < 4:
-        pieces.append('*')
-    if tile.country is None:
-        bg = ''
-    else:
-        bg = set_bg_to_color(tile.country.background)
-    return bg + ''.join(pieces) + RESET_COLOR
+    def __init__(self, source, renderer, speed=DEFAULT_SPEED):
+        super(Player, self).__init__()
+        self.source = source
+        self.renderer = renderer
+        self.speed = speed
+        self.paused = False
+        self.turn = None
+        self.board = None
+        self._frames = None
+        # The last turn of the source, once it was reached.
+        self._last_turn = None
 
+    def seek(self, turn):
+        """Moves to the first turn from the given one, and returns whether there is one.
 
-def load_game(json_file):
-    game = engine.game_from_dict(json.load(json_file)['state'])
-    sorted_countries = sorted(game.countries, key=lambda x: x.name)
-    for i, country in enumerate(sorted_countries):
-        country.foreground, country.background = COUNTRY_COLORS[i]
-    return game
+        Seeking forward goes on from the current turn without drawing the turns
+        in between, and seeking back starts the source over.
+        """
+        if turn == self.turn:
+            return True
+        if self._last_turn is not None and turn > self._last_turn:
+            return False
+        if self._frames is None or self.turn is None or turn < self.turn:
+            self._frames = self.source.iter_turns(turn)
+        for frame_turn, board in self._frames:
+            self.turn, self.board = frame_turn, board
+            if frame_turn >= turn:
+                return True
+        self._frames = None
+        self._last_turn = self.turn
+        return False
 
+    def draw(self):
+        status = 'turn {}  {:g} turns/s{}  {}'.format(self.turn, self.speed, '  paused' if self.paused else '', HELP)
+        self.renderer.draw(self.board, status)
 
-def print_legend(game):
-    for country in sorted(game.countries, key=lambda x: x.name):
-        print_string = '{}: {} tiles, {} pieces'.format(country.name, len(country.tiles), len(country.pieces))
-        print(set_bg_to_color(country.background) + print_string + RESET_COLOR)
+    def run(self, controls, start=0):
+        """Plays from the given turn, until the last turn, or until q is pressed in a terminal."""
+        if not self.seek(start):
+            return
+        self.draw()
+        while True:
+            key = controls.read_key(None if self.paused else 1 / self.speed)
+            if key is None:
+                if not self.seek(self.turn + 1):
+                    if not controls.enabled:
+                        return
+                    self.paused = True
+            elif key == 'q':
+                return
+            elif key == ' ':
+                self.paused = not self.paused
+            elif key == '+':
+                self.speed *= 2
+            elif key == '-':
+                self.speed /= 2
+            elif key in SEEK_KEYS:
+                self.seek(max(self.turn + SEEK_KEYS[key], 0))
+            self.draw()
 
 
-def print_game(game):
-    print_legend(game)
-    for x in range(game.width):
-        row = [print_tile(game.tiles[x][y]) for y in range(game.height)]
-        print(''.join(row))
+def parse_args():
+    parser = argparse.ArgumentParser(description='Plays a PyWar game log in the terminal.')
+    parser.add_argument('game_log', metavar='GAME_LOG', type=str,
+                        help='Gzipped tarball game log, replay archive ({}) or command log ({}).'.format(
+                            replay.REPLAY_EXTENSION, COMMAND_LOG_EXTENSION))
+    parser.add_argument('--speed', metavar='NUM', type=float, default=DEFAULT_SPEED,
+                        help='Turns per second.')
+    parser.add_argument('--start', metavar='TURN', type=int, default=0,
+                        help='Turn to start playing from.')
+    return parser.parse_args()
 
 
-def print_gameplay(file_path):
-    with tarfile.open(file_path, 'r:gz') as tar:
-        turns = sorted(filter(lambda name: name.startswith('turn'), tar.getnames()))
-        for turn in turns:
-            print(turn)
-            with tar.extractfile(turn) as turn_json:
-                game = load_game(turn_json)
-                print_game(game)
-                time.sleep(0.1)
-                print('\n\n')
+def main():
+    args = parse_args()
+    source = open_source(args.game_log)
+    sys.stdout.write(HIDE_CURSOR)
+    try:
+        with KeyboardControls() as controls:
+            Player(source, TerminalRenderer(), speed=args.speed).run(controls, start=args.start)
+    finally:
+        sys.stdout.write(SHOW_CURSOR + '\n')
+        source.close()
 
 
-print_gameplay(sys.argv[1])
+if __name__ == '__main__':
+    main()
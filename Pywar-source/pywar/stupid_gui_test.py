@@ -0,0 +1,58 @@
+import io
+import unittest
+
+import game_log
+from game_log_testing import LoggedGameTestCase
+import stupid_gui
+
+
+class TestStupidGui(LoggedGameTestCase):
+    def setUp(self):
+        super(TestStupidGui, self).setUp()
+        # The viewer colors any amount of countries.
+        country3 = self.game.add_country('country 3')
+        for tile in self.game.tiles[4]:
+            tile.country = country3
+        self.path = self.get_path('.tar.gz')
+        self.play_and_log(game_log.GameLogWriter(self.path, keyframe_interval=3))
+
+    def test_game_log_source(self):
+        source = stupid_gui.GameLogSource(self.path)
+        with game_log.GameLogReader(self.path) as reader:
+            turns = []
+            for turn, board in source.iter_turns(start=2):
+                turns.append(turn)
+                expected_board = stupid_gui.Board(reader.get_state(turn))
+                self.assertEqual(board.cells, expected_board.cells)
+                self.assertEqual(board.tile_counts, expected_board.tile_counts)
+                self.assertEqual(board.piece_counts, expected_board.piece_counts)
+            self.assertEqual(turns, reader.turns[1:])
+
+    def test_draws_only_changed_cells(self):
+        output = io.StringIO()
+        renderer = stupid_gui.TerminalRenderer(output)
+        frames = stupid_gui.GameLogSource(self.path).iter_turns()
+        _, board = next(frames)
+        renderer.draw(board, 'first')
+        self.assertIn(stupid_gui.CLEAR_SCREEN, output.getvalue())
+        self.assertEqual(output.getvalue().count('*'), 25 * 4 - 2)
+        output.seek(0)
+        output.truncate()
+        _, board = next(frames)
+        renderer.draw(board, 'second')
+        self.assertNotIn(stupid_gui.CLEAR_SCREEN, output.getvalue())
+        # The legend has a line for each of the three countries, and the tank left one tile for another.
+        self.assertEqual(output.getvalue().count(stupid_gui.RESET_COLOR), 3 + 2)
+
+    def test_player_seeks(self):
+        player = stupid_gui.Player(stupid_gui.GameLogSource(self.path), stupid_gui.TerminalRenderer(io.StringIO()))
+        self.assertTrue(player.seek(5))
+        self.assertEqual(player.turn, 5)
+        self.assertTrue(player.seek(2))
+        self.assertEqual(player.turn, 2)
+        self.assertFalse(player.seek(20))
+        self.assertEqual(player.turn, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
 from collections import namedtuple
+import json
+import mmap
+import struct
 
 import commands
 import constants
@@ -325,6 +328,16 @@ class Tile(object):
         self.country = tile_dict['country']
         self.pieces = [_load_piece(context, self, piece_dict) for piece_dict in tile_dict['pieces']]
 
+    @classmethod
+    def _from_columns(cls, context, coordinates, money, country, piece_dicts):
+        tile = cls.__new__(cls)
+        super(Tile, tile).__init__()
+        tile.coordinates = coordinates
+        tile.money = money
+        tile.country = country
+        tile.pieces = [_load_piece(context, tile, piece_dict) for piece_dict in piece_dicts]
+        return tile
+
 
 class TurnContext(object):
     """Contains all the context of this turn.
@@ -344,8 +357,14 @@ class TurnContext(object):
         super(TurnContext, self).__init__()
         self._turn_data = turn_data
         self._commands = []
-        self.tiles = {(tile['coordinate']['x'], tile['coordinate']['y']): Tile(self, tile)
-                      for tile in turn_data['tiles']}
+        if turn_data.get('format') == 'columnar':
+            self.tiles = self._load_columnar_tiles(turn_data, turn_data['owners'], turn_data['money'],
+                                                   turn_data['pieces'])
+        elif turn_data.get('format') == 'shared':
+            self.tiles = self._load_shared_tiles(turn_data)
+        else:
+            self.tiles = {(tile['coordinate']['x'], tile['coordinate']['y']): Tile(self, tile)
+                          for tile in turn_data['tiles']}
         self.my_pieces = {}
         self.all_pieces = {}
         self.game_width = turn_data['width']
@@ -353,10 +372,62 @@ class TurnContext(object):
         self.my_country = turn_data['country']
         self.all_countries = turn_data['all_countries']
         for tile in self.tiles.values():
-            for piece in tile.pieces:
-                if piece.country == self.my_country:
-                    self.my_pieces[piece.id] = piece
-                self.all_pieces[piece.id] = piece
+            self._add_pieces_of(tile)
+
+    def _load_shared_tiles(self, turn_data):
+        # See master.SharedView for the layout.
+        tile_count = turn_data['width'] * turn_data['height']
+        with open(turn_data['path'], 'rb') as view_file, \
+                mmap.mmap(view_file.fileno(), 0, access=mmap.ACCESS_READ) as mapping, \
+                memoryview(mapping) as view:
+            column_size = tile_count * struct.calcsize('i')
+            pieces_offset = 3 * column_size
+            with view[:column_size].cast('i') as owners, view[column_size:2 * column_size].cast('i') as money:
+                pieces = json.loads(view[pieces_offset:pieces_offset + turn_data['piecesLength']].tobytes())
+                return self._load_columnar_tiles(turn_data, owners,
+                                                 (None if amount < 0 else amount for amount in money), pieces)
+
+    def _load_columnar_tiles(self, turn_data, owners, money, pieces):
+        country_names = turn_data['all_countries']
+        height = turn_data['height']
+        pieces_by_coordinates = {}
+        for piece_dict in pieces:
+            piece_dict['country'] = country_names[piece_dict['country']]
+            pieces_by_coordinates.setdefault((piece_dict['x'], piece_dict['y']), []).append(piece_dict)
+        tiles = {}
+        for i, (owner, tile_money) in enumerate(zip(owners, money)):
+            coordinates = Coordinates(i // height, i % height)
+            tiles[coordinates] = Tile._from_columns(self, coordinates, tile_money,
+                                                    country_names[owner] if owner >= 0 else None,
+                                                    pieces_by_coordinates.get(coordinates, []))
+        return tiles
+
+    def _add_pieces_of(self, tile):
+        for piece in tile.pieces:
+            if piece.country == self.my_country:
+                self.my_pieces[piece.id] = piece
+            self.all_pieces[piece.id] = piece
+
+    def apply_delta(self, turn_data):
+        """Starts a new turn, given only the tiles that changed since the previous one.
+
+        turn_data has the same structure as the one given to the constructor,
+        except that its tiles list contains only the changed tiles. Commands
+        given in the previous turn are discarded.
+        """
+        self._turn_data = turn_data
+        self._commands = []
+        new_tiles = [Tile(self, tile) for tile in turn_data['tiles']]
+        # Remove all old pieces before adding the new ones, since pieces may move
+        # between changed tiles.
+        for tile in new_tiles:
+            for piece in self.tiles[tile.coordinates].pieces:
+                self.my_pieces.pop(piece.id, None)
+                self.all_pieces.pop(piece.id, None)
+        for tile in new_tiles:
+            self.tiles[tile.coordinates] = tile
+            self._add_pieces_of(tile)
+        self.all_countries = turn_data['all_countries']
 
     def get_tiles_of_country(self, country_name):
         """Returns the set of tile coordinates owned by the given country name.
@@ -0,0 +1,465 @@
+"""Transports carrying turn requests from the master to a slave, and their responses back.
+
+HTTP goes through a Flask server in the slave, and allows slaves that run
+elsewhere. Local slaves may instead exchange length-prefixed frames with the
+master over pipes or a Unix domain socket, skipping HTTP and WSGI altogether.
+"""
+import asyncio
+import http.client
+import os
+import select
+import shutil
+import socket
+import struct
+import tempfile
+import time
+import traceback
+import zlib
+
+import codec
+
+TIMEOUT = 10
+
+# Every frame starts with its kind, the ID of the codec of its payload, its
+# sequence number and the payload length.
+FRAME_HEADER = struct.Struct('>BBII')
+FRAME_TURN = 1
+FRAME_RESULT = 2
+FRAME_ERROR = 3
+# Asks the slave to get ready for a new game, answered by a result or an error frame.
+FRAME_RESET = 4
+READ_SIZE = 1 << 16
+# Written by the slave to its ready pipe once it can take turn requests.
+READY_TOKEN = b'ready\n'
+# The HTTP Content-Encoding of compressed turn requests and results, in the zlib format.
+COMPRESSED_ENCODING = 'deflate'
+# Game views compress about as well at the fastest level, at a third of the time of the default one.
+COMPRESSION_LEVEL = 1
+
+
+class TransportError(Exception):
+    pass
+
+
+def get_open_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    s.listen(1)
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def compress(data, threshold):
+    """Returns the data, compressed if it has at least threshold bytes, and its HTTP Content-Encoding or None."""
+    if threshold is None or len(data) < threshold:
+        return data, None
+    return zlib.compress(data, COMPRESSION_LEVEL), COMPRESSED_ENCODING
+
+
+def decompress(data, encoding):
+    """Returns the given data, decompressed if it has the given HTTP Content-Encoding."""
+    if encoding is None or encoding == 'identity':
+        return data
+    if encoding != COMPRESSED_ENCODING:
+        raise TransportError('Unsupported content encoding {}'.format(encoding))
+    try:
+        return zlib.decompress(data)
+    except zlib.error as e:
+        raise TransportError('Malformed compressed data: {}'.format(e))
+
+
+def _wait_for_fd(fd, deadline, write=False):
+    """Blocks until the given file descriptor is readable (or writable), or the deadline passes."""
+    timeout = None if deadline is None else max(deadline - time.time(), 0)
+    if write:
+        ready = select.select([], [fd], [], timeout)[1]
+    else:
+        ready = select.select([fd], [], [], timeout)[0]
+    if not ready:
+        raise TimeoutError('Timed out waiting for the other side of the channel')
+
+
+async def _wait_for_fd_async(fd, write=False):
+    """Waits until the given file descriptor is readable (or writable), without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def on_ready():
+        if not ready.done():
+            ready.set_result(None)
+
+    if write:
+        loop.add_writer(fd, on_ready)
+    else:
+        loop.add_reader(fd, on_ready)
+    try:
+        await ready
+    finally:
+        if write:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+class FrameChannel(object):
+    """Sends and receives frames over a pair of file descriptors.
+
+    Both descriptors may be the same socket. Frames that were cut in the middle
+    by a timeout (or a cancellation) are completed by the next call, so the
+    stream never goes out of sync.
+    """
+
+    def __init__(self, read_fd, write_fd):
+        super(FrameChannel, self).__init__()
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self._input = bytearray()
+        self._output = b''
+
+    def _write_some(self):
+        try:
+            written = os.write(self.write_fd, self._output)
+        except BlockingIOError:
+            return
+        self._output = self._output[written:]
+
+    def _pop_frame(self):
+        """Returns the first buffered frame, or None if it wasn't fully read yet."""
+        if len(self._input) < FRAME_HEADER.size:
+            return None
+        kind, codec_id, seq, length = FRAME_HEADER.unpack_from(self._input)
+        end = FRAME_HEADER.size + length
+        if len(self._input) < end:
+            return None
+        payload = bytes(self._input[FRAME_HEADER.size:end])
+        del self._input[:end]
+        return kind, codec_id, seq, payload
+
+    def _read_some(self):
+        try:
+            chunk = os.read(self.read_fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        if not chunk:
+            raise EOFError('The channel was closed by the other side')
+        self._input += chunk
+
+    def send(self, kind, codec_id, seq, payload, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        self._output += FRAME_HEADER.pack(kind, codec_id, seq, len(payload)) + payload
+        while self._output:
+            _wait_for_fd(self.write_fd, deadline, write=True)
+            self._write_some()
+
+    def receive(self, timeout=None):
+        """Returns the next frame as a (kind, codec_id, seq, payload) tuple.
+
+        EOFError is raised if the other side closed the channel.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        frame = self._pop_frame()
+        while frame is None:
+            _wait_for_fd(self.read_fd, deadline)
+            self._read_some()
+            frame = self._pop_frame()
+        return frame
+
+    async def send_async(self, kind, codec_id, seq, payload):
+        self._output += FRAME_HEADER.pack(kind, codec_id, seq, len(payload)) + payload
+        # Start writing right away, the other side may already be waiting.
+        self._write_some()
+        while self._output:
+            await _wait_for_fd_async(self.write_fd, write=True)
+            self._write_some()
+
+    async def receive_async(self):
+        """Like receive, for non-blocking descriptors watched by the running event loop."""
+        frame = self._pop_frame()
+        while frame is None:
+            await _wait_for_fd_async(self.read_fd)
+            self._read_some()
+            frame = self._pop_frame()
+        return frame
+
+
+class HttpTransport(object):
+    """Posts the turns to a Flask server in the slave, over a keep-alive connection.
+
+    If compress_threshold is not None, both sides compress the turn requests and
+    results of at least this many bytes. timeout is the time (in seconds) the
+    slave has for responding to each turn, which should be the turn timeout of
+    the master.
+    """
+
+    def __init__(self, compress_threshold=None, timeout=TIMEOUT):
+        super(HttpTransport, self).__init__()
+        self.port = get_open_port()
+        self.compress_threshold = compress_threshold
+        self.timeout = timeout
+        self.slave_args = ['--port', str(self.port)]
+        if compress_threshold is not None:
+            self.slave_args += ['--compress-threshold', str(compress_threshold)]
+        self.pass_fds = ()
+        # A keep-alive connection to the slave, reused across turns.
+        self.conn = None
+
+    def slave_started(self):
+        pass
+
+    def is_ready(self):
+        """Checks whether the slave responds, after it signaled it's ready."""
+        try:
+            conn = http.client.HTTPConnection('localhost', self.port, timeout=0.5)
+            conn.request('HEAD', '/isup')
+            response = conn.getresponse()
+            return response.status == 200
+        except (OSError, http.client.HTTPException):
+            return False
+
+    def _exchange_turn(self, conn, turn_data, turn_codec):
+        """Posts a turn request and returns the turn result, blocking a worker thread."""
+        headers = {'Content-Type': turn_codec.content_type, 'Accept': turn_codec.content_type}
+        turn_data, encoding = compress(turn_data, self.compress_threshold)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        if self.compress_threshold is not None:
+            headers['Accept-Encoding'] = COMPRESSED_ENCODING
+        try:
+            try:
+                conn.request('POST', '/turn', turn_data, headers)
+                response = conn.getresponse()
+            except (ConnectionError, http.client.HTTPException):
+                # The connection went stale (the slave closed it, or restarted), reconnect once.
+                conn.close()
+                conn.request('POST', '/turn', turn_data, headers)
+                response = conn.getresponse()
+            # Read the whole body, so the connection is ready for the next request.
+            body = response.read()
+            if response.status != 200:
+                raise TransportError(response.reason)
+            body = decompress(body, response.getheader('Content-Encoding'))
+            result_codec = codec.CODECS_BY_CONTENT_TYPE.get(response.getheader('Content-Type'), codec.JSON)
+            return result_codec.decode_turn_result(body)
+        except Exception:
+            conn.close()
+            raise
+
+    async def exchange_turn(self, turn_data, turn_codec):
+        """Sends a turn request, encoded by the given codec, and returns the decoded turn result of the slave."""
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('localhost', self.port, timeout=self.timeout)
+        return await asyncio.get_running_loop().run_in_executor(None, self._exchange_turn, self.conn, turn_data,
+                                                                turn_codec)
+
+    def reset_game(self, timeout=TIMEOUT):
+        """Asks the slave to get ready for a new game, raising TransportError if it can't."""
+        conn = http.client.HTTPConnection('localhost', self.port, timeout=timeout)
+        try:
+            conn.request('POST', '/reset')
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise TransportError(body.decode('utf8', 'replace') or response.reason)
+
+    def reset(self):
+        """Abandons the turn in flight, after it missed its deadline."""
+        conn, self.conn = self.conn, None
+        sock = conn.sock if conn is not None else None
+        if sock is not None:
+            # Wake up the worker thread still waiting for the response.
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class FrameTransport(object):
+    """Base class for transports exchanging frames with the slave over a FrameChannel.
+
+    Every turn request gets a new sequence number, and responses to requests
+    that missed their deadline are discarded once they arrive.
+    """
+
+    def __init__(self):
+        super(FrameTransport, self).__init__()
+        self.channel = None
+        self._seq = 0
+
+    async def exchange_turn(self, turn_data, turn_codec):
+        """Sends a turn request, encoded by the given codec, and returns the decoded turn result of the slave."""
+        self._seq += 1
+        await self.channel.send_async(FRAME_TURN, turn_codec.codec_id, self._seq, turn_data)
+        while True:
+            kind, codec_id, seq, payload = await self.channel.receive_async()
+            if seq == self._seq:
+                break
+        if kind == FRAME_ERROR:
+            raise TransportError(payload.decode('utf8'))
+        return codec.CODECS_BY_ID[codec_id].decode_turn_result(payload)
+
+    def reset_game(self, timeout=TIMEOUT):
+        """Asks the slave to get ready for a new game, raising TransportError if it can't."""
+        deadline = time.time() + timeout
+        self._seq += 1
+        self.channel.send(FRAME_RESET, codec.JSON.codec_id, self._seq, b'', timeout)
+        while True:
+            kind, _, seq, payload = self.channel.receive(max(deadline - time.time(), 0))
+            if seq == self._seq:
+                break
+        if kind == FRAME_ERROR:
+            raise TransportError(payload.decode('utf8'))
+
+    def reset(self):
+        """Abandons the turn in flight, after it missed its deadline.
+
+        The channel keeps any partially sent or received frame, and the late
+        response is skipped by its sequence number.
+        """
+        pass
+
+
+class PipeTransport(FrameTransport):
+    """Exchanges frames with the slave over a pair of pipes it inherits.
+
+    The pipes are separate from the slave's standard streams, which stay free
+    for the output of the bots.
+    """
+
+    def __init__(self):
+        super(PipeTransport, self).__init__()
+        self._requests_read, requests_write = os.pipe()
+        responses_read, self._responses_write = os.pipe()
+        os.set_blocking(requests_write, False)
+        os.set_blocking(responses_read, False)
+        self.channel = FrameChannel(responses_read, requests_write)
+        self.slave_args = ['--pipe-fds', '{},{}'.format(self._requests_read, self._responses_write)]
+        self.pass_fds = (self._requests_read, self._responses_write)
+
+    def slave_started(self):
+        # Leave the slave ends only in the slave, so we'd see EOF once it exits.
+        os.close(self._requests_read)
+        os.close(self._responses_write)
+
+    def is_ready(self):
+        # Turn requests wait in the pipe until the slave gets to read them.
+        return True
+
+    def close(self):
+        os.close(self.channel.read_fd)
+        os.close(self.channel.write_fd)
+
+
+class UnixSocketTransport(FrameTransport):
+    """Exchanges frames with the slave over a Unix domain socket it listens on."""
+
+    def __init__(self):
+        super(UnixSocketTransport, self).__init__()
+        self._directory = tempfile.mkdtemp(prefix='pywar-')
+        self.path = os.path.join(self._directory, 'slave.sock')
+        self.slave_args = ['--unix-socket', self.path]
+        self.pass_fds = ()
+        self.sock = None
+
+    def slave_started(self):
+        pass
+
+    def is_ready(self):
+        if self.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                return False
+            sock.setblocking(False)
+            self.sock = sock
+            self.channel = FrameChannel(sock.fileno(), sock.fileno())
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.channel = None
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+# dict: transport name -> transport class, used by the master.
+TRANSPORTS = {
+    'http': HttpTransport,
+    'pipe': PipeTransport,
+    'unix': UnixSocketTransport,
+}
+
+
+def serve_frames(channel, handle_turn, handle_reset=None):
+    """Answers the turn frames of the master until it closes the channel.
+
+    handle_turn is called with the decoded turn request, and should return the
+    turn result. It is encoded by the codec of the request. handle_reset, if
+    given, is called on reset frames, and may raise to refuse a new game.
+    """
+    closed = False
+    while not closed:
+        try:
+            kind, codec_id, seq, payload = channel.receive()
+        except EOFError:
+            return
+        # Turns queued behind a newer one were already given up on by the master.
+        try:
+            while True:
+                kind, codec_id, seq, payload = channel.receive(timeout=0)
+        except TimeoutError:
+            pass
+        except EOFError:
+            closed = True
+        if kind == FRAME_RESET:
+            try:
+                if handle_reset is not None:
+                    handle_reset()
+            except Exception as e:
+                channel.send(FRAME_ERROR, codec_id, seq, str(e).encode('utf8'))
+            else:
+                channel.send(FRAME_RESULT, codec_id, seq, b'')
+            continue
+        if kind != FRAME_TURN:
+            continue
+        try:
+            turn_codec = codec.CODECS_BY_ID[codec_id]
+            result = turn_codec.encode_turn_result(handle_turn(turn_codec.decode_turn_request(payload)))
+        except Exception as e:
+            traceback.print_exc()
+            channel.send(FRAME_ERROR, codec_id, seq, str(e).encode('utf8'))
+        else:
+            channel.send(FRAME_RESULT, codec_id, seq, result)
+
+
+def signal_ready(ready_fd):
+    """Tells the master that the slave can take turn requests, if it gave a ready pipe."""
+    if ready_fd is not None:
+        os.write(ready_fd, READY_TOKEN)
+        os.close(ready_fd)
+
+
+def serve_pipe(read_fd, write_fd, handle_turn, handle_reset=None, ready_fd=None):
+    signal_ready(ready_fd)
+    serve_frames(FrameChannel(read_fd, write_fd), handle_turn, handle_reset)
+
+
+def serve_unix_socket(path, handle_turn, handle_reset=None, ready_fd=None):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    signal_ready(ready_fd)
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            serve_frames(FrameChannel(conn.fileno(), conn.fileno()), handle_turn, handle_reset)
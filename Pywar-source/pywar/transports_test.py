@@ -0,0 +1,182 @@
+import asyncio
+import http.server
+import json
+import os
+import socket
+import threading
+import unittest
+
+import codec
+import transports
+
+
+class TestFrameChannel(unittest.TestCase):
+    def setUp(self):
+        read_fd, write_fd = os.pipe()
+        self.fds = [read_fd, write_fd]
+        self.channel = transports.FrameChannel(read_fd, write_fd)
+
+    def tearDown(self):
+        for fd in self.fds:
+            os.close(fd)
+
+    def test_send_and_receive(self):
+        self.channel.send(transports.FRAME_TURN, 0, 1, b'first')
+        self.channel.send(transports.FRAME_RESULT, 1, 2, b'')
+        self.assertEqual(self.channel.receive(), (transports.FRAME_TURN, 0, 1, b'first'))
+        self.assertEqual(self.channel.receive(), (transports.FRAME_RESULT, 1, 2, b''))
+
+    def test_receive_partial_frame(self):
+        frame = transports.FRAME_HEADER.pack(transports.FRAME_TURN, 0, 3, 5) + b'hello'
+        os.write(self.fds[1], frame[:4])
+        with self.assertRaises(TimeoutError):
+            self.channel.receive(timeout=0)
+        os.write(self.fds[1], frame[4:])
+        self.assertEqual(self.channel.receive(timeout=0), (transports.FRAME_TURN, 0, 3, b'hello'))
+
+    def test_receive_closed_channel(self):
+        os.close(self.fds.pop())
+        with self.assertRaises(EOFError):
+            self.channel.receive()
+
+
+class TestCompression(unittest.TestCase):
+    def test_compress_above_threshold(self):
+        data = b'{"money": 0, "pieces": []}' * 100
+        compressed, encoding = transports.compress(data, 100)
+        self.assertEqual(encoding, transports.COMPRESSED_ENCODING)
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(transports.decompress(compressed, encoding), data)
+
+    def test_no_compression_below_threshold(self):
+        self.assertEqual(transports.compress(b'[]', 100), (b'[]', None))
+        self.assertEqual(transports.compress(b'[]', None), (b'[]', None))
+        self.assertEqual(transports.decompress(b'[]', None), b'[]')
+
+    def test_decompress_bad_data(self):
+        with self.assertRaises(transports.TransportError):
+            transports.decompress(b'[]', 'br')
+        with self.assertRaises(transports.TransportError):
+            transports.decompress(b'[]', transports.COMPRESSED_ENCODING)
+
+
+class TestServeFrames(unittest.TestCase):
+    def serve(self, *frames, kind=transports.FRAME_TURN, handle_reset=None):
+        """Serves the given (seq, payload) frames, and returns the channel of the master."""
+        requests_read, requests_write = os.pipe()
+        responses_read, responses_write = os.pipe()
+        self.addCleanup(os.close, requests_read)
+        self.addCleanup(os.close, responses_read)
+        master_channel = transports.FrameChannel(responses_read, requests_write)
+        for seq, payload in frames:
+            master_channel.send(kind, codec.JSON.codec_id, seq, payload)
+        os.close(requests_write)
+
+        def handle_turn(turn_data):
+            return [turn_data['value']]
+
+        ready_read, ready_write = os.pipe()
+        self.addCleanup(os.close, ready_read)
+        transports.serve_pipe(requests_read, responses_write, handle_turn, handle_reset, ready_write)
+        os.close(responses_write)
+        self.assertEqual(os.read(ready_read, 100), transports.READY_TOKEN)
+        return master_channel
+
+    def test_serve_frames(self):
+        master_channel = self.serve((1, b'{"value": 1}'))
+        self.assertEqual(master_channel.receive(), (transports.FRAME_RESULT, codec.JSON.codec_id, 1, b'[1]'))
+
+    def test_serve_frames_skips_stale_turns(self):
+        master_channel = self.serve((1, b'{"value": 1}'), (2, b'{"value": 2}'))
+        self.assertEqual(master_channel.receive(), (transports.FRAME_RESULT, codec.JSON.codec_id, 2, b'[2]'))
+        with self.assertRaises(EOFError):
+            master_channel.receive()
+
+    def test_serve_frames_error(self):
+        master_channel = self.serve((1, b'{}'))
+        kind, _, seq, _ = master_channel.receive()
+        self.assertEqual((kind, seq), (transports.FRAME_ERROR, 1))
+
+    def test_serve_frames_reset(self):
+        resets = []
+        master_channel = self.serve((1, b''), kind=transports.FRAME_RESET, handle_reset=lambda: resets.append(1))
+        self.assertEqual(master_channel.receive(), (transports.FRAME_RESULT, codec.JSON.codec_id, 1, b''))
+        self.assertEqual(resets, [1])
+
+    def test_serve_frames_refused_reset(self):
+        def handle_reset():
+            raise RuntimeError('leaked')
+
+        master_channel = self.serve((1, b''), kind=transports.FRAME_RESET, handle_reset=handle_reset)
+        self.assertEqual(master_channel.receive(), (transports.FRAME_ERROR, codec.JSON.codec_id, 1, b'leaked'))
+
+
+class TurnRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.connections.add(self.connection)
+        turn_data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = codec.JSON.encode_turn_result([turn_data['value']])
+        self.send_response(200)
+        self.send_header('Content-Type', codec.JSON.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpTransport(unittest.TestCase):
+    def setUp(self):
+        # Turns may take longer than the default timeout.
+        self.transport = transports.HttpTransport(timeout=2 * transports.TIMEOUT)
+        self.addCleanup(self.transport.close)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.server = None
+        self.start_server()
+        self.addCleanup(self.stop_server)
+
+    def start_server(self):
+        """Starts a slave server on the port of the transport, which remembers the connections it served."""
+        http.server.ThreadingHTTPServer.allow_reuse_address = True
+        self.server = http.server.ThreadingHTTPServer(('localhost', self.transport.port), TurnRequestHandler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop_server(self):
+        """Stops the slave server, closing its keep-alive connections as an exiting slave would."""
+        for connection in self.server.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.server.shutdown()
+        self.server.server_close()
+
+    def exchange_turn(self, value):
+        return self.loop.run_until_complete(self.transport.exchange_turn(json.dumps({'value': value}).encode('utf8'),
+                                                                         codec.JSON))
+
+    def test_reuses_connection(self):
+        self.assertEqual(self.exchange_turn(1), [1])
+        self.assertEqual(self.exchange_turn(2), [2])
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_waits_for_the_turn_timeout(self):
+        self.assertEqual(self.exchange_turn(1), [1])
+        self.assertEqual(self.transport.conn.sock.gettimeout(), 2 * transports.TIMEOUT)
+
+    def test_reconnects_to_restarted_slave(self):
+        self.assertEqual(self.exchange_turn(1), [1])
+        self.stop_server()
+        self.start_server()
+        self.assertEqual(self.exchange_turn(2), [2])
+        self.assertEqual(len(self.server.connections), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()